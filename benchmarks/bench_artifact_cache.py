@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Compares loading a logged model with mlflow.sklearn.load_model(runs:/...) against loading it
+through the local artifact cache in utils/artifact_cache.py, and checks LRU eviction.
+
+Uses a throwaway file tracking store, or the server in MLFLOW_TRACKING_URI if it is set.
+
+Run with: python benchmarks/bench_artifact_cache.py --loads 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+from sklearn.linear_model import Ridge
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+import mlflow
+import mlflow.sklearn
+
+from bench_data_io import synthetic_split
+from utils.artifact_cache import ArtifactCache
+from utils.feature_encoder import FeatureEncoder
+
+warnings.filterwarnings('ignore')
+
+
+def log_model(X, y):
+    """Fits a Ridge model and logs it to a new run. Returns the run id."""
+    with mlflow.start_run() as run:
+        mlflow.sklearn.log_model(Ridge(alpha=0.1).fit(X, y), artifact_path="model", input_example=X.iloc[:1])
+    return run.info.run_id
+
+
+def ms_per_load(load, run_id, loads):
+    start = time.perf_counter()
+    for _ in range(loads):
+        load(run_id)
+    return (time.perf_counter() - start) / loads * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local model artifact cache")
+    parser.add_argument('--loads', type=int, default=20, help='Number of loads to average')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        if "MLFLOW_TRACKING_URI" not in os.environ:
+            mlflow.set_tracking_uri(f"file:{os.path.join(folder, 'mlruns')}")
+
+        X, y = synthetic_split(10000)
+        encoder = FeatureEncoder.from_frame(X)
+        X = encoder.to_frame(encoder.encode_frame(X))
+        run_id = log_model(X, y)
+
+        cache = ArtifactCache(os.path.join(folder, "cache"))
+
+        start = time.perf_counter()
+        cache.load_model(run_id)
+        cold = (time.perf_counter() - start) * 1000
+
+        direct = ms_per_load(lambda run: mlflow.sklearn.load_model(f"runs:/{run}/model"), run_id, args.loads)
+        warm = ms_per_load(cache.load_model, run_id, args.loads)
+
+        print(f"{'version':<22} {'ms per load':>12}")
+        print(f"{'mlflow runs:/ uri':<22} {direct:>12.1f}")
+        print(f"{'cache, first load':<22} {cold:>12.1f}")
+        print(f"{'cache, cached':<22} {warm:>12.1f}")
+
+        expected = mlflow.sklearn.load_model(f"runs:/{run_id}/model")
+        assert np.array_equal(expected.coef_, cache.load_model(run_id).coef_), "Cached model differs"
+
+        # A cache that fits three runs drops the least recently used one when a fourth is added
+        size_mb = cache.stats()["size_mb"]
+        small = ArtifactCache(os.path.join(folder, "small"), max_mb=size_mb * 3.5)
+        run_ids = [run_id] + [log_model(X, y) for _ in range(2)]
+        for run in run_ids:
+            small.local_path(run)
+            time.sleep(0.01)
+        small.local_path(run_ids[0])
+        small.local_path(log_model(X, y))
+
+        cached = [run for run, _, _ in small.entries()]
+        assert run_ids[1] not in cached and run_ids[0] in cached, f"Unexpected eviction: {cached}"
+        print(f"eviction ok, {small.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Compares the column by column cleaning preprocess.py used to do with the vectorized
+clean_listings in utils/cleaning.py on a large synthetic listing set.
+
+Run with: python benchmarks/bench_cleaning.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from synthetic_listings import UNUSED_COLUMNS, make_listings
+from utils.cleaning import (CATEGORICAL_COLUMNS, INVALID_ZERO_COLUMNS, NUMERICAL_COLUMNS, X_COLUMNS, Y_COLUMN,
+                            clean_listings)
+
+warnings.filterwarnings('ignore')
+
+
+def legacy_clean(df):
+    """The cleaning steps as preprocess.py used to run them."""
+    df = df.drop_duplicates()
+    df = df.drop(columns=UNUSED_COLUMNS + ['listing_id'])
+
+    for col in df.select_dtypes(include='number').columns:
+        Q1 = df[col].quantile(0.25)
+        Q3 = df[col].quantile(0.75)
+        IQR = Q3 - Q1
+        lower_bound = Q1 - 1.5 * IQR
+        upper_bound = Q3 + 1.5 * IQR
+        outliers = df[(df[col] < lower_bound) | (df[col] > upper_bound)]
+
+    def remove_outliers_iqr(df, column):
+        Q1 = df[column].quantile(0.25)
+        Q3 = df[column].quantile(0.75)
+        IQR = Q3 - Q1
+        lower_bound = Q1 - 1.5 * IQR
+        upper_bound = Q3 + 1.5 * IQR
+        return df[(df[column] >= lower_bound) & (df[column] <= upper_bound)]
+
+    df_cleaned = remove_outliers_iqr(df, 'number_price_changes')
+    df_cleaned = remove_outliers_iqr(df, 'wheelbase_from_vin')
+    df = df_cleaned.copy()
+
+    df[INVALID_ZERO_COLUMNS] = df[INVALID_ZERO_COLUMNS].replace(0, np.nan)
+    for col in INVALID_ZERO_COLUMNS:
+        df[col].fillna(df[col].mean(), inplace=True)
+    for col in NUMERICAL_COLUMNS:
+        df[col].fillna(df[col].mean(), inplace=True)
+    for col in CATEGORICAL_COLUMNS:
+        df[col].fillna(df[col].mode()[0], inplace=True)
+    for col in CATEGORICAL_COLUMNS:
+        df = df.astype({col: 'category'})
+
+    df = df.replace({"transmission_from_vin": "6"}, {"transmission_from_vin": "M"})
+    df = df.replace({"transmission_from_vin": "7"}, {"transmission_from_vin": "A"})
+    df['price'] = df['price'].mask(df['price'] < 1000, df['price'].mean())
+    df['msrp'] = df['msrp'].mask(df['msrp'] < 1000, df['msrp'].mean())
+    df['mileage'] = df['mileage'].mask((df['mileage'] < 1000) & (df['stock_type'] == 'USED'), df['mileage'].mean())
+
+    value_counts = df['model'].value_counts()
+    df = df[df['model'].isin(value_counts[value_counts > 3].index)]
+    return df[X_COLUMNS + [Y_COLUMN]]
+
+
+def best_seconds(func, df, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing cleaning")
+    parser.add_argument('--rows', type=int, default=2000000, help='Rows of synthetic listings')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repeats')
+    args = parser.parse_args()
+
+    print(f"Generating {args.rows} synthetic listings")
+    df = make_listings(args.rows)
+
+    legacy = best_seconds(legacy_clean, df, args.repeat)
+    vectorized = best_seconds(clean_listings, df, args.repeat)
+
+    print(f"{'version':<12} {'seconds':>10}")
+    print(f"{'legacy':<12} {legacy:>10.3f}")
+    print(f"{'vectorized':<12} {vectorized:>10.3f}")
+    print(f"speedup {legacy / vectorized:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
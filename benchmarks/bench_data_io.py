@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compares loading and encoding a processed split stored as CSV against Parquet.
+
+Run with: python benchmarks/bench_data_io.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from utils.data_io import load_split, save_splits
+from utils.feature_encoder import FeatureEncoder
+
+MAKES = ['Acura', 'Audi', 'BMW', 'Chevrolet', 'Dodge', 'Ford', 'GMC', 'Honda', 'Hyundai', 'Jeep',
+         'Kia', 'Mazda', 'Nissan', 'Ram', 'Subaru', 'Tesla', 'Toyota', 'Volkswagen', 'Volvo']
+
+
+def synthetic_split(rows, seed=42):
+    """A processed X split and its prices."""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({
+        'make': rng.choice(MAKES, rows),
+        'mileage': np.round(rng.uniform(0, 200000, rows), 1),
+        'model_year': rng.integers(2000, 2024, rows).astype(float),
+        'transmission_from_vin': rng.choice(['A', 'M'], rows),
+        'stock_type': rng.choice(['USED', 'NEW'], rows),
+        'msrp': np.round(rng.uniform(5000, 90000, rows)),
+    })
+    y = pd.Series(np.round(rng.uniform(5000, 90000, rows)), name='price')
+    return X, y
+
+
+def load_and_encode(path):
+    """Loads a split and encodes it the way train.py does."""
+    X = load_split(path)
+    encoder = FeatureEncoder.from_frame(X)
+    return encoder.encode_frame(X)
+
+
+def measure(path):
+    """Seconds to load and encode a split, then its peak traced memory in MB from a second run."""
+    start = time.perf_counter()
+    load_and_encode(path)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    load_and_encode(path)
+    peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark processed split storage formats")
+    parser.add_argument('--rows', type=int, default=1000000, help='Rows in the synthetic split')
+    args = parser.parse_args()
+
+    X, y = synthetic_split(args.rows)
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"{'format':<10} {'file MB':>10} {'load+encode s':>15} {'peak MB':>10}")
+        for data_format in ['csv', 'parquet']:
+            subfolder = os.path.join(folder, data_format)
+            os.makedirs(subfolder)
+            names = save_splits(subfolder, X, y, X.iloc[:0], y.iloc[:0], data_format)
+
+            path = os.path.join(subfolder, names[0])
+            size = os.path.getsize(path) / 1024 ** 2
+            seconds, peak = measure(path)
+            print(f"{data_format:<10} {size:>10.1f} {seconds:>15.3f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Compares evaluating a model on the whole test split in memory with the batched, multi-process
+evaluation in utils/eval_metrics.py, and checks both give the same metrics.
+
+Run with: python benchmarks/bench_evaluate.py --rows 2000000 --workers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.linear_model import Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from bench_data_io import synthetic_split
+from utils.data_io import load_split, save_splits
+from utils.eval_metrics import evaluate_batches
+from utils.feature_encoder import FeatureEncoder
+
+
+def in_memory(model, X_path, y_path):
+    """Loads and encodes the whole split, then scores it the way evaluate.py used to."""
+    X_test = load_split(X_path)
+    y_test = load_split(y_path)
+    encoder = FeatureEncoder.from_model(model)
+    y_pred = model.predict(encoder.to_frame(encoder.encode_frame(X_test)))
+    return {'r2': r2_score(y_test, y_pred), 'mse': mean_squared_error(y_test, y_pred),
+            'mae': mean_absolute_error(y_test, y_pred)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched evaluation")
+    parser.add_argument('--rows', type=int, default=2000000, help='Rows in the synthetic test split')
+    parser.add_argument('--batch_size', type=int, default=100000, help='Rows per batch')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes (0 uses every core)')
+    args = parser.parse_args()
+
+    X, y = synthetic_split(args.rows)
+    y = (X['msrp'] * 0.7 - X['mileage'] * 0.05 + (X['model_year'] - 2000) * 500).round().rename('price')
+
+    encoder = FeatureEncoder.from_frame(X)
+    model = Ridge(alpha=0.1).fit(encoder.to_frame(encoder.encode_frame(X.iloc[:100000])), y.iloc[:100000])
+    y = y + np.random.default_rng(0).normal(0, 3000, len(y))
+
+    with tempfile.TemporaryDirectory() as folder:
+        names = save_splits(folder, X.iloc[:0], y.iloc[:0], X, y, 'parquet')
+        X_path, y_path = os.path.join(folder, names[2]), os.path.join(folder, names[3])
+
+        start = time.perf_counter()
+        expected = in_memory(model, X_path, y_path)
+        memory_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        metrics = evaluate_batches(model, X_path, y_path, args.batch_size, args.workers)
+        batched_seconds = time.perf_counter() - start
+
+    report = metrics.overall()
+    print(f"{'version':<12} {'seconds':>10}")
+    print(f"{'in memory':<12} {memory_seconds:>10.3f}")
+    print(f"{'batched':<12} {batched_seconds:>10.3f}")
+
+    for name, value in expected.items():
+        assert np.isclose(report[name], value, rtol=1e-9), f"{name} differs: {report[name]} vs {value}"
+    assert metrics.breakdown('make')['count'].sum() == len(y), "Make breakdown does not cover every row"
+    print(f"metrics match: r2 {report['r2']:.6f} rmse {report['rmse']:.1f} mae {report['mae']:.1f}")
+    print(metrics.breakdown('make').head().to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compares training Ridge on the whole train split in memory with training it chunk by chunk
+from accumulated X'X and X'y (utils/incremental.py), and checks both give the same model.
+
+Run with: python benchmarks/bench_incremental.py --rows 2000000 --chunksize 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+from sklearn.linear_model import Ridge
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from bench_data_io import synthetic_split
+from utils.data_io import load_split, save_splits
+from utils.feature_encoder import FeatureEncoder
+from utils.incremental import fit_incremental
+
+# One-hot makes and the intercept are collinear, so both solvers warn about conditioning
+warnings.filterwarnings('ignore')
+
+
+def in_memory(X_path, y_path, chunksize):
+    """Loads and encodes the whole split, then fits it the way train.py does."""
+    X_train = load_split(X_path)
+    y_train = load_split(y_path)
+    encoder = FeatureEncoder.from_frame(X_train)
+    X_train = encoder.to_frame(encoder.encode_frame(X_train))
+    return Ridge(alpha=0.1).fit(X_train, y_train)
+
+
+def incremental(X_path, y_path, chunksize):
+    return fit_incremental(X_path, y_path, alpha=0.1, chunksize=chunksize)[0]
+
+
+def measure(func, *args):
+    """The model, seconds taken, then the peak traced memory in MB from a second run."""
+    start = time.perf_counter()
+    model = func(*args)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+
+    return model, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark incremental Ridge training")
+    parser.add_argument('--rows', type=int, default=2000000, help='Rows in the synthetic train split')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows per chunk for incremental training')
+    args = parser.parse_args()
+
+    X, y = synthetic_split(args.rows)
+    # Give the prices a real relation to the features so the coefficients mean something
+    y = (X['msrp'] * 0.7 - X['mileage'] * 0.05 + (X['model_year'] - 2000) * 500).round().rename('price')
+
+    with tempfile.TemporaryDirectory() as folder:
+        names = save_splits(folder, X, y, X.iloc[:0], y.iloc[:0], 'parquet')
+        X_path, y_path = os.path.join(folder, names[0]), os.path.join(folder, names[1])
+
+        print(f"{'version':<12} {'seconds':>10} {'peak MB':>10}")
+        models = {}
+        for name, func in [('in memory', in_memory), ('incremental', incremental)]:
+            models[name], seconds, peak = measure(func, X_path, y_path, args.chunksize)
+            print(f"{name:<12} {seconds:>10.3f} {peak:>10.1f}")
+
+    expected, actual = models['in memory'], models['incremental']
+    assert list(expected.feature_names_in_) == list(actual.feature_names_in_), "Feature order differs"
+    assert expected.coef_.shape == actual.coef_.shape, "Coefficient shapes differ"
+
+    scale = np.abs(expected.coef_).max()
+    difference = np.abs(expected.coef_ - actual.coef_).max() / scale
+    assert difference < 1e-8, f"Coefficients differ by {difference:.2e} of their scale"
+    assert np.allclose(expected.intercept_, actual.intercept_, rtol=1e-8), "Intercepts differ"
+    print(f"models match, max coefficient difference {difference:.2e} of the largest coefficient")
+
+
+if __name__ == "__main__":
+    main()
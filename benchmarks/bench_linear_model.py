@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Checks that the exported .npz linear models predict the same prices as the sklearn models
+they came from, and compares the latency of both serving paths.
+
+Run with: python benchmarks/bench_linear_model.py
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import joblib
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from utils.feature_encoder import FeatureEncoder
+from utils.linear_model import LinearModel, ensure_exported
+
+
+def random_listings(encoder, rows, seed=42):
+    """Synthetic listings using the makes the model knows about."""
+    rng = np.random.default_rng(seed)
+    makes = list(encoder.category_index['make'])
+    return pd.DataFrame({
+        'make': rng.choice(makes, rows),
+        'mileage': rng.uniform(0, 200000, rows),
+        'model_year': rng.integers(2000, 2024, rows),
+        'transmission_from_vin': rng.choice(['A', 'M'], rows),
+        'stock_type': rng.choice(['USED', 'NEW'], rows),
+        'msrp': rng.uniform(5000, 90000, rows),
+    })
+
+
+def best_us(func, number, repeat):
+    """Best time per call in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and latency of the numpy linear model export")
+    parser.add_argument('--model', type=str, default=os.path.join(PROJECT_ROOT, "models", "ridge_model_v2.jlib"), help='sklearn model to export and compare')
+    parser.add_argument('--rows', type=int, default=100000, help='Rows for the parity check and batch timing')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repeats')
+    args = parser.parse_args()
+
+    sk_model = joblib.load(args.model)
+    np_model = LinearModel.load(ensure_exported(args.model))
+    encoder = FeatureEncoder.from_model(np_model)
+
+    X = encoder.encode_frame(random_listings(encoder, args.rows))
+    X_frame = encoder.to_frame(X)
+
+    # Parity against model.predict
+    expected = np.ravel(sk_model.predict(X_frame))
+    actual = np_model.predict(X)
+    max_diff = np.max(np.abs(expected - actual))
+    assert np.allclose(expected, actual, rtol=1e-9, atol=1e-6), f"Predictions differ by up to {max_diff}"
+    print(f"parity: {args.rows} rows, max abs difference {max_diff:.3e}")
+
+    # Latency of one row, the shape of a single api request
+    row = X[:1]
+    row_frame = X_frame.iloc[:1]
+    print(f"{'path':<36} {'1 row (us)':>12} {f'{args.rows} rows (ms)':>18}")
+    paths = {
+        "sklearn predict (DataFrame)": (lambda: sk_model.predict(row_frame), lambda: sk_model.predict(X_frame)),
+        "numpy dot product": (lambda: np_model.predict(row), lambda: np_model.predict(X)),
+    }
+    for name, (single, batch) in paths.items():
+        single_us = best_us(single, 1000, args.repeat)
+        batch_ms = best_us(batch, 1, args.repeat) / 1000
+        print(f"{name:<36} {single_us:>12.2f} {batch_ms:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
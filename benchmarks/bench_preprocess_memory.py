@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compares the peak memory of cleaning a raw listing dump read with pandas' default dtypes (every
+text column as Python strings) against read_raw_listings in utils/cleaning.py, which dictionary
+encodes text columns as they are read and downcasts the other numeric columns. Each way runs in
+its own process so the peak resident memory of one does not hide the other.
+
+Run with: python benchmarks/bench_preprocess_memory.py --rows 2000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+warnings.filterwarnings('ignore')
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB. ru_maxrss would carry over the peak of the parent
+    that forked it, VmHWM starts again when the process image is replaced.
+    """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(mode, file_path):
+    """Reads and cleans the dump one way and returns the time, frame size and peak memory."""
+    import pandas as pd
+    from utils.cleaning import clean_listings, read_raw_listings
+
+    start = time.perf_counter()
+    df = pd.read_csv(file_path) if mode == 'default' else read_raw_listings(file_path)
+    read_seconds = time.perf_counter() - start
+    frame_mb = df.memory_usage(deep=True).sum() / 1e6
+
+    cleaned = clean_listings(df)
+
+    return {
+        'mode': mode,
+        'rows_cleaned': len(cleaned),
+        'read_seconds': read_seconds,
+        'total_seconds': time.perf_counter() - start,
+        'frame_mb': frame_mb,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark peak memory of reading and cleaning listings")
+    parser.add_argument('--rows', type=int, default=2000000, help='Rows of synthetic listings')
+    parser.add_argument('--measure', nargs=2, metavar=('MODE', 'FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(*args.measure)))
+        return
+
+    from synthetic_listings import make_listings
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = os.path.join(folder, 'CBB_Listings.csv')
+        print(f"Writing {args.rows} synthetic listings")
+        make_listings(args.rows).to_csv(file_path, index=False)
+
+        results = []
+        for mode in ('default', 'compact'):
+            output = subprocess.run([sys.executable, __file__, '--measure', mode, file_path],
+                                    capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'read':<10} {'frame MB':>10} {'peak MB':>10} {'read s':>8} {'total s':>8} {'rows':>10}")
+    for result in results:
+        print(f"{result['mode']:<10} {result['frame_mb']:>10.1f} {result['peak_rss_mb']:>10.1f} "
+              f"{result['read_seconds']:>8.2f} {result['total_seconds']:>8.2f} {result['rows_cleaned']:>10}")
+    print(f"peak memory reduced {results[0]['peak_rss_mb'] / results[1]['peak_rss_mb']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
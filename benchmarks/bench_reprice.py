@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Compares re-pricing a listing dump one listing at a time through predict() in predict_api.py
+with the chunked, multi-process job in utils/repricing.py, and checks both give the same prices.
+
+Run with: python benchmarks/bench_reprice.py --rows 1000000 --workers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from synthetic_listings import make_listings
+from utils.cleaning import X_COLUMNS, clean_listings
+from utils.model_registry import default_registry
+from utils.repricing import reprice, scoring_fill_values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk re-pricing")
+    parser.add_argument('--rows', type=int, default=500000, help='Listings in the synthetic dump')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows per chunk')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes (0 uses every core)')
+    parser.add_argument('--versions', type=str, nargs='+', default=['v1', 'v2'], help='Model versions to price with')
+    parser.add_argument('--single', type=int, default=5000, help='Listings priced one at a time through predict()')
+    args = parser.parse_args()
+
+    from predict_api import predict
+
+    registry = default_registry()
+    models = {version: registry.get(version) for version in args.versions}
+    scorers = {version: registry.get_with_encoder(version) for version in args.versions}
+
+    dump = make_listings(args.rows, missing_rate=0.0)
+    values = scoring_fill_values(clean_listings(dump)[X_COLUMNS])
+
+    with tempfile.TemporaryDirectory() as folder:
+        input_path = os.path.join(folder, 'CBB_Listings.csv')
+        dump.to_csv(input_path, index=False)
+
+        # The api path, every listing and version is one predict() call
+        sample = dump.iloc[:args.single]
+        start = time.perf_counter()
+        expected = {version: [predict(row.stock_type, row.mileage, row.msrp, row.model_year, row.make,
+                                      str(row.transmission_from_vin), model, encoder)
+                              for row in sample.itertuples()]
+                    for version, (model, encoder) in scorers.items()}
+        single_rate = len(sample) / (time.perf_counter() - start)
+        print(f"predict() one listing at a time: {single_rate:.0f} rows/sec")
+
+        for workers in sorted({1, args.workers or os.cpu_count() or 1}):
+            output_path = os.path.join(folder, 'prices.parquet')
+            summary = reprice(input_path, output_path, models, values, args.chunksize, workers)
+            print(f"reprice with {workers} workers: {summary['rows_per_second']:.0f} rows/sec "
+                  f"({summary['rows']} rows in {summary['seconds']:.2f}s, {summary['rows_per_second'] / single_rate:.0f}x)")
+
+        prices = pd.read_parquet(output_path).iloc[:args.single]
+
+        # Listings the cleaning changes (zeros, low values, transmission codes) are priced differently by predict()
+        clean = ((sample['mileage'] >= 1000) | (sample['stock_type'] != 'USED')) & (sample['mileage'] != 0) & \
+            (sample['msrp'] >= 1000) & sample['transmission_from_vin'].isin(['A', 'M'])
+        for version in args.versions:
+            difference = np.abs(prices[f'price_{version}'].to_numpy() - np.array(expected[version]))[clean.to_numpy()]
+            print(f"{version}: max price difference to predict() {difference.max():.2e} on {clean.sum()} listings")
+
+
+if __name__ == "__main__":
+    main()
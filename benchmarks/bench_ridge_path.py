@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Compares scanning alphas with one Ridge fit per alpha against solving the whole
+regularization path at once with utils/ridge_path.py, and checks both give the same scores.
+
+Run with: python benchmarks/bench_ridge_path.py --rows 1000000 --alphas 100
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.linear_model import Ridge
+from sklearn.metrics import r2_score
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from bench_sweep import synthetic_matrix
+from utils.ridge_path import alpha_grid, path_scores, ridge_path
+
+
+def per_alpha(X_fit, y_fit, X_val, y_val, alphas):
+    """Validation r2 of one independent fit per alpha."""
+    return np.array([r2_score(y_val, Ridge(alpha=alpha).fit(X_fit, y_fit).predict(X_val)) for alpha in alphas])
+
+
+def path(X_fit, y_fit, X_val, y_val, alphas):
+    """Validation r2 of every alpha from one decomposition."""
+    coefs, intercepts = ridge_path(X_fit, y_fit, alphas)
+    return path_scores(X_val, y_val, coefs, intercepts)['val_r2']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Ridge regularization path")
+    parser.add_argument('--rows', type=int, default=1000000, help='Rows in the synthetic training matrix')
+    parser.add_argument('--alphas', type=int, default=100, help='Number of alphas to scan')
+    args = parser.parse_args()
+
+    X, y = synthetic_matrix(args.rows)
+    n_fit = int(len(X) * 0.8)
+    data = (X[:n_fit], y[:n_fit], X[n_fit:], y[n_fit:])
+    alphas = alpha_grid(0.001, 1000.0, args.alphas)
+
+    results = {}
+    print(f"{'version':<12} {'seconds':>10}")
+    for name, func in [('per alpha', per_alpha), ('path', path)]:
+        start = time.perf_counter()
+        results[name] = func(*data, alphas)
+        print(f"{name:<12} {time.perf_counter() - start:>10.3f}")
+
+    assert np.allclose(results['per alpha'], results['path'], rtol=0, atol=1e-9), "Path scores differ from per alpha fits"
+    print(f"scores match, best alpha {alphas[np.argmax(results['path'])]:.4g}")
+
+
+if __name__ == "__main__":
+    main()
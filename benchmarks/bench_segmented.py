@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compares the global Ridge with the segmented per-make bundle of utils/segmented.py on
+synthetic listings where every make depreciates at its own rate: validation r2, fit time
+and the time to price single listings and batches.
+
+Run with: python benchmarks/bench_segmented.py --rows 500000 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from synthetic_listings import MAKE_WEIGHTS
+from utils.linear_model import LinearModel
+from utils.segmented import fit_segmented
+
+
+def synthetic_matrix(rows, seed=42):
+    """An encoded matrix with one-hot makes and prices that depreciate at a different rate for every make."""
+    rng = np.random.default_rng(seed)
+    makes = np.array(list(MAKE_WEIGHTS))
+    weights = np.array(list(MAKE_WEIGHTS.values()))
+    make = rng.choice(len(makes), rows, p=weights / weights.sum())
+
+    feature_names = ['mileage', 'model_year', 'msrp', 'transmission_from_vin_M', 'stock_type_USED']
+    feature_names += [f"make_{name}" for name in makes]
+
+    X = np.zeros((rows, len(feature_names)))
+    X[:, 0] = rng.gamma(2.0, 30000, rows)
+    X[:, 1] = rng.integers(2005, 2025, rows)
+    X[:, 2] = rng.lognormal(10.6, 0.4, rows)
+    X[:, 3] = rng.random(rows) < 0.05
+    X[:, 4] = rng.random(rows) < 0.9
+    X[np.arange(rows), 5 + make] = 1.0
+
+    depreciation = rng.uniform(0.03, 0.15, len(makes))[make]
+    y = X[:, 2] * np.exp(-depreciation * (2025 - X[:, 1])) - X[:, 0] * 0.05 + rng.normal(0, 2000, rows)
+    return X, y, feature_names, makes[make]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--min_rows', type=int, default=500)
+    parser.add_argument('--single', type=int, default=20000, help='Listings priced one at a time')
+    args = parser.parse_args()
+
+    X, y, feature_names, makes = synthetic_matrix(args.rows)
+    params = {'alpha': 0.1, 'fit_intercept': True, 'solver': 'auto'}
+
+    for workers in sorted({1, args.workers or os.cpu_count() or 1}):
+        start = time.perf_counter()
+        model, segments, metrics = fit_segmented(X, y, feature_names, params, args.min_rows, workers=workers)
+        print(f"fit with {workers} workers: {time.perf_counter() - start:.2f}s for {len(segments)} segments "
+              f"and the global model, twice (hold out and all rows)")
+
+    print(f"val r2 global {metrics['val_r2_global']:.4f}  segmented {metrics['val_r2_segmented']:.4f}  "
+          f"({metrics['global_rows']} of {len(X)} rows on the global model)")
+
+    global_model = LinearModel(model.coef_, model.intercept_, feature_names)
+    n = min(args.single, len(X))
+
+    start = time.perf_counter()
+    for i in range(n):
+        global_model.predict(X[i:i + 1])
+    global_single = (time.perf_counter() - start) / n * 1e6
+
+    start = time.perf_counter()
+    for i in range(n):
+        model.predict(X[i:i + 1], [makes[i]])
+    segmented_single = (time.perf_counter() - start) / n * 1e6
+
+    start = time.perf_counter()
+    global_model.predict(X)
+    global_batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.predict(X)
+    segmented_batch = time.perf_counter() - start
+
+    print(f"single listing: global {global_single:.1f} us  segmented {segmented_single:.1f} us")
+    print(f"batch of {len(X)}: global {global_batch * 1000:.1f} ms  segmented {segmented_batch * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
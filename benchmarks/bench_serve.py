@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Throughput of src/serve.py as the number of worker processes grows, and how much of each
+worker's memory is shared with the other workers.
+
+Starts the launcher with every worker count in turn, runs the load test from load_test_api.py
+against it and prints requests/s, the speedup over one worker and the private and shared memory
+of the workers (read from /proc, so memory is only reported on Linux).
+
+Run with: python benchmarks/bench_serve.py --workers 1 2 4 8 --requests 4000 --concurrency 64
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from http.client import HTTPConnection
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+from load_test_api import load_test
+
+
+def wait_until_up(port, timeout=60.0):
+    """Polls /health_status until the api answers."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health_status")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"The api did not start on port {port}")
+
+
+def worker_memory_mb(parent_pid):
+    """Sum of private and shared resident memory in MB over the workers of the launcher."""
+    try:
+        with open(f"/proc/{parent_pid}/task/{parent_pid}/children") as file:
+            pids = file.read().split()
+    except OSError:
+        return None
+
+    private = shared = 0
+    for pid in pids:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                name, _, value = line.partition(":")
+                if name.startswith("Private_"):
+                    private += int(value.split()[0])
+                elif name.startswith("Shared_"):
+                    shared += int(value.split()[0])
+    return private / 1024, shared / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serve.py with a growing number of workers")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Worker counts to run')
+    parser.add_argument('--requests', type=int, default=4000, help='Requests per run')
+    parser.add_argument('--concurrency', type=int, default=64, help='Requests in flight at once')
+    parser.add_argument('--version', type=str, default='v2', help='Model version to predict with')
+    parser.add_argument('--port', type=int, default=9997, help='Port to run the launcher on')
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.requests} requests with {args.concurrency} in flight")
+    print(f"{'workers':>8} {'req/s':>8} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} {'private MB':>11} {'shared MB':>10}")
+
+    baseline = None
+    for workers in args.workers:
+        server = subprocess.Popen([sys.executable, os.path.join(PROJECT_ROOT, "src", "serve.py"),
+                                   "--workers", str(workers), "--port", str(args.port)],
+                                  cwd=os.path.join(PROJECT_ROOT, "src"),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(args.port)
+            result = load_test(f"http://127.0.0.1:{args.port}", args.version, args.requests, args.concurrency)
+            memory = worker_memory_mb(server.pid)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(30)
+
+        if result["errors"]:
+            raise SystemExit(f"{len(result['errors'])} requests failed, first: {result['errors'][0]}")
+
+        baseline = baseline or result["throughput"]
+        private, shared = memory if memory else (float("nan"), float("nan"))
+        print(f"{workers:>8} {result['throughput']:>8.0f} {result['throughput'] / baseline:>8.2f} "
+              f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {private:>11.1f} {shared:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+End to end benchmark of the pipeline stages on synthetic CBB_Listings data.
+
+Generates raw listings with synthetic_listings.py, then runs preprocess, train, evaluate and
+predict one after the other, each in a fresh Python process so its time, CPU time and peak
+memory are its own. MLflow logs to a file store in the work folder, so no tracking server or
+network is needed. Results are written as JSON, named after the current commit, and two result
+files can be compared to see which stages got faster or slower.
+
+Run with: python benchmarks/bench_suite.py --rows 200000
+Compare:  python benchmarks/bench_suite.py --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+
+STAGES = ['generate', 'preprocess', 'train', 'evaluate', 'predict']
+
+def raw_path(workdir):
+    return os.path.join(workdir, "raw", "CBB_Listings.csv")
+
+
+def split_paths(workdir, data_format):
+    """Paths of X_train, y_train, X_test and y_test in the work folder."""
+    from preprocess import split_paths as processed_paths
+
+    return processed_paths(data_format, os.path.join(workdir, "processed"))
+
+
+def read_run_id(workdir):
+    path = os.path.join(workdir, "run_id.txt")
+    if not os.path.exists(path):
+        raise RuntimeError("The train stage has to run before evaluate and predict")
+    with open(path) as file:
+        return file.read().strip()
+
+
+def stage_generate(args):
+    from synthetic_listings import make_listings
+
+    os.makedirs(os.path.dirname(raw_path(args.workdir)), exist_ok=True)
+    make_weights = json.loads(args.make_weights) if args.make_weights else None
+
+    df = make_listings(args.rows, args.seed, make_weights, args.missing_rate)
+    df.to_csv(raw_path(args.workdir), index=False)
+    return {"raw_rows": len(df), "raw_mb": os.path.getsize(raw_path(args.workdir)) / 1024 ** 2}
+
+
+def stage_preprocess(args):
+    from utils.cleaning import clean_and_split
+
+    folder = os.path.join(args.workdir, "processed")
+    os.makedirs(folder, exist_ok=True)
+
+    summary = clean_and_split(raw_path(args.workdir), folder, args.chunksize, args.data_format)
+    return {"train_rows": summary['rows_train'], "test_rows": summary['rows_test']}
+
+
+def stage_train(args):
+    from preprocess import train_model
+    from utils.arg_parser import get_input_args
+
+    os.makedirs(os.environ["MODEL_EXPORT_DIR"], exist_ok=True)
+    run_id = train_model(get_input_args([]), split_paths(args.workdir, args.data_format))
+
+    with open(os.path.join(args.workdir, "run_id.txt"), "w") as file:
+        file.write(run_id)
+    return {"run_id": run_id}
+
+
+def stage_evaluate(args):
+    import mlflow
+    from preprocess import evaluate_model
+    from utils.arg_parser import get_input_args
+
+    run_id = read_run_id(args.workdir)
+    evaluate_model(get_input_args([]), split_paths(args.workdir, args.data_format), run_id)
+
+    metrics = mlflow.get_run(run_id).data.metrics
+    return {"test_r2": metrics.get("test_r2"), "test_rmse": metrics.get("test_rmse")}
+
+
+def stage_predict(args):
+    """Latency of predict_api.predict on single test listings and throughput of predict_batch."""
+    from predict_api import predict, predict_batch
+    from utils.artifact_cache import default_cache
+    from utils.data_io import load_split
+    from utils.feature_encoder import FeatureEncoder
+
+    model = default_cache().load_model(read_run_id(args.workdir))
+    encoder = FeatureEncoder.from_model(model)
+
+    _, _, X_test_path, _ = split_paths(args.workdir, args.data_format)
+    listings = load_split(X_test_path).head(args.predict_rows).to_dict(orient='records')
+
+    latencies = []
+    for listing in listings[:args.predict_calls]:
+        start = time.perf_counter()
+        predict(listing['stock_type'], listing['mileage'], listing['msrp'], listing['model_year'], listing['make'],
+                listing['transmission_from_vin'], model, encoder)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    predict_batch(listings, model, encoder)
+    batch_seconds = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "single_calls": len(latencies),
+        "single_p50_ms": float(np.percentile(latencies, 50)),
+        "single_p99_ms": float(np.percentile(latencies, 99)),
+        "batch_rows": len(listings),
+        "batch_rows_per_second": len(listings) / batch_seconds,
+    }
+
+
+def run_stage(args):
+    """Runs one stage in this process and writes its timings to args.result_file."""
+    stage = globals()[f"stage_{args.stage}"]
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    details = stage(args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    # Worker processes of the stage (evaluation batches, sweeps) add their CPU time and peak memory
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {
+        "seconds": wall,
+        "cpu_seconds": cpu + children.ru_utime + children.ru_stime,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children_peak_rss_mb": children.ru_maxrss / 1024,
+        "details": details,
+    }
+    with open(args.result_file, "w") as file:
+        json.dump(result, file)
+
+
+def spawn_stage(stage, args, env):
+    """Runs a stage in a new Python process and returns its result."""
+    result_file = os.path.join(args.workdir, f"{stage}.json")
+    command = [sys.executable, os.path.abspath(__file__), "--stage", stage, "--result_file", result_file,
+               "--workdir", args.workdir, "--rows", str(args.rows), "--seed", str(args.seed),
+               "--missing_rate", str(args.missing_rate), "--chunksize", str(args.chunksize),
+               "--data_format", args.data_format, "--predict_rows", str(args.predict_rows),
+               "--predict_calls", str(args.predict_calls)]
+    if args.make_weights:
+        command += ["--make_weights", args.make_weights]
+
+    log_path = os.path.join(args.workdir, f"{stage}.log")
+    with open(log_path, "w") as log:
+        completed = subprocess.run(command, env=env, cwd=args.workdir, stdout=log, stderr=subprocess.STDOUT)
+    if completed.returncode != 0:
+        raise SystemExit(f"Stage {stage} failed, see {log_path}")
+
+    with open(result_file) as file:
+        return json.load(file)
+
+
+def git_commit():
+    """Short hash of the checked out commit, with -dirty if there are local changes."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_suite(args):
+    env = dict(os.environ,
+               MLFLOW_TRACKING_URI=f"file:{os.path.join(args.workdir, 'mlruns')}",
+               MODEL_CACHE_DIR=os.path.join(args.workdir, "model_cache"),
+               MODEL_EXPORT_DIR=os.path.join(args.workdir, "models"),
+               PYTHONPATH=os.pathsep.join([os.path.join(PROJECT_ROOT, "src"), os.path.dirname(os.path.abspath(__file__))]))
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {name: getattr(args, name) for name in
+                   ['rows', 'seed', 'missing_rate', 'make_weights', 'chunksize', 'data_format', 'repeat',
+                    'predict_rows', 'predict_calls']},
+        "stages": {},
+    }
+
+    print(f"{args.rows} rows in {args.workdir}")
+    print(f"{'stage':<12} {'seconds':>9} {'cpu s':>9} {'peak MB':>9}")
+    for stage in args.stages:
+        # Keep the fastest of the repeats, generating the data once is enough
+        runs = [spawn_stage(stage, args, env) for _ in range(1 if stage == 'generate' else args.repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        best["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+        results["stages"][stage] = best
+        print(f"{stage:<12} {best['seconds']:>9.2f} {best['cpu_seconds']:>9.2f} {best['peak_rss_mb']:>9.1f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}-{args.rows}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+
+
+def compare(base_path, new_path, threshold):
+    """Prints the change of every stage between two result files. Returns True if any stage got slower."""
+    with open(base_path) as file:
+        base = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+
+    settings = [{name: value for name, value in run["config"].items() if name != 'repeat'} for run in (base, new)]
+    if settings[0] != settings[1]:
+        print(f"Warning: the runs used different settings\n  {base['config']}\n  {new['config']}")
+
+    print(f"{base['commit']} -> {new['commit']}")
+    print(f"{'stage':<12} {'seconds':>19} {'change':>8} {'peak MB':>19} {'change':>8}")
+
+    regressed = False
+    for stage in new["stages"]:
+        if stage not in base["stages"]:
+            continue
+        old_stage, new_stage = base["stages"][stage], new["stages"][stage]
+        time_change = (new_stage["seconds"] / old_stage["seconds"] - 1) * 100
+        memory_change = (new_stage["peak_rss_mb"] / old_stage["peak_rss_mb"] - 1) * 100
+
+        flag = ""
+        if stage != 'generate' and (time_change > threshold or memory_change > threshold):
+            flag = "  slower" if time_change > threshold else "  more memory"
+            regressed = True
+
+        print(f"{stage:<12} {old_stage['seconds']:>9.2f} {new_stage['seconds']:>9.2f} {time_change:>+7.1f}% "
+              f"{old_stage['peak_rss_mb']:>9.1f} {new_stage['peak_rss_mb']:>9.1f} {memory_change:>+7.1f}%{flag}")
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic listings")
+    parser.add_argument('--rows', type=int, default=200000, help='Raw listings to generate')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the generated listings')
+    parser.add_argument('--missing_rate', type=float, default=0.02, help='Share of missing values per column')
+    parser.add_argument('--make_weights', type=str, default=None,
+                        help='JSON object of make -> relative frequency, e.g. \'{"Ford": 3, "Kia": 1}\'')
+    parser.add_argument('--chunksize', type=int, default=0, help='Preprocess in chunks of this many rows (0 in memory)')
+    parser.add_argument('--data_format', type=str, default='parquet', choices=['parquet', 'csv'])
+    parser.add_argument('--predict_rows', type=int, default=10000, help='Test listings sent to predict_batch')
+    parser.add_argument('--predict_calls', type=int, default=1000, help='Single predict calls timed')
+    parser.add_argument('--stages', type=str, nargs='+', default=STAGES, choices=STAGES, help='Stages to run')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs of every stage, the fastest is kept')
+    parser.add_argument('--workdir', type=str, default=None, help='Folder for data and mlruns (a temporary one by default)')
+    parser.add_argument('--output', type=str, default=None, help='Results file (benchmarks/results/<commit>-<rows>.json)')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BASE', 'NEW'), help='Compare two results files')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent change reported as a regression')
+    parser.add_argument('--stage', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result_file', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    if args.stage:
+        run_stage(args)
+        return
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        args.workdir = os.path.abspath(args.workdir)
+        run_suite(args)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            args.workdir = workdir
+            run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Compares fitting the sweep candidates one after the other with fitting them in the
+shared memory process pool of utils/sweep.py.
+
+Run with: python benchmarks/bench_sweep.py --rows 500000 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.linear_model import Ridge
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+
+from utils.arg_parser import load_config
+from utils.sweep import run_sweep, sweep_candidates
+
+
+def synthetic_matrix(rows, n_makes=40, seed=42):
+    """An encoded training matrix shaped like the real one: three numeric columns and one-hot makes."""
+    rng = np.random.default_rng(seed)
+    X = np.zeros((rows, 5 + n_makes + 1))
+    X[:, 0] = rng.gamma(2.0, 30000, rows)
+    X[:, 1] = rng.integers(2005, 2025, rows)
+    X[:, 2] = rng.lognormal(10.6, 0.4, rows)
+    X[:, 3] = rng.random(rows) < 0.9
+    X[:, 4] = rng.random(rows) < 0.8
+    X[np.arange(rows), 5 + rng.integers(0, n_makes + 1, rows)] = 1.0
+    X = X[:, :-1]
+
+    coef = rng.normal(0, 1000, X.shape[1])
+    coef[:3] = [-0.05, 800, 0.6]
+    y = X @ coef + rng.normal(0, 2000, rows)
+    return X, y
+
+
+def sequential(X, y, candidates, validation_size=0.2):
+    """Every candidate fitted in this process on a copy of the fit rows."""
+    n_fit = len(X) - int(round(len(X) * validation_size))
+    order = np.random.default_rng(42).permutation(len(X))
+    X, y = X[order], y[order]
+    for params in candidates:
+        Ridge(**params).fit(X[:n_fit], y[:n_fit]).predict(X[n_fit:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hyperparameter sweep")
+    parser.add_argument('--rows', type=int, default=500000, help='Rows in the synthetic training matrix')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes (0 uses every core)')
+    args = parser.parse_args()
+
+    X, y = synthetic_matrix(args.rows)
+    candidates = sweep_candidates(load_config()['sweep']['space'])
+    print(f"{len(candidates)} candidates on a {X.shape[0]} x {X.shape[1]} matrix, {os.cpu_count()} cores")
+
+    start = time.perf_counter()
+    sequential(X, y, candidates)
+    serial_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = run_sweep(X, y, candidates, workers=args.workers)
+    pool_seconds = time.perf_counter() - start
+
+    print(f"{'version':<12} {'seconds':>10}")
+    print(f"{'sequential':<12} {serial_seconds:>10.3f}")
+    print(f"{'pool':<12} {pool_seconds:>10.3f}")
+    print(f"speedup {serial_seconds / pool_seconds:.1f}x")
+    print(f"best {results[0]['params']} val_r2={results[0]['metrics']['val_r2']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
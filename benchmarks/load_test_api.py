@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Load test for the single listing predict endpoints of a running predict_api.py.
+
+Sends the example listing from many threads at once and reports throughput and latency
+percentiles. Run it against the api started with and without MICRO_BATCH=1 to compare.
+
+Run with: python benchmarks/load_test_api.py --requests 2000 --concurrency 32
+"""
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from threading import local
+from urllib.parse import urlparse
+
+EXAMPLE_LISTING = {
+    "stock_type": "USED",
+    "mileage": 543.0,
+    "msrp": 20,
+    "model_year": 2023,
+    "make": "Alfa Romeo",
+    "transmission_from_vin": "M"
+}
+
+
+def percentile(values, q):
+    """q-th percentile of sorted values."""
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def load_test(url, version='v2', requests=2000, concurrency=32):
+    """
+    Sends requests copies of the example listing with concurrency in flight at once.
+    Returns the throughput, latency percentiles in ms, errors and the distinct prices returned.
+    """
+    address = urlparse(url)
+    path = f"/{version}/predict"
+    body = json.dumps(EXAMPLE_LISTING)
+    headers = {"Content-Type": "application/json"}
+    connections = local()
+
+    def send(_):
+        # Every thread keeps its own connection open between requests
+        if not hasattr(connections, 'conn'):
+            connections.conn = HTTPConnection(address.hostname, address.port)
+        start = time.perf_counter()
+        try:
+            connections.conn.request("POST", path, body, headers)
+            response = json.loads(connections.conn.getresponse().read())
+        except (OSError, ValueError) as e:
+            connections.conn.close()
+            del connections.conn
+            return time.perf_counter() - start, None, str(e)
+        return time.perf_counter() - start, response.get("price_predicted"), response.get("error")
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(send, range(concurrency)))  # warm up the connections and the model
+
+        start = time.perf_counter()
+        results = list(pool.map(send, range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _, _ in results)
+    return {
+        "path": path,
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "throughput": requests / elapsed,
+        "mean_ms": statistics.mean(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "errors": [error for _, _, error in results if error is not None],
+        "prices": {price for _, price, error in results if error is None},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the predict endpoints")
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:9999', help='Address of the running api')
+    parser.add_argument('--version', type=str, default='v2', help='Model version to predict with')
+    parser.add_argument('--requests', type=int, default=2000, help='Number of requests to send')
+    parser.add_argument('--concurrency', type=int, default=32, help='Number of requests in flight at once')
+    args = parser.parse_args()
+
+    result = load_test(args.url, args.version, args.requests, args.concurrency)
+    errors, prices = result["errors"], result["prices"]
+
+    print(f"{result['requests']} requests to {result['path']} with {result['concurrency']} in flight in {result['seconds']:.2f} s")
+    print(f"throughput: {result['throughput']:.0f} requests/s")
+    print(f"latency ms: mean {result['mean_ms']:.2f} p50 {result['p50_ms']:.2f} "
+          f"p90 {result['p90_ms']:.2f} p99 {result['p99_ms']:.2f}")
+    print(f"errors: {len(errors)}" + (f" (first: {errors[0]})" if errors else ""))
+
+    # Every request predicts the same listing, so batching must not change the price
+    if len(prices) > 1:
+        raise SystemExit(f"Got {len(prices)} different prices for the same listing: {sorted(prices)[:5]}")
+
+
+if __name__ == "__main__":
+    main()
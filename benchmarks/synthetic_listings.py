@@ -0,0 +1,90 @@
+"""
+Generates synthetic listings with the same columns as CBB_Listings.csv for benchmarks.
+"""
+import numpy as np
+import pandas as pd
+
+# Makes and how common they are, roughly like the real listing dump
+MAKE_WEIGHTS = {
+    'Acura': 1.5, 'Alfa Romeo': 0.3, 'Audi': 2.0, 'BMW': 2.5, 'Buick': 1.5, 'Cadillac': 1.2, 'Chevrolet': 9.0,
+    'Chrysler': 1.5, 'Dodge': 4.0, 'Fiat': 0.3, 'Ford': 11.0, 'GMC': 5.0, 'Genesis': 0.5, 'Honda': 6.0,
+    'Hyundai': 6.0, 'Infiniti': 0.8, 'Jaguar': 0.4, 'Jeep': 5.0, 'Kia': 5.0, 'Land Rover': 0.6, 'Lexus': 1.5,
+    'Lincoln': 1.0, 'Maserati': 0.2, 'Mazda': 3.5, 'Mercedes-Benz': 2.5, 'Mini': 0.6, 'Mitsubishi': 1.2,
+    'Nissan': 5.0, 'Polestar': 0.1, 'Pontiac': 0.2, 'Porsche': 0.5, 'Ram': 4.5, 'Rivian': 0.1, 'Scion': 0.1,
+    'Smart': 0.1, 'Subaru': 2.5, 'Suzuki': 0.1, 'Tesla': 0.8, 'Toyota': 8.0, 'Volkswagen': 3.0, 'Volvo': 1.0,
+}
+
+# Columns that preprocessing drops straight away
+UNUSED_COLUMNS = ['has_leather', 'has_navigation', 'listing_heading', 'listing_type', 'listing_url',
+                  'listing_first_date', 'days_on_market', 'dealer_id', 'dealer_name', 'dealer_street', 'dealer_city',
+                  'dealer_province', 'dealer_postal_code', 'dealer_url', 'dealer_email', 'dealer_phone', 'dealer_type',
+                  'vehicle_id', 'uvc', 'price_analysis', 'price_history_delimited', 'distance_to_dealer',
+                  'location_score', 'listing_dropoff_date', 'certified']
+
+# Columns that get missing values
+MISSING_COLUMNS = ['stock_type', 'make', 'model', 'series', 'style', 'exterior_color', 'exterior_color_category',
+                   'interior_color', 'interior_color_category', 'drivetrain_from_vin', 'engine_from_vin',
+                   'transmission_from_vin', 'fuel_type_from_vin', 'mileage', 'price', 'msrp', 'model_year',
+                   'wheelbase_from_vin', 'number_price_changes']
+
+COLORS = ['Black', 'White', 'Grey', 'Silver', 'Blue', 'Red', 'Green', 'Brown']
+
+
+def make_listings(rows, seed=42, make_weights=None, missing_rate=0.02, zero_rate=0.01, duplicate_rate=0.01):
+    """
+    Builds a DataFrame of raw listings.
+
+    make_weights maps make -> relative frequency (defaults to MAKE_WEIGHTS), missing_rate is the
+    share of missing values in every column of MISSING_COLUMNS, zero_rate the share of invalid
+    zeros in mileage, price and msrp, and duplicate_rate the share of rows repeated at the end.
+    """
+    rng = np.random.default_rng(seed)
+    make_weights = make_weights or MAKE_WEIGHTS
+
+    makes = np.array(list(make_weights))
+    weights = np.array(list(make_weights.values()), dtype=np.float64)
+    make = rng.choice(makes, rows, p=weights / weights.sum())
+
+    model_year = rng.integers(2005, 2025, rows).astype(np.float64)
+    stock_type = np.where(model_year >= 2024, 'NEW', np.where(rng.random(rows) < 0.1, 'NEW', 'USED'))
+    mileage = np.where(stock_type == 'NEW', rng.uniform(0, 500, rows), rng.gamma(2.0, 30000, rows)).round(1)
+    msrp = rng.lognormal(10.6, 0.4, rows).round()
+    price = (msrp * np.exp(-0.08 * (2025 - model_year)) - mileage * 0.05 + rng.normal(0, 2000, rows)).clip(500).round()
+
+    df = pd.DataFrame({
+        'listing_id': np.arange(rows),
+        'stock_type': stock_type,
+        'vin': np.char.add('VIN', np.arange(rows).astype(str)),
+        'make': make,
+        'model': np.char.add(make.astype(str), rng.integers(0, 12, rows).astype(str)),
+        'series': rng.choice(['Base', 'Sport', 'Limited', 'Touring'], rows),
+        'style': rng.choice(['Sedan', 'SUV', 'Truck', 'Hatchback', 'Coupe'], rows),
+        'exterior_color': rng.choice(COLORS, rows),
+        'exterior_color_category': rng.choice(COLORS, rows),
+        'interior_color': rng.choice(COLORS[:4], rows),
+        'interior_color_category': rng.choice(COLORS[:4], rows),
+        'drivetrain_from_vin': rng.choice(['FWD', 'AWD', 'RWD', '4WD'], rows),
+        'engine_from_vin': rng.choice(['I4', 'V6', 'V8', 'Electric'], rows),
+        'transmission_from_vin': rng.choice(['A', 'M', '6', '7'], rows, p=[0.8, 0.05, 0.05, 0.1]),
+        'fuel_type_from_vin': rng.choice(['Gasoline', 'Diesel', 'Electric', 'Hybrid'], rows, p=[0.85, 0.05, 0.05, 0.05]),
+        'mileage': mileage,
+        'price': price,
+        'msrp': msrp,
+        'model_year': model_year,
+        'wheelbase_from_vin': rng.normal(112, 8, rows).round(1),
+        'number_price_changes': rng.poisson(2, rows).astype(np.float64),
+    })
+
+    # Dropped columns are small integers to keep the generated frame light
+    for column in UNUSED_COLUMNS:
+        df[column] = rng.integers(0, 100, rows)
+
+    # Invalid zeros and missing values
+    for column in ['mileage', 'price', 'msrp']:
+        df.loc[rng.random(rows) < zero_rate, column] = 0.0
+    for column in MISSING_COLUMNS:
+        df.loc[rng.random(rows) < missing_rate, column] = np.nan
+
+    # Exact duplicate rows
+    duplicates = df.sample(frac=duplicate_rate, random_state=seed)
+    return pd.concat([df, duplicates], ignore_index=True)
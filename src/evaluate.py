@@ -1,57 +1,62 @@
 #!/usr/bin/env python3
+"""
+File should run through metrics to calculate how well the model is performing against test data.
+"""
 
 import logging
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+from utils.artifact_cache import default_cache
+from utils.eval_metrics import GROUP_COLUMNS, evaluate_batches
+from utils.feature_encoder import encoder_for_model
+from utils.profiling import stage
 
-"""
-File should run through metrics to calculate how well the model is performing against test data.
-"""
-from sklearn.metrics import r2_score, mean_squared_error, mean_absolute_error # Import necessary metrics
-import joblib
-import pandas as pd
-import numpy as np
-import mlflow.sklearn
+logger = logging.getLogger(__name__)
 
 class Eval:
-    def __init__(self, y_test_path, X_test_path, model_path, run_id):
+    def __init__(self, y_test_path, X_test_path, model_path, run_id, batch_size=100000, workers=0):
         self.X_test_path = X_test_path
         self.y_test_path = y_test_path
         self.model_path = model_path
         self.run_id = run_id
+        self.batch_size = batch_size
+        self.workers = workers
         
     def Evalulate(self):
-        
+        import mlflow
+
         try:
 
             logger.info('Evaluating Training model with test data')
-            # Load test datasets
-            X_test = pd.read_csv(self.X_test_path)
-            y_test = pd.read_csv(self.y_test_path)
-            
-            # Enocde test since original test file did not save new encoded data
-            X_test = pd.get_dummies(X_test,prefix=['transmission_from_vin'], columns = ['transmission_from_vin'], drop_first=True, dtype=float)
-            X_test = pd.get_dummies(X_test,prefix=['stock_type'], columns = ['stock_type'], drop_first=True, dtype=float)
-            X_test = pd.get_dummies(X_test,prefix=['make'], columns = ['make'], drop_first=False, dtype=float)
+            # Load logged model from mlflow through the local artifact cache
+            with stage('load_model'):
+                model = default_cache().load_model(self.run_id)
 
-            # Load logged model from mlflow
-            model_uri = f"runs:/{self.run_id}/model"
-            model = mlflow.sklearn.load_model(model_uri)
+                # Encode with the schema logged next to the model, like the api does
+                encoder = encoder_for_model(model, default_cache().model_file(self.run_id))
 
             # Load the model directly
             # model = joblib.load(self.model_path)
 
-            # Create y_hat_test
-            y_hat_test = model.predict(X_test)
+            # Stream the test split in batches, encoded in the model's column order and scored in parallel
+            with stage('predict'):
+                metrics = evaluate_batches(model, self.X_test_path, self.y_test_path, self.batch_size, self.workers,
+                                           encoder=encoder)
+            report = metrics.overall()
 
             # Create r2 and print 
-            r2 = r2_score(y_test, y_hat_test)
+            r2 = report['r2']
             print(f"r2 score: {r2}")
+            print(f"mse: {report['mse']} rmse: {report['rmse']} mae: {report['mae']} on {metrics.count} rows")
 
             logger.info(f"Model evaluated to have an r2 score of {r2}")
-            # mlflow autolog still runs from train py so commented out
-            #mlflow.log_metric("r2_score", r2)
+
+            # Log the test metrics and the error breakdowns to the training run
+            with stage('log_metrics'), mlflow.start_run(run_id=self.run_id):
+                mlflow.log_metrics({f"test_{name}": float(value) for name, value in report.items() if name != 'count'})
+                for column in GROUP_COLUMNS:
+                    breakdown = metrics.breakdown(column)
+                    logger.info(f"Errors by {column}:\n{breakdown.head(10).to_string()}")
+                    mlflow.log_text(breakdown.to_csv(), f"evaluation/errors_by_{column}.csv")
 
             logger.info("Evaluation finished")
             mlflow.end_run()
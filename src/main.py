@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Command line entry point of the car price pipeline.
+
+    python src/main.py [options]                       preprocess, train and evaluate
+    python src/main.py preprocess [options]            bring the processed splits up to date
+    python src/main.py train [options]                 train on the processed splits
+    python src/main.py evaluate --run_id <id> [options]
+    python src/main.py serve [--workers N --host H --port P]
+    python src/main.py reprice [--input dump.csv --output prices.parquet --versions v1 v2]
+
+The options are the ones in utils/arg_parser.py (defaults from configs/parameters.yml), serve
+and reprice take the options of serve.py and reprice.py. Each command only imports what it needs.
+With --profile the pipeline commands print the time and peak memory of every stage and log them
+to the mlflow run.
+"""
+import logging
+import sys
+import warnings
+
+logger = logging.getLogger(__name__)
+
+COMMANDS = ['pipeline', 'preprocess', 'train', 'evaluate', 'serve', 'reprice']
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    command = argv.pop(0) if argv and argv[0] in COMMANDS else 'pipeline'
+
+    if command == 'serve':
+        import serve
+
+        serve.main(argv)
+        return
+
+    if command == 'reprice':
+        import reprice
+
+        reprice.main(argv)
+        return
+
+    from utils.arg_parser import get_input_args
+
+    in_arg = get_input_args(argv)
+
+    # Configure logging to write to stdout
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler()])
+    warnings.filterwarnings('ignore')
+
+    import preprocess
+    from utils.profiling import Profiler, stage
+
+    profiler = None
+    if in_arg.profile or in_arg.profile_dumps:
+        profiler = Profiler(in_arg.profile_dumps, in_arg.profile_dir).start()
+    run_id = None
+
+    try:
+
+        if command == 'pipeline':
+            run_id = preprocess.run_pipeline(in_arg)
+
+        elif command == 'preprocess':
+            with stage('preprocess'):
+                paths = preprocess.preprocess(in_arg.data_directory, in_arg.chunksize, in_arg.data_format,
+                                              in_arg.force_preprocess)
+            print(f"Processed splits: {', '.join(paths)}")
+
+        elif command == 'train':
+            with stage('train'):
+                run_id = preprocess.train_model(in_arg, preprocess.split_paths(in_arg.data_format))
+            print(f"Trained model logged to run {run_id}")
+
+        elif command == 'evaluate':
+            if not in_arg.run_id:
+                raise SystemExit("evaluate needs the --run_id of the trained model")
+            run_id = in_arg.run_id
+            with stage('evaluate'):
+                preprocess.evaluate_model(in_arg, preprocess.split_paths(in_arg.data_format), run_id)
+
+    finally:
+        # A failed run still reports the stages it got through
+        if profiler is not None:
+            profiler.stop()
+            profiler.report(run_id)
+
+
+if __name__ == "__main__":
+    main()
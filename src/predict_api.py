@@ -1,81 +1,169 @@
-from flask import Flask, jsonify, request
-import pandas as pd
-import joblib
+from flask import Flask, Response, g, has_request_context, jsonify, request
+import numpy as np
+import json
 import logging
+import os
+from utils.feature_encoder import FeatureEncoder
+from utils.instrumentation import CONTENT_TYPE, MetricsRegistry, RequestTimer, SampleFilter, configure_logging
+from utils.linear_model import LinearModel, SegmentedModel
+from utils.micro_batcher import MicroBatcher
+from utils.model_registry import ModelNotDeployedError, default_registry
+from utils.prediction_cache import MISSING, PredictionCache, listing_key
+from utils.shadow import ShadowScorer
 
 app = Flask(__name__)
 
-def predict(stock_type, mileage, msrp, model_year, make,
-    transmission_from_vin, model):
+logger = logging.getLogger(__name__)
+
+# One line per request, sampled at REQUEST_LOG_SAMPLE_RATE like the werkzeug access log
+request_logger = logging.getLogger("predict_api.requests")
+request_logger.addFilter(SampleFilter())
+logging.getLogger("werkzeug").addFilter(SampleFilter())
+
+# Models are loaded once and kept in memory between requests
+registry = default_registry()
+
+# Fields every listing must have to be predicted
+REQUIRED_FIELDS = ['stock_type', 'mileage', 'msrp', 'model_year', 'make', 'transmission_from_vin']
+
+# Error of a listing whose numeric fields cannot be encoded
+NUMBERS_ERROR = "mileage, msrp and model_year must be numbers"
+
+# Content types accepted for newline delimited batches
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+
+# MICRO_BATCH=1 coalesces concurrent /v1/predict and /v2/predict requests into batches of up to
+# MICRO_BATCH_MAX_SIZE listings, waiting at most MICRO_BATCH_MAX_WAIT_MS for a batch to fill
+MICRO_BATCH = os.environ.get("MICRO_BATCH", "0") == "1"
+MICRO_BATCH_MAX_SIZE = int(os.environ.get("MICRO_BATCH_MAX_SIZE", 64))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get("MICRO_BATCH_MAX_WAIT_MS", 2))
+
+# PREDICTION_CACHE_SIZE > 0 keeps that many single listing prices for PREDICTION_CACHE_TTL seconds
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 0))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", 300))
+
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+
+# SHADOW_MODELS="v1=v2" also scores SHADOW_SAMPLE_RATE of the v1 requests with v2 on a background
+# thread, with at most SHADOW_QUEUE_SIZE listings waiting, and serves the price differences on /shadow
+SHADOW_MODELS = dict(item.strip().split("=", 1) for item in os.environ.get("SHADOW_MODELS", "").split(",") if "=" in item)
+SHADOW_SAMPLE_RATE = float(os.environ.get("SHADOW_SAMPLE_RATE", 0.1))
+SHADOW_QUEUE_SIZE = int(os.environ.get("SHADOW_QUEUE_SIZE", 10000))
+
+# FLASK_DEBUG=1 turns on the interactive debugger when this file is run directly, never set it where the api is reachable
+FLASK_DEBUG = os.environ.get("FLASK_DEBUG", "0") == "1"
+
+# Metrics of this process, served on /metrics in the Prometheus text format
+metrics = MetricsRegistry()
+REQUESTS = metrics.counter("predict_api_requests_total", "Requests served", ["route", "method", "status"])
+REQUEST_LATENCY = metrics.histogram("predict_api_request_seconds", "Time to serve a request", ["route"])
+PHASE_LATENCY = metrics.histogram("predict_api_phase_seconds",
+                                  "Time spent in each phase of a request (parse, cache, encode, predict, serialize)",
+                                  ["route", "phase"])
+ERRORS = metrics.counter("predict_api_errors_total", "Requests or batch listings that failed", ["route", "reason"])
+metrics.gauge("predict_api_model_load_seconds", "Time the last load of a model took", ["version"],
+              lambda: {(version, ): stats["load_time_ms"] / 1000
+                       for version, stats in registry.stats().items() if stats["loaded"]})
+metrics.gauge("predict_api_model_loads", "Times a model was loaded", ["version"],
+              lambda: {(version, ): stats["loads"] for version, stats in registry.stats().items() if stats["loaded"]})
+metrics.gauge("predict_api_prediction_cache", "Prediction cache counters", ["counter"],
+              lambda: {(name, ): value for name, value in prediction_cache.stats().items()
+                       if prediction_cache.enabled and name in ("size", "hits", "misses", "expired", "invalidations")})
+metrics.gauge("predict_api_shadow", "Shadow scoring counters and price differences", ["primary", "shadow", "stat"],
+              lambda: {(primary, stats["shadow"], name): stats[name]
+                       for primary, stats in (shadow.stats(merged=False).items() if shadow is not None else ())
+                       for name in ("sampled", "dropped", "errors", "count", "mean_delta", "mean_abs_delta", "rmse_delta")
+                       if name in stats})
+
+
+def mark_phase(phase):
+    """Ends a phase of the current request, outside of a request it does nothing."""
+    if has_request_context():
+        timer = g.get("timer")
+        if timer is not None:
+            timer.mark(phase)
+
+
+def route_name():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+@app.before_request
+def start_timer():
+    g.timer = RequestTimer()
+
+
+@app.after_request
+def record_request(response):
+    timer = g.get("timer")
+    if timer is None:
+        return response
+
+    # Everything after the last phase is turning the result into the response
+    timer.mark("serialize")
+    route = route_name()
+
+    REQUESTS.inc(route, request.method, str(response.status_code))
+    REQUEST_LATENCY.observe(timer.total(), route)
+    for phase, seconds in timer.phases.items():
+        PHASE_LATENCY.observe(seconds, route, phase)
+
+    request_logger.info(f"{request.method} {request.path} {response.status_code} in {timer.total() * 1000:.2f} ms")
+    return response
+
+
+@app.errorhandler(ModelNotDeployedError)
+def model_not_deployed(error):
+    """A version whose model file is missing answers with a JSON 503 instead of an HTML 500."""
+    ERRORS.inc(route_name(), "model_not_deployed")
+    return jsonify({"error": f"Model {error.version} is not deployed"}), 503
+
+
+@app.teardown_request
+def record_exception(error):
+    if error is not None:
+        ERRORS.inc(route_name(), type(error).__name__)
+
+
+def score(model, encoder, X, makes=None):
     """
-    Predicts the price of a car based on features given.
+    Predicts from an encoded matrix.
+    Exported linear models take the matrix directly, sklearn models get it with feature names.
+    Segmented models route every row to its make's model by the makes, when given.
     """
+    if isinstance(model, SegmentedModel):
+        return model.predict(X, makes)
+    if isinstance(model, LinearModel):
+        return model.predict(X)
+    return model.predict(encoder.to_frame(X))
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),  # Log to console
-            logging.FileHandler('app.log')  # Log to file            
-        ]
-     )
 
-    logger = logging.getLogger(__name__)
+def predict(stock_type, mileage, msrp, model_year, make,
+    transmission_from_vin, model, encoder=None):
+    """
+    Predicts the price of a car based on features given.
+    """
 
     try:
 
-        logger.info(f"Received prediction request with stock_type: {stock_type}")
-        logger.info(f"Received prediction request with mileage: {mileage}")
-        logger.info(f"Received prediction request with msrp: {msrp}")
-        logger.info(f"Received prediction request with model_year: {model_year}")
-        logger.info(f"Received prediction request with make: {make}")
-        logger.info(f"Received prediction request with transmission: {transmission_from_vin}")
-        logger.info(f"Received prediction request with model: {model}")
-
-        # List of all makes in model
-        make_list = ['make_Acura', 'make_Alfa Romeo', 'make_Audi',
-        'make_BMW', 'make_Buick', 'make_Cadillac', 'make_Chevrolet',
-        'make_Chrysler', 'make_Dodge', 'make_Fiat', 'make_Ford', 'make_GMC',
-        'make_Genesis', 'make_Honda', 'make_Hyundai', 'make_Infiniti',
-        'make_Jaguar', 'make_Jeep', 'make_Kia', 'make_Land Rover', 'make_Lexus',
-        'make_Lincoln', 'make_Maserati', 'make_Mazda', 'make_Mercedes-Benz',
-        'make_Mini', 'make_Mitsubishi', 'make_Nissan', 'make_Polestar',
-        'make_Pontiac', 'make_Porsche', 'make_Ram', 'make_Rivian', 'make_Scion',
-        'make_Smart', 'make_Subaru', 'make_Suzuki', 'make_Tesla', 'make_Toyota',
-        'make_Volkswagen', 'make_Volvo']
-        
-        # Create basic dataframe from new data
-        d = {'stock_type': [stock_type],
-            'mileage': [mileage],
-            'model_year': [model_year],
-            'msrp': [msrp],
-            'transmission_from_vin': [transmission_from_vin]
+        if encoder is None:
+            encoder = FeatureEncoder.from_model(model)
+
+        # Encode new data straight into a row in the model's column order
+        listing = {'stock_type': stock_type,
+            'mileage': mileage,
+            'model_year': model_year,
+            'msrp': msrp,
+            'make': make,
+            'transmission_from_vin': transmission_from_vin
             }
-        new_data = pd.DataFrame(d)
-
-        # Encode new data
-        new_data = pd.get_dummies(new_data,prefix=['transmission_from_vin'], columns = ['transmission_from_vin'], dtype=float)
-        new_data = pd.get_dummies(new_data,prefix=['stock_type'], columns = ['stock_type'], dtype=float)
-
-        # Grab make data
-        makedata = pd.DataFrame({f'make_{make}'})
-
-        # Rename if transmission column name different
-        if 'transmission_from_vin_A' in new_data.columns:
-            new_data = new_data.rename(columns={'transmission_from_vin_A': "transmission_from_vin_M"})
-        
-        # Add in car make columns
-        for i in make_list:
-            if i not in makedata.columns:
-                new_data[i] = 0
-            else:
-                new_data[i] = 1
-
-        price = model.predict(new_data)
-        
-        logger.info(f"Prediction successful")
-
-        return float(price)
+        new_data = encoder.encode_row(listing)[np.newaxis, :]
+        mark_phase('encode')
+
+        price = score(model, encoder, new_data, [make])
+        mark_phase('predict')
+
+        return float(price[0])
     
     except Exception as e:
         logger.error(f"Prediction failed with error: {str(e)}") 
@@ -93,8 +181,14 @@ def home():
         "endpoints": {
             "/Car_Price_Prediction_home": "The home page",
             "/health_status": "Indicates if API is available and ready",
+            "/models": "Shows load times and cache hits for the loaded models",
+            "/metrics": "Request counts, latencies and errors in the Prometheus text format",
+            "/shadow": "Price differences between the primary and shadow versions when shadow scoring is on",
             "/v1/predict1": "Uses v1 model to predict price",
-            "/v2/predict1": "Uses v2 model to predict price"
+            "/v2/predict1": "Uses v2 model to predict price",
+            "/v3/predict": "Uses the segmented model of the car's make to predict price",
+            "/v1/predict_batch": "Uses v1 model to predict the prices of a JSON array or NDJSON stream of cars",
+            "/v2/predict_batch": "Uses v2 model to predict the prices of a JSON array or NDJSON stream of cars"
         },
 
         "input_format" : {
@@ -129,92 +223,250 @@ def health_check():
         'status': "UP",
         "message": "Car Price Prediction is up"
     }
+    if batcher is not None:
+        health["micro_batching"] = batcher.stats()
+    if prediction_cache.enabled:
+        health["prediction_cache"] = prediction_cache.stats()
     return jsonify(health)
 
-@app.route('/v1/predict', methods=['POST'])
-def v1():
-    
+@app.route('/models', methods=['GET'])
+def models():
+    return jsonify(registry.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+def validate_listing(data):
+    """
+    Checks a single listing for the fields the model needs.
+    Returns an error message, or None if the listing is valid.
+    """
+
+    if not isinstance(data, dict):
+        return "Listing must be a JSON object"
+
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            return f"Missing {field} data"
+
+    return None
+
+
+def predict_route(version):
+    """
+    Shared handler for the single listing prediction endpoints.
+    """
+
     if not request.is_json:
+        ERRORS.inc(route_name(), "invalid_request")
         return jsonify({"error": "Request must be JSON data"})
-    
+
     data = request.json
-    
-    
-    if "stock_type" not in data:
-        return jsonify ({"error": "Missing stock_type data"})
-    
-    if "mileage" not in data:
-        return jsonify ({"error": "Missing mileage data"})
-    
-    if "msrp" not in data:
-        return jsonify ({"error": "Missing msrp data"})
-    
-    if "model_year" not in data:
-        return jsonify ({"error": "Missing model_year data"})
-    
-    if "make" not in data:
-        return jsonify ({"error": "Missing make data"})
-    
-    if "transmission_from_vin" not in data:
-        return jsonify ({"error": "Missing transmission_from_vin data"})
-    
-    stock_type = data.get('stock_type')
-    mileage = data.get('mileage')
-    msrp = data.get('msrp')
-    model_year = data.get('model_year')
-    make = data.get('make')
-    transmission_from_vin = data.get('transmission_from_vin')
 
-    model = joblib.load('/home/machine/cmpt3830/models/ridge_model_v1.jlib')
+    error = validate_listing(data)
+    mark_phase('parse')
+    if error is not None:
+        ERRORS.inc(route_name(), "invalid_listing")
+        return jsonify({"error": error})
+
+    model, encoder = registry.get_with_encoder(version)
+
+    key = None
+    if prediction_cache.enabled:
+        try:
+            key = listing_key(encoder, data)
+        except (TypeError, ValueError):
+            # Left to the prediction below to report
+            key = None
+
+        if key is not None:
+            cached = prediction_cache.get(version, model, key)
+            mark_phase('cache')
+            if cached is not MISSING:
+                if shadow is not None:
+                    shadow.offer(version, {field: data.get(field) for field in REQUIRED_FIELDS}, cached)
+                return jsonify({
+                    "success": True,
+                    "price_predicted": cached
+                })
+
+    try:
+        if batcher is not None:
+            # Wait for the price from the next micro-batch of this version
+            results = batcher.predict(version, {field: data.get(field) for field in REQUIRED_FIELDS})
+            mark_phase('predict')
+        else:
+            stock_type = data.get('stock_type')
+            mileage = data.get('mileage')
+            msrp = data.get('msrp')
+            model_year = data.get('model_year')
+            make = data.get('make')
+            transmission_from_vin = data.get('transmission_from_vin')
+
+            results = predict(stock_type, mileage, msrp, model_year, make, transmission_from_vin, model, encoder)
+    except (TypeError, ValueError):
+        # Reported like the rows of /predict_batch that cannot be encoded
+        ERRORS.inc(route_name(), "invalid_listing")
+        return jsonify({"error": NUMBERS_ERROR})
 
-    results = predict(stock_type, mileage, msrp, model_year, make, transmission_from_vin, model)
+    if key is not None:
+        prediction_cache.put(version, model, key, results)
+
+    if shadow is not None:
+        shadow.offer(version, {field: data.get(field) for field in REQUIRED_FIELDS}, results)
 
     return jsonify({
         "success": True,
         "price_predicted": results
     })
 
+
+@app.route('/v1/predict', methods=['POST'])
+def v1():
+    return predict_route('v1')
+
 @app.route('/v2/predict', methods=['POST'])
 def v2():
+    return predict_route('v2')
+
+@app.route('/v3/predict', methods=['POST'])
+def v3():
+    return predict_route('v3')
+
+
+def read_batch():
+    """
+    Reads the listings of a batch request, either a JSON array or NDJSON (one listing per line).
+    Returns a list where each item is a listing, or an error message for lines that were not valid JSON.
+    """
+
+    if request.mimetype in NDJSON_TYPES:
+        listings = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                listings.append(json.loads(line))
+            except ValueError:
+                listings.append(ValueError("Line is not valid JSON"))
+        return listings
+
     if not request.is_json:
-        return jsonify({"error": "Request must be JSON data"})
-    
-    data = request.json
-    
-    
-    if "stock_type" not in data:
-        return jsonify ({"error": "Missing stock_type data"})
-    
-    if "mileage" not in data:
-        return jsonify ({"error": "Missing mileage data"})
-    
-    if "msrp" not in data:
-        return jsonify ({"error": "Missing msrp data"})
-    
-    if "model_year" not in data:
-        return jsonify ({"error": "Missing model_year data"})
-    
-    if "make" not in data:
-        return jsonify ({"error": "Missing make data"})
-    
-    if "transmission_from_vin" not in data:
-        return jsonify ({"error": "Missing transmission_from_vin data"})
-    
-    stock_type = data.get('stock_type')
-    mileage = data.get('mileage')
-    msrp = data.get('msrp')
-    model_year = data.get('model_year')
-    make = data.get('make')
-    transmission_from_vin = data.get('transmission_from_vin')
+        return None
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return None
+
+    return data
+
+
+def predict_batch(listings, model, encoder):
+    """
+    Predicts the prices of many listings with one call to the model.
+    Listings that fail validation get an error instead of a price without failing the batch.
+    """
+
+    results = [None] * len(listings)
+    X = np.zeros((len(listings), encoder.n_features), dtype=np.float64)
+    positions = []
+    makes = []
+
+    # Validate every listing and keep the good ones
+    for i, listing in enumerate(listings):
+        if isinstance(listing, Exception):
+            results[i] = {"index": i, "error": str(listing)}
+            continue
+
+        error = validate_listing(listing)
+        if error is None:
+            try:
+                # Encode straight into the next row of the batch matrix
+                encoder.encode_row(listing, out=X[len(positions)])
+            except (TypeError, ValueError):
+                error = NUMBERS_ERROR
+
+        if error is not None:
+            results[i] = {"index": i, "error": error}
+            continue
+
+        positions.append(i)
+        makes.append(listing['make'])
+
+    if positions:
+        # Predict all valid listings with one call in the column order the model was trained on
+        mark_phase('encode')
+        prices = score(model, encoder, X[:len(positions)], makes)
+        mark_phase('predict')
+
+        for i, price in zip(positions, prices):
+            results[i] = {"index": i, "price_predicted": float(price)}
+
+    # Sampled like the request lines, micro-batches of single predictions run through here too
+    request_logger.info(f"Batch prediction finished with {len(positions)} predicted and {len(listings) - len(positions)} errors")
 
-    model = joblib.load('/home/machine/cmpt3830/models/ridge_model_v2.jlib')
+    return results
 
-    results = predict(stock_type, mileage, msrp, model_year, make, transmission_from_vin, model)
+
+def score_micro_batch(version, listings):
+    """
+    Scores the listings the micro-batcher collected from single predict requests in one call.
+    Returns a price, or a ValueError to raise in the waiting request, for every listing.
+    """
+    model, encoder = registry.get_with_encoder(version)
+    results = predict_batch(listings, model, encoder)
+    return [result["price_predicted"] if "error" not in result else ValueError(result["error"]) for result in results]
+
+
+batcher = MicroBatcher(score_micro_batch, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS) if MICRO_BATCH else None
+
+shadow = ShadowScorer(score_micro_batch, SHADOW_MODELS, SHADOW_SAMPLE_RATE, SHADOW_QUEUE_SIZE) if SHADOW_MODELS else None
+
+
+@app.route('/shadow', methods=['GET', 'DELETE'])
+def shadow_route():
+    """Price differences of the shadow versions, DELETE clears them."""
+    if shadow is None:
+        return jsonify({"error": "Shadow scoring is off, set SHADOW_MODELS to turn it on"}), 404
+    if request.method == 'DELETE':
+        shadow.reset()
+    return jsonify(shadow.stats())
+
+
+@app.route('/<version>/predict_batch', methods=['POST'])
+def batch(version):
+
+    if version not in registry.model_paths:
+        return jsonify({"error": f"Unknown model version {version}"}), 404
+
+    listings = read_batch()
+    mark_phase('parse')
+    if listings is None:
+        ERRORS.inc(route_name(), "invalid_request")
+        return jsonify({"error": "Request must be a JSON array or NDJSON data"})
+
+    model, encoder = registry.get_with_encoder(version)
+
+    results = predict_batch(listings, model, encoder)
+    errors = sum(1 for result in results if "error" in result)
+    if errors:
+        ERRORS.inc(route_name(), "invalid_listing", amount=errors)
 
     return jsonify({
         "success": True,
-        "price_predicted": results
+        "predicted": len(results) - errors,
+        "errors": errors,
+        "results": results
     })
 
 if __name__ == "__main__":
-    app.run(host='127.0.0.1', port=9999, debug=True)
\ No newline at end of file
+    configure_logging()
+    registry.preload()
+    if batcher is not None:
+        batcher.start()
+    if shadow is not None:
+        shadow.start()
+    # No reloader, it would import this module again and preload the models and start the threads twice
+    app.run(host='127.0.0.1', port=9999, debug=FLASK_DEBUG, use_reloader=False, threaded=True)
\ No newline at end of file
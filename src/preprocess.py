@@ -1,220 +1,153 @@
 #!/usr/bin/env python3
-import logging
-
 """
 File should process all the data using pandas, split in with sklearn, and then export it with os and shutil.
-"""
-
-# Configure logging to write to stdout
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler()]  # Log to stdout
-)
-
-logger = logging.getLogger(__name__)
 
-import pandas as pd
-import numpy as np
-import sklearn.preprocessing
-from sklearn.model_selection import train_test_split
-import warnings
-import shutil
+The steps are functions so they can be imported without running anything. python src/main.py
+runs them from the command line, and running this file directly still runs the whole pipeline.
+"""
+import logging
 import os
-import train
-import evaluate
+import shutil
+import warnings
 
+from utils.cleaning import clean_and_split
+from utils.data_io import split_file_names
+from utils.preprocess_cache import cache_is_valid, preprocess_cache_key, write_cache_key
+from utils.profiling import stage
 
-warnings.filterwarnings('ignore')
+logger = logging.getLogger(__name__)
 
 
 #file_path = "/home/machine/cmpt3830/data/raw/CBB_Listings.csv"
-file_path = "/app/data/raw/CBB_Listings.csv"
-
-try:
-
-    df = pd.read_csv(file_path)
-
-    #removing duplicates
-    df.drop_duplicates(inplace= True)
-
-
-    #dropping a column by name
-    column_to_remove = ['has_leather', 'has_navigation','listing_id','listing_heading', 'listing_type', 'listing_url', 'listing_first_date', 'days_on_market', 'dealer_id', 'dealer_name', 'dealer_street', 'dealer_city', 'dealer_province', 'dealer_postal_code', 'dealer_url', 'dealer_email', 'dealer_phone', 'dealer_type', 'vehicle_id', 'uvc', 'price_analysis', 'price_history_delimited', 'distance_to_dealer', 'location_score', 'listing_dropoff_date', 'certified']
-    df.drop(columns=column_to_remove, inplace=True)
-
-
-    # Outlier detection using IQR for each numerical column
-    for col in df.select_dtypes(include='number').columns:
-        Q1 = df[col].quantile(0.25)
-        Q3 = df[col].quantile(0.75)
-        IQR = Q3 - Q1
-
-        # Define the outlier range
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-
-        # Identify outliers
-        outliers = df[(df[col] < lower_bound) | (df[col] > upper_bound)]
-        #print(f'Outliers in {col}: \n{outliers}\n')
-
-    def remove_outliers_iqr(df, column):
-        Q1 = df[column].quantile(0.25)
-        Q3 = df[column].quantile(0.75)
-        IQR = Q3 - Q1
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-        # Filter the dataframe
-        filtered_df = df[(df[column] >= lower_bound) & (df[column] <= upper_bound)] # removed the extra indent
-        return filtered_df
-
-    # Applying outlier removal for 'number_price_changes' and 'wheelbase_from_vin'
-    df_cleaned = remove_outliers_iqr(df, 'number_price_changes')
-    df_cleaned = remove_outliers_iqr(df, 'wheelbase_from_vin')
+#file_path = "/app/data/raw/CBB_Listings.csv"
 
-    # Display cleaned DataFrame
-    #df_cleaned.head()
+# Train test split settings
+TEST_SIZE = 0.20
+RANDOM_STATE = 42
 
-    df = df_cleaned
+# Folder to move processed data into
+#PROCESSED_FOLDER = '/home/machine/cmpt3830/data/processed'
+PROCESSED_FOLDER = '/app/data/processed'
 
+#MODEL_PATH = '/home/machine/cmpt3830/models/ridge_model.jlib'
+MODEL_PATH = '/app/models/ridge_model.jlib'
 
-    numerical_columns = ['mileage', 'price', 'msrp', 'model_year',
-                        'wheelbase_from_vin', 'number_price_changes']
+# Source files of the cleaning and split writing steps, a change to any of them invalidates the processed data cache.
+# clean_and_split lives in utils/cleaning.py so edits to the training steps of this file keep the cache.
+CLEANING_CODE_FILES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils', name)
+                       for name in ['cleaning.py', 'chunked_preprocess.py', 'data_io.py']]
 
-    categorical_columns = ['stock_type', 'vin', 'make', 'model', 'series', 'style',
-                        'exterior_color', 'exterior_color_category', 'interior_color',
-                        'interior_color_category', 'drivetrain_from_vin', 'engine_from_vin',
-                        'transmission_from_vin', 'fuel_type_from_vin']
 
+def split_paths(data_format='parquet', target_folder=PROCESSED_FOLDER):
+    """Paths of the X_train, y_train, X_test and y_test files in the processed folder."""
+    return [os.path.join(target_folder, name) for name in split_file_names(data_format)]
 
-    # Columns where 0 is invalid and should be treated as missing values (NaN)
-    invalid_zero_columns = ['mileage', 'price', 'msrp', 'wheelbase_from_vin', 'number_price_changes']
 
-    # Replacing 0 with NaN in these columns
-    df[invalid_zero_columns] = df[invalid_zero_columns].replace(0, np.nan)
+def preprocess(data_directory, chunksize=0, data_format='parquet', force=False, target_folder=PROCESSED_FOLDER):
+    """
+    Brings the processed splits in target_folder up to date with CBB_Listings.csv in data_directory.
+    Cleaning is skipped when the raw data, settings and cleaning code are unchanged since the last run.
+    Returns the paths of X_train, y_train, X_test and y_test.
+    """
+    from utils.chunked_preprocess import peak_rss_mb
 
-    # For numerical columns, fill missing values with median
-    for col in invalid_zero_columns:
-        df[col].fillna(df[col].mean(), inplace=True)
+    file_path = os.path.join(data_directory, "CBB_Listings.csv")
 
-    # Check if 0 values have been handled correctly
-    #print(df[invalid_zero_columns].isnull().sum())
+    # Put names of processed files into list
+    pro_csv = split_file_names(data_format)
 
+    # Everything that changes the processed output goes into the cache key
+    cleaning_config = {
+        'mode': 'chunked' if chunksize else 'in_memory',
+        'data_format': data_format,
+        'test_size': TEST_SIZE,
+        'random_state': RANDOM_STATE,
+    }
+    with stage('cache_key'):
+        key, key_record = preprocess_cache_key(file_path, cleaning_config, CLEANING_CODE_FILES)
 
-    for col in numerical_columns:
-        df[col].fillna(df[col].mean(), inplace=True)
+    if not force and cache_is_valid(target_folder, key, pro_csv):
 
+        # Raw data and settings are unchanged so the processed files can be reused
+        logger.info(f"Processed data in {target_folder} is up to date, skipping cleaning")
 
-    for col in categorical_columns:
-        df[col].fillna(df[col].mode()[0], inplace=True)
+    else:
 
-    for i in categorical_columns:
-        df = df.astype({i: 'category'})
+        clean_and_split(file_path, '.', chunksize, data_format, TEST_SIZE, RANDOM_STATE)
 
+        print(f"Peak memory during preprocessing: {peak_rss_mb():.1f} MB")
 
-    # Replacing 6 with M and 7 with A
-    df = df.replace({"transmission_from_vin": "6"}, {"transmission_from_vin": "M"})
-    df = df.replace({"transmission_from_vin": "7"}, {"transmission_from_vin": "A"})
-
-
-    # Replaces values less than 1000 with the mean for price and msrp
-    df['price'] = df['price'].mask(df['price'] < 1000, df['price'].mean())
-    df['msrp'] = df['msrp'].mask(df['msrp'] < 1000, df['msrp'].mean())
-
-
-    # Replaces all mileage values with less than 1000 and a stock type of USED with the mean value (Note: | is or, NOT AND!)
-    df['mileage'] = df['mileage'].mask((df['mileage'] < 1000) & (df['stock_type'] == 'USED'), df['mileage'].mean(), inplace=False)
-
-
-    # Categories with very few of a value
-    less = ['exterior_color_category', 'interior_color_category', 'make', 'fuel_type_from_vin', 'model']
-
-
-    # Removing those values
-    for cat in less:
-        value_counts = df[f"{cat}"].value_counts()
-    df = df[df[cat].isin(value_counts[value_counts > 3].index)]
-
-
-    # Dropping again 
-    df = df.drop(columns=["exterior_color", "interior_color", 'vin','exterior_color_category',	'interior_color_category',	
-                        'wheelbase_from_vin',	'drivetrain_from_vin',	'engine_from_vin','number_price_changes'])
-
-
-    # Split to X and y
-    X = df[['make','mileage','model_year','transmission_from_vin','stock_type','msrp']]
-    y = df['price']
-
-
-    # Train test split
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.20, random_state=42)
-
-
-    # Put into csvs
-    X_train.to_csv('X_train.csv', index=False)
-    y_train.to_csv('y_train.csv', index=False)
-    X_test.to_csv('X_test.csv', index=False)
-    y_test.to_csv('y_test.csv', index=False)
+        # Move every processed file into the folder, replacing stale files from older runs
+        for proc in pro_csv:
+            destination_path = os.path.join(target_folder, proc)
+            shutil.move(proc, destination_path)
 
+        # Record what the processed files were made from
+        write_cache_key(target_folder, key, key_record, pro_csv)
 
-    # Put names of csvs into list
-    pro_csv = ["X_train.csv", "y_train.csv", "X_test.csv", "y_test.csv"]
+    return split_paths(data_format, target_folder)
 
 
-    # Folder to move processed data into
-    #target_folder = '/home/machine/cmpt3830/data/processed'  
-    target_folder = '/app/data/processed'
+def train_model(in_arg, paths):
+    """Trains with the method picked on the command line and returns the mlflow run id."""
+    from train import Train
 
-    # For loop to process data
-    for proc in pro_csv:
+    X_train_path, y_train_path, X_test_path, y_test_path = paths
+    training = Train(X_train_path, X_test_path, y_train_path, y_test_path, in_arg.solver, in_arg.alpha, in_arg.fit_intercept)
 
-    # Find path for target folder 
-        destination_path = os.path.join(target_folder, proc)
-    
-    # Check if file already made and avoids making another
-        if os.path.exists(destination_path):
-            print(f"The file '{destination_path}' already exists.") 
-    
-    # Moves file to folder if first instance
-        else: 
-            shutil.move(proc, destination_path)
+    if in_arg.sweep:
+        return training.sweep(in_arg.sweep_space, in_arg.sweep_search, in_arg.sweep_iter, in_arg.sweep_workers,
+                              in_arg.sweep_validation_size, RANDOM_STATE)
+    if in_arg.alpha_path:
+        return training.alpha_path(in_arg.path_low, in_arg.path_high, in_arg.path_num, in_arg.path_validation_size,
+                                   RANDOM_STATE)
+    if in_arg.segmented:
+        return training.train_segmented(in_arg.segment_min_rows, in_arg.segment_groups, in_arg.segment_workers,
+                                        in_arg.segment_validation_size, RANDOM_STATE)
+    if in_arg.train_chunksize:
+        return training.train_incremental(in_arg.train_chunksize)
+    return training.trainmodel()
+
+
+def evaluate_model(in_arg, paths, run_id):
+    """Evaluates the model logged to a run on the test split."""
+    from evaluate import Eval
 
-    # Using process.py as main until main is actually created
-    #X_train_path = "/home/machine/cmpt3830/data/processed/X_train.csv"
-    #X_test_path = "/home/machine/cmpt3830/data/processed/X_test.csv"
-    #y_train_path = "/home/machine/cmpt3830/data/processed/y_train.csv"
-    #y_test_path = "/home/machine/cmpt3830/data/processed/y_test.csv"
+    _, _, X_test_path, y_test_path = paths
+    Eval(y_test_path, X_test_path, MODEL_PATH, run_id, in_arg.eval_batch_size, in_arg.eval_workers).Evalulate()
 
-    X_train_path = "/app/data/processed/X_train.csv"
-    X_test_path = "/app/data/processed/X_test.csv"
-    y_train_path = "/app/data/processed/y_train.csv"
-    y_test_path = "/app/data/processed/y_test.csv"
 
-    from train import Train
-    from evaluate import Eval
-    from utils.arg_parser import get_input_args
+def run_pipeline(in_arg):
+    """Preprocesses, trains and evaluates. Returns the mlflow run id of the trained model."""
+    warnings.filterwarnings('ignore')
 
-    print("Training Begins")
-    in_arg = get_input_args()
+    try:
 
-    training = Train(X_train_path, X_test_path, y_train_path, y_test_path, in_arg.solver, in_arg.alpha, in_arg.fit_intercept)
+        with stage('preprocess'):
+            paths = preprocess(in_arg.data_directory, in_arg.chunksize, in_arg.data_format, in_arg.force_preprocess)
 
-    h = training.trainmodel()
+        print("Training Begins")
+        with stage('train'):
+            run_id = train_model(in_arg, paths)
+        print("Training Finishes")
 
-    print("Training Finishes")
+        print('Evaluation Begins')
+        with stage('evaluate'):
+            evaluate_model(in_arg, paths, run_id)
+        print("Evaluation Finishes")
 
-    print('Evaluation Begins')
-    #model_path = '/home/machine/cmpt3830/models/ridge_model.jlib'
+        print("Should print this sentence if code is run to end.")
+        return run_id
 
-    model_path = '/app/models/ridge_model.jlib'
-    eval = Eval(y_test_path, X_test_path, model_path, h)
+    except Exception as e:
+        logger.error(f"Preprocessing failed with error: {str(e)}")
+        raise
 
-    eval.Evalulate()
 
-    print("Evaluation Finishes")
+if __name__ == "__main__":
+    import sys
 
-    print("Should print this sentence if code is run to end.")
+    from main import main
 
-except Exception as e:
-    logger.error(f"Preprocessing failed with error: {str(e)}")
-    raise
\ No newline at end of file
+    # Same as python src/main.py, which sets up logging and profiling
+    main(['pipeline'] + sys.argv[1:])
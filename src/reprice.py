@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Re-prices every listing of a raw CBB_Listings style dump with one or more model versions.
+
+The models are the ones the api serves (models folder, MODEL_DIR, MODEL_FORMAT and MODEL_RUNS),
+and missing values are filled with the means and modes of the processed train split, so the
+prices match what the api would return for the same listings.
+
+Run with: python src/reprice.py --input data/raw/CBB_Listings.csv --output prices.parquet --versions v1 v2
+"""
+import argparse
+import logging
+import os
+
+from utils.arg_parser import load_config
+
+logger = logging.getLogger(__name__)
+
+
+def get_args(args=None):
+    config = load_config()
+    reprice = config.get("reprice", {})
+
+    from preprocess import split_paths
+
+    parser = argparse.ArgumentParser(description="Re-price every listing of a raw listing dump with several model versions")
+    parser.add_argument('--input', type=str, default=os.path.join(config["data_directory"], "CBB_Listings.csv"),
+                        help='Raw listing dump to price')
+    parser.add_argument('--output', type=str, default=reprice.get("output", "prices.parquet"),
+                        help='Parquet or CSV file to write the prices to')
+    parser.add_argument('--versions', type=str, nargs='+', default=reprice.get("versions", ["v1", "v2"]),
+                        help='Model versions to price with, one price column each')
+    parser.add_argument('--chunksize', type=int, default=reprice.get("chunksize", 100000),
+                        help='Rows of the dump read and scored at a time')
+    parser.add_argument('--workers', type=int, default=reprice.get("workers", 0),
+                        help='Worker processes scoring chunks (0 uses every core)')
+    parser.add_argument('--active_only', action='store_true',
+                        help='Only price listings without a drop off date')
+    parser.add_argument('--train_split', type=str,
+                        default=split_paths(config.get("data_format", "parquet"))[0],
+                        help='Processed X_train split that missing values are filled from')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = get_args(args)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        handlers=[logging.StreamHandler()])
+
+    from utils.data_io import load_split
+    from utils.model_registry import default_registry
+    from utils.repricing import reprice, scoring_fill_values
+
+    try:
+
+        registry = default_registry()
+        unknown = [version for version in args.versions if version not in registry.model_paths]
+        if unknown:
+            raise ValueError(f"Unknown model versions {unknown}, expected some of {list(registry.model_paths)}")
+        models = {version: registry.get(version) for version in args.versions}
+        encoders = {version: registry.get_encoder(version) for version in args.versions}
+
+        values = scoring_fill_values(load_split(args.train_split))
+
+        summary = reprice(args.input, args.output, models, values, args.chunksize, args.workers, args.active_only,
+                          encoders)
+        print(f"Priced {summary['rows']} listings with {', '.join(args.versions)} in {summary['seconds']:.1f}s "
+              f"({summary['rows_per_second']:.0f} rows/sec), written to {args.output}")
+        return summary
+
+    except Exception as e:
+        logger.error(f"Re-pricing failed with error: {str(e)}")
+        raise
+
+
+if __name__ == "__main__":
+    main()
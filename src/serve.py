@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Production launcher for predict_api.py with several worker processes.
+
+The parent process loads every model version once, opens the listening socket and then forks
+the workers. All workers accept connections from the same socket and read the models the parent
+loaded through copy-on-write memory, so adding a worker does not add another copy of the models.
+Workers that exit are started again until the launcher gets SIGTERM or Ctrl-C.
+Every worker writes its metrics and shadow scoring sums to a folder the launcher owns, so
+/metrics and /shadow on any worker show the totals of all of them.
+
+Run with: python src/serve.py --workers 8 --host 0.0.0.0 --port 5001
+"""
+import argparse
+import gc
+import glob
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+import predict_api
+from utils.instrumentation import configure_logging, stop_logging
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes, 0 starts one per core
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", 0))
+
+# Connections the kernel queues for the workers before refusing new ones
+LISTEN_BACKLOG = 1024
+
+# Folder the workers share their metrics and shadow sums through, a temporary folder removed on exit by default
+METRICS_DIR = os.environ.get("METRICS_DIR")
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser(description="Serve the car price prediction api with several worker processes")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=9999, help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS,
+                        help='Number of worker processes, 0 starts one per core')
+    return parser.parse_args(args)
+
+
+def open_socket(host, port):
+    """Binds the listening socket the workers share."""
+    sock = socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def open_metrics_dir(folder=METRICS_DIR):
+    """
+    Returns the folder the workers share their metrics through, and whether it is temporary.
+    Snapshots of an earlier launcher are removed, counters start from zero with every launcher.
+    """
+    if not folder:
+        return tempfile.mkdtemp(prefix="predict_api_metrics-"), True
+
+    os.makedirs(folder, exist_ok=True)
+    for path in glob.glob(os.path.join(folder, "*.json")) + glob.glob(os.path.join(folder, "shadow-generation")):
+        os.remove(path)
+    return folder, False
+
+
+def run_worker(sock, host, port, metrics_dir):
+    """Serves requests from the shared socket until the worker gets SIGTERM."""
+    # The parent's log writer thread did not survive the fork
+    configure_logging()
+
+    # Ctrl-C reaches the whole process group, the parent stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Threads do not survive the fork, so the micro-batcher and shadow scorer start in every worker
+    if predict_api.batcher is not None:
+        predict_api.batcher.start()
+    if predict_api.shadow is not None:
+        predict_api.shadow.share(metrics_dir)
+        predict_api.shadow.start()
+    predict_api.metrics.share(metrics_dir)
+
+    server = make_server(host, port, predict_api.app, threaded=True, fd=sock.fileno())
+
+    # shutdown() waits for serve_forever() to return, so it has to run on another thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+    logger.info(f"Worker {os.getpid()} serving on http://{host}:{port}")
+    server.serve_forever()
+    server.server_close()
+    predict_api.metrics.stop_sharing()
+
+
+def spawn_worker(sock, host, port, metrics_dir):
+    """Forks a worker process and returns its pid."""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    code = 0
+    try:
+        run_worker(sock, host, port, metrics_dir)
+    except BaseException as e:
+        logger.error(f"Worker {os.getpid()} failed with error: {str(e)}")
+        code = 1
+    finally:
+        stop_logging()
+        os._exit(code)
+
+
+def serve(host, port, workers=0):
+    """Loads the models, then forks the workers and restarts any that exit."""
+    workers = workers or os.cpu_count() or 1
+
+    try:
+        predict_api.registry.preload()
+        sock = open_socket(host, port)
+        metrics_dir, temporary = open_metrics_dir()
+    except Exception as e:
+        logger.error(f"Could not start the api: {str(e)}")
+        raise
+
+    # Move everything loaded so far out of the garbage collector's reach, so collections in the
+    # workers do not write to the pages they share with the parent
+    gc.freeze()
+
+    children = {spawn_worker(sock, host, port, metrics_dir) for _ in range(workers)}
+    logger.info(f"Started {workers} workers on http://{host}:{port}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with code {os.waitstatus_to_exitcode(status)}, starting a new one")
+            time.sleep(0.1)
+            children.add(spawn_worker(sock, host, port, metrics_dir))
+
+    sock.close()
+    if temporary:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+    logger.info("All workers stopped")
+
+
+def main(args=None):
+    args = get_args(args)
+    configure_logging()
+    serve(args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,29 @@
 #!/usr/bin/env python3
+"""
+File should import the cleaned split data, encode the features, train using a ridge model with best params, and then export model to model folder.
+
+mlflow, sklearn and the sweep, path, segmented and incremental solvers are imported by the methods that use
+them, so importing this module is fast and has no side effects.
+"""
 
 import logging
+import os
+import shutil
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',    handlers=[
-        logging.StreamHandler()])  
+import numpy as np
+
+from utils.data_io import load_split
+from utils.feature_encoder import FeatureEncoder, schema_path
+from utils.profiling import stage
 
 logger = logging.getLogger(__name__)
 
-"""
-File should import the cleaned split data, encode the features, train using a ridge model with best params, and then export model to model folder.
-"""
+# Folder the trained model is exported to for the api
+MODEL_EXPORT_DIR = os.environ.get("MODEL_EXPORT_DIR", "/app/models")
 
-import pandas as pd
-import numpy as np
-from sklearn.preprocessing import LabelEncoder
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.linear_model import Ridge
-from sklearn.preprocessing import MaxAbsScaler
-from sklearn.pipeline import Pipeline
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import GridSearchCV
-from sklearn.metrics import r2_score, mean_squared_error, mean_absolute_error # Import necessary metrics
-import matplotlib.pyplot as plt
-import os
-import shutil
-import mlflow
-import mlflow.sklearn 
-from utils.arg_parser import get_input_args
+# The encoding schema in a logged mlflow model folder, next to its model.pkl
+MLFLOW_SCHEMA_FILE = schema_path("model.pkl")
 
-in_arg = get_input_args()
 
 class Train:
     def __init__(self,X_train_path, X_test_path, y_train_path, y_test_path, solver, alpha, fit_intercept):
@@ -42,13 +37,83 @@ class Train:
         self.alpha = alpha 
         self.fit_intercept = fit_intercept
 
+        # Encoder fitted on the train split, saved as the encoding schema of every exported model
+        self.encoder = None
+
+    def load_training_data(self):
+        """Loads the train split and encodes it with the same compiled encoder used by evaluation and the api."""
+        with stage('load'):
+            X_train = load_split(self.X_train_path)
+            y_train = load_split(self.y_train_path)
+
+        with stage('encode'):
+            self.encoder = FeatureEncoder.from_frame(X_train)
+            X_train = self.encoder.to_frame(self.encoder.encode_frame(X_train))
+
+        return X_train, y_train
+
+    def export_schema(self, model_file):
+        """Saves the encoding schema next to an exported model file in the models folder."""
+        self.encoder.save_schema(schema_path(os.path.join(MODEL_EXPORT_DIR, model_file)))
+
+    def log_schema(self, artifact_path="model"):
+        """Logs the encoding schema into the logged model folder of the active run."""
+        import mlflow
+
+        mlflow.log_dict(self.encoder.schema(), f"{artifact_path}/{MLFLOW_SCHEMA_FILE}")
+
+    def export_model(self, model):
+        """Saves the model with joblib and moves it to the models folder, next to its encoding schema."""
+        import joblib
+
+        # Target folder to move model to
+        target_folder = "/home/machine/cmpt3830/models"
+        target_folder = MODEL_EXPORT_DIR
+
+        # Save the model with joblib 
+        joblib.dump(model , 'ridge_model_v2.jlib')
+
+        # export model to models file
+        # The schema goes first, the api reloads the model as soon as the file changes
+        self.export_schema("ridge_model_v2.jlib")
+        destination_path = os.path.join(target_folder, "ridge_model_v2.jlib")
+        shutil.move("ridge_model_v2.jlib", destination_path)
+
+    def refit_and_export(self, X_train, y_train):
+        """Fits the chosen parameters on the whole train split, logs the model to the active run and exports it."""
+        from sklearn.linear_model import Ridge
+
+        with stage('refit'):
+            model = Ridge(alpha=self.alpha, fit_intercept=self.fit_intercept, solver=self.solver)
+            model = model.fit(X_train, y_train)
+
+        self.log_and_export(model, X_train.iloc[:1])
+        return model
+
+    def log_and_export(self, model, input_example):
+        """Logs the parameters and model to the active run and exports the model."""
+        import mlflow
+        import mlflow.sklearn
+
+        with stage('log_model'):
+            mlflow.log_params({'alpha': self.alpha, 'fit_intercept': self.fit_intercept, 'solver': self.solver})
+            mlflow.sklearn.log_model(model, artifact_path="model", input_example=input_example)
+            self.log_schema()
+
+        with stage('export'):
+            self.export_model(model)
+
     def trainmodel(self):
+        import mlflow
+        import mlflow.sklearn
+        from sklearn.linear_model import Ridge
+        from sklearn.preprocessing import MaxAbsScaler
 
         try: 
             
             logger.info(f"Training commencing")
             # Start an MLflow run using the context manager
-            with mlflow.start_run(run_name=f"GoAuto{in_arg.alpha}") as run:
+            with mlflow.start_run(run_name=f"GoAuto{self.alpha}") as run:
                 
                 mlflow_tracking_uri = os.environ.get("http://localhost:5000")
                 mlflow.set_tracking_uri(mlflow_tracking_uri)
@@ -62,19 +127,8 @@ class Train:
                 mlflow.log_param("alpha", 0.1)
                 mlflow.log_param("fit_intercept", True)
                 """
-                # Load data
-                X_train = pd.read_csv(self.X_train_path)
-                X_test = pd.read_csv(self.X_test_path)
-                y_train = pd.read_csv(self.y_train_path)
-                y_test = pd.read_csv(self.y_test_path)
-
-                # Encode columns
-                X_train = pd.get_dummies(X_train,prefix=['transmission_from_vin'], columns = ['transmission_from_vin'], drop_first=True, dtype=float)
-                X_train = pd.get_dummies(X_train,prefix=['stock_type'], columns = ['stock_type'], drop_first=True, dtype=float)
-                X_train = pd.get_dummies(X_train,prefix=['make'], columns = ['make'], drop_first=False, dtype=float)
-                X_test = pd.get_dummies(X_test,prefix=['transmission_from_vin'], columns = ['transmission_from_vin'], drop_first=True, dtype=float)
-                X_test = pd.get_dummies(X_test,prefix=['stock_type'], columns = ['stock_type'], drop_first=True, dtype=float)
-                X_test = pd.get_dummies(X_test,prefix=['make'], columns = ['make'], drop_first=False, dtype=float)
+                # Load and encode data
+                X_train, y_train = self.load_training_data()
 
                 """
                 Removed pipeline since it was messing with export of model and instead manually input best params
@@ -84,26 +138,17 @@ class Train:
                 MMS = MaxAbsScaler()
                 MMS.fit(X_train)
 
-                X_train = X_train.drop(columns=['make_Suzuki'])
-
-                model = Ridge(alpha=self.alpha, fit_intercept=self.fit_intercept, solver=self.solver)
-                model = model.fit(X_train, y_train)
+                # The time autolog takes to log the model is part of the fit
+                with stage('fit'):
+                    model = Ridge(alpha=self.alpha, fit_intercept=self.fit_intercept, solver=self.solver)
+                    model = model.fit(X_train, y_train)
 
                 # Done by autolog
                 #mlflow.sklearn.log_model(model, artifact_path="model", input_example=X_train.iloc[:1])
-                
-                import joblib
-
-                # Target folder to move model to
-                target_folder = "/home/machine/cmpt3830/models"
-                target_folder = "/app/models"
+                self.log_schema()
 
-                # Save the model with joblib 
-                joblib.dump(model , 'ridge_model_v2.jlib')
-
-                # export model to models file
-                destination_path = os.path.join(target_folder, "ridge_model_v2.jlib")
-                shutil.move("ridge_model_v2.jlib", destination_path)
+                with stage('export'):
+                    self.export_model(model)
 
                 # Trouble shooting below
                 autolog_run = mlflow.active_run()
@@ -117,4 +162,171 @@ class Train:
         
         except Exception as e:
             logger.error(f"Training failed with error: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+    def sweep(self, space, search='grid', n_iter=20, workers=0, validation_size=0.2, random_state=42):
+        """
+        Fits every candidate of the search space in parallel, logs each as a nested mlflow run,
+        then refits the best parameters on the whole train split and exports that model.
+        """
+        import mlflow
+        from utils.sweep import run_sweep, sweep_candidates
+
+        try:
+
+            logger.info(f"Sweep commencing")
+            with mlflow.start_run(run_name=f"GoAutoSweep_{search}") as run:
+
+                X_train, y_train = self.load_training_data()
+
+                candidates = sweep_candidates(space, search, n_iter, random_state)
+                with stage('fit'):
+                    results = run_sweep(X_train.to_numpy(np.float64), y_train.to_numpy(np.float64), candidates,
+                                        workers, validation_size, random_state)
+
+                mlflow.log_params({'search': search, 'candidates': len(candidates), 'validation_size': validation_size})
+
+                for rank, result in enumerate(results, start=1):
+                    with mlflow.start_run(run_name=f"candidate_{rank}", nested=True):
+                        mlflow.log_params(result['params'])
+                        mlflow.log_metrics(result['metrics'])
+                        mlflow.log_metric('rank', rank)
+
+                best = results[0]
+                logger.info(f"Best parameters {best['params']} with {best['metrics']}")
+
+                self.solver = best['params'].get('solver', self.solver)
+                self.alpha = best['params'].get('alpha', self.alpha)
+                self.fit_intercept = best['params'].get('fit_intercept', self.fit_intercept)
+
+                mlflow.log_metrics({f"best_{name}": value for name, value in best['metrics'].items()})
+                self.refit_and_export(X_train, y_train)
+
+                logger.info("Sweep finished")
+                return run.info.run_id
+
+        except Exception as e:
+            logger.error(f"Sweep failed with error: {str(e)}")
+            raise
+
+    def alpha_path(self, low=0.001, high=1000.0, num=100, validation_size=0.2, random_state=42):
+        """
+        Solves the whole Ridge regularization path from one decomposition, scores every alpha
+        on a held out share of the train split, then refits and exports the best alpha.
+        """
+        import mlflow
+        from utils.ridge_path import alpha_grid, path_scores, ridge_path
+        from utils.sweep import holdout_split
+
+        try:
+
+            logger.info(f"Regularization path commencing")
+            with mlflow.start_run(run_name=f"GoAutoPath{num}") as run:
+
+                X_train, y_train = self.load_training_data()
+                X = X_train.to_numpy(np.float64)
+                y = y_train.to_numpy(np.float64).ravel()
+
+                order, n_fit = holdout_split(len(X), validation_size, random_state)
+                fit_rows, val_rows = order[:n_fit], order[n_fit:]
+
+                alphas = alpha_grid(low, high, num)
+                with stage('fit'):
+                    coefs, intercepts = ridge_path(X[fit_rows], y[fit_rows], alphas, self.fit_intercept)
+                with stage('predict'):
+                    scores = path_scores(X[val_rows], y[val_rows], coefs, intercepts)
+
+                mlflow.log_params({'path_low': low, 'path_high': high, 'path_num': num, 'validation_size': validation_size})
+
+                # One metric series over the path, with the alpha index as the step
+                for step, alpha in enumerate(alphas):
+                    mlflow.log_metrics({'path_alpha': alpha, **{name: values[step] for name, values in scores.items()}},
+                                       step=step)
+
+                best = int(np.argmax(scores['val_r2']))
+                self.alpha = float(alphas[best])
+                logger.info(f"Best alpha {self.alpha} with val_r2 {scores['val_r2'][best]:.4f}")
+
+                mlflow.log_metrics({f"best_{name}": float(values[best]) for name, values in scores.items()})
+                self.refit_and_export(X_train, y_train)
+
+                logger.info("Regularization path finished")
+                return run.info.run_id
+
+        except Exception as e:
+            logger.error(f"Regularization path failed with error: {str(e)}")
+            raise
+
+    def train_segmented(self, min_rows=500, groups=None, workers=0, validation_size=0.2, random_state=42):
+        """
+        Fits one model per make (or group of makes in groups) and a global model for the rest in
+        parallel, logs the bundle and exports it as ridge_segmented_v3.npz for the api.
+        """
+        import mlflow
+        import mlflow.sklearn
+        from utils.segmented import fit_segmented
+
+        try:
+
+            logger.info(f"Segmented training commencing")
+            with mlflow.start_run(run_name=f"GoAutoSegmented{self.alpha}") as run:
+
+                X_train, y_train = self.load_training_data()
+
+                params = {'alpha': self.alpha, 'fit_intercept': self.fit_intercept, 'solver': self.solver}
+                with stage('fit'):
+                    model, segments, metrics = fit_segmented(X_train.to_numpy(np.float64), y_train.to_numpy(np.float64),
+                                                             X_train.columns, params, min_rows, groups, workers,
+                                                             validation_size, random_state)
+
+                mlflow.log_params({**params, 'segment_min_rows': min_rows, 'segment_groups': len(groups or {}),
+                                   'validation_size': validation_size})
+                mlflow.log_metrics(metrics)
+                mlflow.log_dict(segments, "segments.json")
+                logger.info(f"Fitted {len(segments)} segments with {metrics}")
+
+                with stage('log_model'):
+                    mlflow.sklearn.log_model(model, artifact_path="model")
+                    self.log_schema()
+
+                # The bundle is served straight from its .npz export
+                with stage('export'):
+                    model.save('ridge_segmented_v3.npz')
+                    self.export_schema('ridge_segmented_v3.npz')
+                    shutil.move('ridge_segmented_v3.npz', os.path.join(MODEL_EXPORT_DIR, 'ridge_segmented_v3.npz'))
+
+                logger.info("Segmented training finished")
+                return run.info.run_id
+
+        except Exception as e:
+            logger.error(f"Segmented training failed with error: {str(e)}")
+            raise
+
+    def train_incremental(self, chunksize=100000):
+        """
+        Trains on the train split chunk by chunk from accumulated X'X and X'y, so the split never
+        has to fit in memory, then logs and exports the model like trainmodel.
+        """
+        import mlflow
+        from utils.incremental import fit_incremental
+
+        try:
+
+            logger.info(f"Incremental training commencing")
+            with mlflow.start_run(run_name=f"GoAutoIncremental{self.alpha}") as run:
+
+                model, self.encoder, n_rows = fit_incremental(self.X_train_path, self.y_train_path, self.alpha,
+                                                              self.fit_intercept, self.solver, chunksize)
+
+                mlflow.log_params({'train_chunksize': chunksize})
+                mlflow.log_metric('train_rows', n_rows)
+
+                input_example = self.encoder.to_frame(np.zeros((1, self.encoder.n_features)))
+                self.log_and_export(model, input_example)
+
+                logger.info(f"Incremental training finished on {n_rows} rows")
+                return run.info.run_id
+
+        except Exception as e:
+            logger.error(f"Incremental training failed with error: {str(e)}")
+            raise
@@ -19,8 +19,8 @@ def load_config():
 
     return config
 
-def get_input_args():
-    """Parses command-line arguments with defaults loaded from a YAML file."""
+def get_input_args(args=None):
+    """Parses command-line arguments (or the list args) with defaults loaded from a YAML file."""
     config = load_config()
 
     parser = argparse.ArgumentParser(description="Command-line arguments for CNN training and prediction")
@@ -33,6 +33,63 @@ def get_input_args():
 
     parser.add_argument('--data_directory', type=str, default=config["data_directory"], help='Path to goauto data')
 
-    args = parser.parse_args()
+    parser.add_argument('--chunksize', type=int, default=config.get("chunksize", 0), help='Rows per chunk to preprocess the raw data in a streaming pass (0 loads it all at once)')
 
-    return args
\ No newline at end of file
+    parser.add_argument('--data_format', type=str, default=config.get("data_format", "parquet"), choices=['parquet', 'csv'], help='File format of the processed train/test splits')
+
+    parser.add_argument('--force_preprocess', action='store_true', help='Clean the raw data again even if the processed data cache is up to date')
+
+    sweep = config.get("sweep", {})
+
+    parser.add_argument('--sweep', action='store_true', help='Run a parallel hyperparameter sweep instead of training a single model')
+
+    parser.add_argument('--sweep_search', type=str, default=sweep.get("search", "grid"), choices=['grid', 'random'], help='Search over the sweep space')
+
+    parser.add_argument('--sweep_iter', type=int, default=sweep.get("n_iter", 20), help='Number of candidates drawn by a random search')
+
+    parser.add_argument('--sweep_workers', type=int, default=sweep.get("workers", 0), help='Worker processes for the sweep (0 uses every core)')
+
+    parser.add_argument('--sweep_validation_size', type=float, default=sweep.get("validation_size", 0.2), help='Share of the train split held out to rank sweep candidates')
+
+    # The search space itself is only set in parameters.yml
+    parser.set_defaults(sweep_space=sweep.get("space", {}))
+
+    parser.add_argument('--train_chunksize', type=int, default=config.get("train_chunksize", 0), help='Rows per chunk to train on the train split incrementally (0 loads it all at once)')
+
+    parser.add_argument('--eval_batch_size', type=int, default=config.get("eval_batch_size", 100000), help='Rows per batch when evaluating on the test split')
+
+    parser.add_argument('--eval_workers', type=int, default=config.get("eval_workers", 0), help='Worker processes scoring test batches (0 uses every core)')
+
+    alpha_path = config.get("alpha_path", {})
+
+    parser.add_argument('--alpha_path', action='store_true', help='Score a whole regularization path of alphas from one decomposition instead of training a single model')
+
+    parser.add_argument('--path_num', type=int, default=alpha_path.get("num", 100), help='Number of log spaced alphas on the regularization path')
+
+    # Range and hold out of the path are only set in parameters.yml
+    parser.set_defaults(path_low=alpha_path.get("low", 0.001), path_high=alpha_path.get("high", 1000.0),
+                        path_validation_size=alpha_path.get("validation_size", 0.2))
+
+    segmented = config.get("segmented", {})
+
+    parser.add_argument('--segmented', action='store_true', help='Fit one model per make and a global model for rare makes instead of a single model')
+
+    parser.add_argument('--segment_min_rows', type=int, default=segmented.get("min_rows", 500), help='Training rows a make (or make group) needs to get its own model')
+
+    parser.add_argument('--segment_workers', type=int, default=segmented.get("workers", 0), help='Worker processes fitting the segment models (0 uses every core)')
+
+    # Make groups and the hold out are only set in parameters.yml
+    parser.set_defaults(segment_groups=segmented.get("groups") or {},
+                        segment_validation_size=segmented.get("validation_size", 0.2))
+
+    parser.add_argument('--run_id', type=str, default=None, help='mlflow run of the model to evaluate when only evaluating')
+
+    profile = config.get("profile", {})
+
+    parser.add_argument('--profile', action='store_true', help='Record wall time, CPU time and peak memory of every stage and sub-step and log them to the mlflow run')
+
+    parser.add_argument('--profile_dumps', type=str, nargs='*', default=profile.get("dumps", []), choices=['cprofile', 'tracemalloc'], help='Also write cProfile and/or tracemalloc dumps of every stage (implies --profile)')
+
+    parser.add_argument('--profile_dir', type=str, default=profile.get("dir", "profiles"), help='Folder the profile dumps and stage timings are written to')
+
+    return parser.parse_args(args)
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""
+Local on-disk cache of MLflow model artifacts, keyed by run id.
+
+Loading runs:/<run_id>/model goes to the tracking store and downloads the artifact every time.
+The cache downloads each run's model folder once into MODEL_CACHE_DIR and serves it from disk
+after that, also across restarts. When the cache grows past MODEL_CACHE_MAX_MB the least recently
+used runs are removed.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# Automatically detect the root directory of the ML project
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", os.path.join(PROJECT_ROOT, ".model_cache"))
+MODEL_CACHE_MAX_MB = float(os.environ.get("MODEL_CACHE_MAX_MB", 1024))
+
+# File in every cached entry whose modification time records when the entry was last used
+LAST_USED_FILE = ".last_used"
+
+
+def folder_size(path):
+    """Total size in bytes of the files under path."""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def sklearn_model_file(model_dir):
+    """Path of the pickled model inside an MLflow sklearn model folder."""
+    with open(os.path.join(model_dir, "MLmodel"), "r") as file:
+        mlmodel = yaml.safe_load(file)
+    return os.path.join(model_dir, mlmodel["flavors"]["sklearn"]["pickled_model"])
+
+
+class ArtifactCache:
+    """
+    Keeps downloaded run artifacts under folder/<run_id>/<artifact_path>.
+    Entries are downloaded to a temporary folder and renamed into place, so an entry
+    that exists is always complete, even with several processes sharing the cache.
+    """
+
+    def __init__(self, folder=MODEL_CACHE_DIR, max_mb=MODEL_CACHE_MAX_MB):
+        self.folder = folder
+        self.max_bytes = max_mb * 1024 ** 2
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry_dir(self, run_id):
+        return os.path.join(self.folder, run_id)
+
+    def _touch(self, entry_dir):
+        with open(os.path.join(entry_dir, LAST_USED_FILE), "a"):
+            pass
+        os.utime(os.path.join(entry_dir, LAST_USED_FILE))
+
+    def local_path(self, run_id, artifact_path="model"):
+        """Local path of a run's artifact, downloaded from the tracking store on first use."""
+        entry_dir = self._entry_dir(run_id)
+        path = os.path.join(entry_dir, artifact_path)
+
+        with self._lock:
+            if os.path.exists(path):
+                self.hits += 1
+                self._touch(entry_dir)
+                return path
+
+            self.misses += 1
+            self._download(run_id, artifact_path, entry_dir)
+            self.evict(keep=run_id)
+            return path
+
+    def _download(self, run_id, artifact_path, entry_dir):
+        import mlflow.artifacts
+
+        start = time.perf_counter()
+        os.makedirs(self.folder, exist_ok=True)
+        download_dir = tempfile.mkdtemp(prefix=".download-", dir=self.folder)
+        try:
+            # Keep the other artifacts of the run that are already cached
+            if os.path.isdir(entry_dir):
+                shutil.copytree(entry_dir, download_dir, dirs_exist_ok=True)
+
+            mlflow.artifacts.download_artifacts(artifact_uri=f"runs:/{run_id}/{artifact_path}", dst_path=download_dir)
+            self._touch(download_dir)
+
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            try:
+                os.rename(download_dir, entry_dir)
+            except OSError:
+                # Another process cached the same run first
+                logger.info(f"Run {run_id} was cached by another process")
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+        logger.info(f"Cached {artifact_path} of run {run_id} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def entries(self):
+        """Cached run ids with their size in bytes and last use time, least recently used first."""
+        if not os.path.isdir(self.folder):
+            return []
+
+        entries = []
+        for run_id in os.listdir(self.folder):
+            entry_dir = self._entry_dir(run_id)
+            if run_id.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+            marker = os.path.join(entry_dir, LAST_USED_FILE)
+            last_used = os.path.getmtime(marker) if os.path.exists(marker) else 0.0
+            entries.append((run_id, folder_size(entry_dir), last_used))
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep=None):
+        """Removes the least recently used runs until the cache fits in max_mb."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+
+        for run_id, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if run_id == keep:
+                continue
+            shutil.rmtree(self._entry_dir(run_id), ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted run {run_id} from the model cache")
+
+    def model_file(self, run_id, artifact_path="model"):
+        """Local path of the pickled sklearn model logged to a run."""
+        return sklearn_model_file(self.local_path(run_id, artifact_path))
+
+    def load_model(self, run_id, artifact_path="model"):
+        """Loads the sklearn model logged to a run from the cache."""
+        import mlflow.sklearn
+
+        return mlflow.sklearn.load_model(self.local_path(run_id, artifact_path))
+
+    def stats(self):
+        """Hit and miss counts and the current size of the cache."""
+        entries = self.entries()
+        return {
+            "folder": self.folder,
+            "runs": len(entries),
+            "size_mb": sum(size for _, size, _ in entries) / 1024 ** 2,
+            "max_mb": self.max_bytes / 1024 ** 2,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_default_cache = None
+
+
+def default_cache():
+    """The artifact cache in MODEL_CACHE_DIR shared by evaluation and the api."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ArtifactCache()
+    return _default_cache
@@ -0,0 +1,253 @@
+"""
+Streaming version of the cleaning in utils/cleaning.py for listing dumps that are too big to load at once.
+
+The raw file is read twice in chunks. The first pass only keeps small totals grouped by the
+outlier columns (row counts, sums and category counts), which is enough to work out the IQR
+bounds and the means and modes of the rows that survive the outlier filter. The second pass
+cleans every chunk with those statistics and appends it to the train/test splits.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from utils.cleaning import (INVALID_ZERO_COLUMNS, OUTLIER_COLUMNS, RARE_COLUMNS, RARE_MAX_COUNT,
+                            TRANSMISSION_CODES, X_COLUMNS, Y_COLUMN, iqr_mask, replace_low_values)
+from utils.data_io import SplitWriter
+from utils.profiling import iterate, peak_rss_mb, stage
+
+logger = logging.getLogger(__name__)
+
+# Only the columns that the cleaning and the model need are read, with fixed dtypes
+MEAN_COLUMNS = ['mileage', 'price', 'msrp', 'model_year']
+MODE_COLUMNS = ['stock_type', 'make', 'transmission_from_vin'] + [column for column in RARE_COLUMNS if column not in X_COLUMNS]
+
+NUMERIC_DTYPES = {column: 'float64' for column in MEAN_COLUMNS + OUTLIER_COLUMNS}
+CATEGORICAL_DTYPES = {column: 'str' for column in MODE_COLUMNS}
+
+# listing_id is read as well so that duplicate rows can be told apart from repeat listings
+DEDUP_DTYPES = {'listing_id': 'str'}
+
+USECOLS = list(DEDUP_DTYPES) + list(NUMERIC_DTYPES) + list(CATEGORICAL_DTYPES)
+
+# Zeros are only replaced in the columns that are read
+ZERO_COLUMNS = [column for column in INVALID_ZERO_COLUMNS if column in MEAN_COLUMNS]
+
+
+def read_chunks(file_path, chunksize):
+    """Reads the raw listings in chunks with only the needed columns."""
+    dtypes = {**DEDUP_DTYPES, **NUMERIC_DTYPES, **CATEGORICAL_DTYPES}
+    return pd.read_csv(file_path, usecols=USECOLS, dtype=dtypes, chunksize=chunksize)
+
+
+def weighted_quantile(values, counts, q):
+    """
+    Quantile of values that each appear counts times, with the same linear
+    interpolation as pandas Series.quantile.
+    """
+    order = np.argsort(values)
+    values = np.asarray(values)[order]
+    cumulative = np.cumsum(np.asarray(counts)[order])
+
+    position = q * (cumulative[-1] - 1)
+    lower = int(np.floor(position))
+    upper = int(np.ceil(position))
+
+    lower_value = values[np.searchsorted(cumulative, lower, side='right')]
+    upper_value = values[np.searchsorted(cumulative, upper, side='right')]
+
+    return lower_value + (upper_value - lower_value) * (position - lower)
+
+
+class Deduplicator:
+    """
+    Drops rows already seen in this or an earlier chunk.
+    Only a sorted array of 64 bit row hashes is kept between chunks.
+    """
+
+    def __init__(self):
+        self.seen = np.empty(0, dtype=np.uint64)
+
+    def keep(self, chunk):
+        """Boolean mask of the rows in chunk that are seen for the first time."""
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+
+        keep = ~pd.Series(hashes).duplicated().to_numpy()
+        keep &= ~np.isin(hashes, self.seen)
+
+        self.seen = np.union1d(self.seen, hashes[keep])
+        return keep
+
+
+class ChunkedStats:
+    """
+    Running totals grouped by the outlier columns that are turned into the cleaning
+    statistics once every chunk has been seen.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.sizes = None
+        self.sums = None
+        self.counts = None
+        self.category_counts = {column: None for column in MODE_COLUMNS}
+        self.missing = {column: None for column in RARE_COLUMNS}
+
+    @staticmethod
+    def _add(total, part):
+        return part if total is None else total.add(part, fill_value=0)
+
+    def update(self, chunk):
+        """Adds one deduplicated chunk to the running totals."""
+        self.rows += len(chunk)
+        groups = [chunk[column] for column in OUTLIER_COLUMNS]
+
+        self.sizes = self._add(self.sizes, chunk.groupby(groups).size())
+
+        # Zeros are treated as missing before the means are taken
+        values = chunk[MEAN_COLUMNS].copy()
+        values[ZERO_COLUMNS] = values[ZERO_COLUMNS].replace(0, np.nan)
+        grouped = values.groupby(groups)
+        self.sums = self._add(self.sums, grouped.sum())
+        self.counts = self._add(self.counts, grouped.count())
+
+        for column in MODE_COLUMNS:
+            counts = chunk.groupby(groups + [chunk[column]]).size()
+            self.category_counts[column] = self._add(self.category_counts[column], counts)
+
+        # Missing values are filled with the mode before rare values are counted
+        for column in RARE_COLUMNS:
+            missing = chunk[column].isna().groupby(groups).sum()
+            self.missing[column] = self._add(self.missing[column], missing)
+
+    def _inside(self, index, lower_bound, upper_bound):
+        """Mask of the outlier column groups in index that are inside the bounds."""
+        inside = np.ones(len(index), dtype=bool)
+        for level, column in enumerate(OUTLIER_COLUMNS):
+            values = index.get_level_values(level).to_numpy(dtype=np.float64)
+            inside &= (values >= lower_bound[column]) & (values <= upper_bound[column])
+        return inside
+
+    def finalize(self):
+        """Works out the outlier bounds, fill values and the rare values to keep."""
+        lower_bound = {}
+        upper_bound = {}
+        for level, column in enumerate(OUTLIER_COLUMNS):
+            sizes = self.sizes.groupby(level=level).sum()
+            Q1 = weighted_quantile(sizes.index.to_numpy(dtype=np.float64), sizes.to_numpy(), 0.25)
+            Q3 = weighted_quantile(sizes.index.to_numpy(dtype=np.float64), sizes.to_numpy(), 0.75)
+            IQR = Q3 - Q1
+            lower_bound[column] = Q1 - 1.5 * IQR
+            upper_bound[column] = Q3 + 1.5 * IQR
+
+        # Only the groups inside the bounds count towards the statistics
+        inside = self._inside(self.sums.index, lower_bound, upper_bound)
+        means = self.sums[inside].sum() / self.counts[inside].sum()
+
+        modes = {}
+        keep_values = {}
+        for column in MODE_COLUMNS:
+            counts = self.category_counts[column]
+            counts = counts[self._inside(counts.index, lower_bound, upper_bound)]
+            counts = counts.groupby(level=len(OUTLIER_COLUMNS)).sum().sort_index()
+
+            # Ties go to the smallest value, like Series.mode()[0]
+            modes[column] = counts.idxmax()
+
+            if column in RARE_COLUMNS:
+                missing = self.missing[column]
+                counts[modes[column]] += missing[self._inside(missing.index, lower_bound, upper_bound)].sum()
+                keep_values[column] = set(counts[counts > RARE_MAX_COUNT].index)
+
+        return {
+            'lower_bound': pd.Series(lower_bound),
+            'upper_bound': pd.Series(upper_bound),
+            'means': means.to_dict(),
+            'modes': modes,
+            'keep_values': keep_values,
+        }
+
+
+def clean_chunk(chunk, stats):
+    """Applies the cleaning steps to one deduplicated chunk using the first pass statistics."""
+    chunk = chunk[iqr_mask(chunk, stats['lower_bound'], stats['upper_bound'])].copy()
+
+    # Replacing 0 with NaN and filling missing values with means and modes
+    chunk[ZERO_COLUMNS] = chunk[ZERO_COLUMNS].replace(0, np.nan)
+    chunk = chunk.fillna({**stats['means'], **stats['modes']})
+
+    # Replacing 6 with M and 7 with A
+    chunk['transmission_from_vin'] = chunk['transmission_from_vin'].replace(TRANSMISSION_CODES)
+
+    # Replacing low prices, msrps and used car mileages with the mean
+    chunk = replace_low_values(chunk, stats['means'])
+
+    # Removing rare categories
+    keep = np.ones(len(chunk), dtype=bool)
+    for column, values in stats['keep_values'].items():
+        keep &= chunk[column].isin(values).to_numpy()
+    return chunk[keep]
+
+
+def preprocess_chunked(file_path, output_folder='.', chunksize=100000, test_size=0.2, random_state=42, data_format='parquet'):
+    """
+    Cleans the raw listings in two streaming passes and writes the X_train, y_train,
+    X_test and y_test splits to output_folder chunk by chunk.
+
+    Rows are assigned to the test split at random with probability test_size, so the split
+    is reproducible for a given random_state but is not the same as train_test_split.
+    Returns a summary with row counts and the peak memory used.
+    """
+
+    # First pass collects the statistics
+    logger.info(f"First pass over {file_path} in chunks of {chunksize} rows")
+    deduplicator = Deduplicator()
+    totals = ChunkedStats()
+    rows_read = 0
+
+    with stage('first_pass'):
+        for chunk in iterate('read_csv', read_chunks(file_path, chunksize)):
+            rows_read += len(chunk)
+            with stage('dedup'):
+                chunk = chunk[deduplicator.keep(chunk)]
+            with stage('statistics'):
+                totals.update(chunk)
+
+    stats = totals.finalize()
+    logger.info(f"Keeping {OUTLIER_COLUMNS} between {stats['lower_bound'].to_dict()} and {stats['upper_bound'].to_dict()}")
+
+    # Second pass cleans and writes every chunk
+    logger.info("Second pass cleaning and splitting chunks")
+    writer = SplitWriter(output_folder, data_format)
+
+    deduplicator = Deduplicator()
+    rng = np.random.default_rng(random_state)
+    written = {'train': 0, 'test': 0}
+
+    with stage('second_pass'):
+        for chunk in iterate('read_csv', read_chunks(file_path, chunksize)):
+            with stage('dedup'):
+                chunk = chunk[deduplicator.keep(chunk)]
+            with stage('clean'):
+                chunk = clean_chunk(chunk, stats)
+
+            is_test = rng.random(len(chunk)) < test_size
+
+            with stage('write'):
+                for split, rows in (('train', chunk[~is_test]), ('test', chunk[is_test])):
+                    writer.write(f'X_{split}', rows[X_COLUMNS])
+                    writer.write(f'y_{split}', rows[Y_COLUMN])
+                    written[split] += len(rows)
+
+    writer.close()
+
+    summary = {
+        'rows_read': rows_read,
+        'rows_unique': totals.rows,
+        'rows_train': written['train'],
+        'rows_test': written['test'],
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    logger.info(f"Chunked preprocessing finished: {summary}")
+
+    return summary
@@ -0,0 +1,333 @@
+"""
+Cleaning steps for the raw CBB listings, shared by preprocessing, training and serving.
+Every step works on whole frames at once instead of looping over columns, and clean_and_split runs
+them on the raw file and writes the train and test splits.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.profiling import iterate, stage
+
+NUMERICAL_COLUMNS = ['mileage', 'price', 'msrp', 'model_year', 'wheelbase_from_vin', 'number_price_changes']
+
+CATEGORICAL_COLUMNS = ['stock_type', 'vin', 'make', 'model', 'series', 'style',
+                       'exterior_color', 'exterior_color_category', 'interior_color',
+                       'interior_color_category', 'drivetrain_from_vin', 'engine_from_vin',
+                       'transmission_from_vin', 'fuel_type_from_vin']
+
+# Columns where 0 is invalid and should be treated as missing values (NaN)
+INVALID_ZERO_COLUMNS = ['mileage', 'price', 'msrp', 'wheelbase_from_vin', 'number_price_changes']
+
+# Rows outside the IQR range of any of these columns are removed
+OUTLIER_COLUMNS = ['number_price_changes', 'wheelbase_from_vin']
+
+# Values below this are replaced with the column mean
+LOW_VALUE_COLUMNS = ['price', 'msrp']
+LOW_VALUE_LIMIT = 1000
+
+# Categories with this many rows or fewer in any of these columns are removed
+RARE_COLUMNS = ['exterior_color_category', 'interior_color_category', 'make', 'fuel_type_from_vin', 'model']
+RARE_MAX_COUNT = 3
+
+TRANSMISSION_CODES = {'6': 'M', '7': 'A'}
+
+X_COLUMNS = ['make', 'mileage', 'model_year', 'transmission_from_vin', 'stock_type', 'msrp']
+Y_COLUMN = 'price'
+
+
+class Vocabulary:
+    """The values of one text column and their integer codes, shared by every chunk that is read."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, values):
+        """Integer codes of a chunk of values, -1 for missing values. New values are added to the vocabulary."""
+        codes, uniques = pd.factorize(values)
+
+        lookup = np.empty(len(uniques) + 1, dtype=np.int32)
+        for position, value in enumerate(uniques):
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            lookup[position] = code
+
+        # The extra last entry maps the -1 of missing values to -1
+        lookup[-1] = -1
+        return lookup[codes]
+
+    def categorical(self, codes):
+        """A Categorical of the codes, with the categories sorted like astype('category') sorts them."""
+        values = np.array(self.values, dtype=object)
+        order = np.argsort(values)
+
+        rank = np.empty(len(order) + 1, dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        rank[-1] = -1
+        return pd.Categorical.from_codes(rank[codes], categories=values[order])
+
+
+def downcast_numeric(values):
+    """
+    Stores a numeric array in the smallest dtype that holds every value exactly: integers in the
+    smallest integer type, and floats in float32 when none of them lose precision.
+    """
+    if values.dtype.kind in 'iu':
+        return pd.to_numeric(values, downcast='integer')
+    if values.dtype == np.float64:
+        small = values.astype(np.float32)
+        if np.array_equal(small.astype(np.float64), values, equal_nan=True):
+            return small
+    return values
+
+
+def read_raw_listings(file_path, chunksize=50000, sample_rows=10000, unique_share=0.5):
+    """
+    Reads the raw listings into compact dtypes.
+
+    The file is read in chunks and every text column is dictionary encoded as it is read: each
+    chunk becomes integer codes against one vocabulary per column that grows over the chunks, so
+    only the strings of one chunk are held at a time. Text columns whose values are mostly unique
+    in the first sample_rows (like vin) stay strings, since a vocabulary would not be smaller.
+    Numeric columns the cleaning does not compute with are downcast chunk by chunk.
+    """
+    sample = pd.read_csv(file_path, nrows=sample_rows)
+
+    text_columns = [column for column in sample.columns
+                    if column in CATEGORICAL_COLUMNS or (column not in NUMERICAL_COLUMNS and sample[column].dtype == object)]
+    vocabularies = {column: Vocabulary() for column in text_columns
+                    if sample[column].nunique() <= unique_share * len(sample)}
+
+    dtypes = {column: 'str' for column in text_columns}
+    dtypes.update({column: 'float64' for column in sample.columns if column in NUMERICAL_COLUMNS})
+
+    parts = {column: [] for column in sample.columns}
+    for chunk in iterate('read_csv', pd.read_csv(file_path, dtype=dtypes, chunksize=chunksize)):
+        with stage('encode'):
+            for column in chunk.columns:
+                values = chunk[column]
+                if column in vocabularies:
+                    parts[column].append(vocabularies[column].encode(values))
+                elif column in NUMERICAL_COLUMNS or values.dtype == object:
+                    parts[column].append(values.to_numpy())
+                else:
+                    parts[column].append(downcast_numeric(values.to_numpy()))
+
+    # Chunks downcast to different dtypes are joined in the smallest dtype that holds them all
+    columns = {}
+    for column in list(parts):
+        values = np.concatenate(parts.pop(column)) if len(sample) else sample[column].to_numpy()
+        if column in vocabularies:
+            values = vocabularies.pop(column).categorical(values)
+        elif values.dtype == object and column not in text_columns:
+            # A numeric looking column that holds text further down the file
+            values = pd.Categorical(values)
+        columns[column] = values
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def replace_categories(values, mapping):
+    """
+    Replaces values of a Series through mapping. Categorical Series are recoded through their
+    vocabulary instead of row by row, and values mapped onto each other share one category.
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.replace(mapping)
+
+    renamed = values.cat.categories.map(lambda category: mapping.get(category, category))
+    categories = renamed.unique().sort_values()
+    lookup = categories.get_indexer(renamed)
+
+    codes = values.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, lookup[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=values.index, name=values.name)
+
+
+def drop_duplicate_rows(df):
+    """
+    Drops rows equal to an earlier row in every column. Rows are compared by a 64 bit hash built
+    one column at a time, instead of factorizing every column at once like drop_duplicates.
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return df[~pd.Series(hashes).duplicated().to_numpy()]
+
+
+def iqr_bounds(df, columns):
+    """Lower and upper IQR bounds of every column, with all quartiles from one quantile call."""
+    quartiles = df[columns].quantile([0.25, 0.75])
+    Q1 = quartiles.loc[0.25]
+    Q3 = quartiles.loc[0.75]
+    IQR = Q3 - Q1
+    return Q1 - 1.5 * IQR, Q3 + 1.5 * IQR
+
+
+def iqr_mask(df, lower_bound, upper_bound):
+    """One boolean mask of the rows inside the bounds for every column (missing values are outside)."""
+    values = df[lower_bound.index]
+    return ((values >= lower_bound) & (values <= upper_bound)).all(axis=1)
+
+
+def remove_outliers(df, columns=OUTLIER_COLUMNS):
+    """Removes rows outside the IQR range of any of the columns."""
+    lower_bound, upper_bound = iqr_bounds(df, columns)
+    return df[iqr_mask(df, lower_bound, upper_bound)]
+
+
+def fill_values(df, numerical_columns=NUMERICAL_COLUMNS, categorical_columns=CATEGORICAL_COLUMNS):
+    """Means of the numerical columns and modes of the categorical columns."""
+    means = df[numerical_columns].mean()
+    modes = df[categorical_columns].mode().iloc[0]
+    return {**means.to_dict(), **modes.to_dict()}
+
+
+def impute(df, numerical_columns=NUMERICAL_COLUMNS, categorical_columns=CATEGORICAL_COLUMNS,
+           invalid_zero_columns=INVALID_ZERO_COLUMNS):
+    """
+    Treats invalid zeros as missing and fills every missing value in one step,
+    numerical columns with their mean and categorical columns with their mode.
+    Returns the filled frame and the values used.
+    """
+    df = df.copy()
+    df[invalid_zero_columns] = df[invalid_zero_columns].replace(0, np.nan)
+
+    values = fill_values(df, numerical_columns, categorical_columns)
+    return df.fillna(values), values
+
+
+def replace_low_values(df, means, columns=LOW_VALUE_COLUMNS):
+    """
+    Replaces prices and msrps (or the given columns) below the limit, and used car mileages
+    below the limit, with the column means.
+    """
+    df = df.copy()
+
+    low_means = pd.Series({column: means[column] for column in columns}, dtype=np.float64)
+    low = df[columns] < LOW_VALUE_LIMIT
+    df[columns] = df[columns].mask(low, low_means, axis=1)
+
+    used_low_mileage = (df['mileage'] < LOW_VALUE_LIMIT) & (df['stock_type'] == 'USED')
+    df['mileage'] = df['mileage'].mask(used_low_mileage, means['mileage'])
+
+    return df
+
+
+def remove_rare_values(df, columns=RARE_COLUMNS, max_count=RARE_MAX_COUNT):
+    """
+    Removes rows whose value in any of the columns appears max_count times or fewer (or is missing).
+    Every column is counted on the same rows, from its integer codes with one bincount.
+    """
+    keep = np.ones(len(df), dtype=bool)
+    for column in columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+        else:
+            codes = pd.factorize(values)[0]
+
+        known = codes >= 0
+        counts = np.bincount(codes[known], minlength=1)
+        keep &= known & (counts[np.where(known, codes, 0)] > max_count)
+    return df[keep]
+
+
+def clean_for_scoring(df, values):
+    """
+    Runs the cleaning steps that work on single listings, filling missing values with the
+    means and modes in values. No row is dropped, so every listing can be priced.
+    """
+    df = df[X_COLUMNS].copy()
+
+    # Replacing 0 with NaN and filling missing values
+    zero_columns = [column for column in INVALID_ZERO_COLUMNS if column in X_COLUMNS]
+    df[zero_columns] = df[zero_columns].replace(0, np.nan)
+    df = df.fillna({column: values[column] for column in X_COLUMNS})
+
+    # Replacing 6 with M and 7 with A
+    df['transmission_from_vin'] = df['transmission_from_vin'].replace(TRANSMISSION_CODES)
+
+    # Replacing low msrps and used car mileages with the mean
+    return replace_low_values(df, values, [column for column in LOW_VALUE_COLUMNS if column in X_COLUMNS])
+
+
+def clean_listings(df):
+    """
+    Runs every cleaning step on raw listings and returns the model columns and price.
+    """
+
+    # Removing duplicates, then keeping only the columns the later steps use
+    with stage('dedup'):
+        df = drop_duplicate_rows(df)
+    used_columns = list(dict.fromkeys(X_COLUMNS + [Y_COLUMN] + RARE_COLUMNS))
+    df = df[used_columns + OUTLIER_COLUMNS]
+
+    # Outlier removal with one combined mask
+    with stage('outliers'):
+        df = remove_outliers(df)
+        df = df[used_columns]
+
+    # Filling missing values
+    with stage('impute'):
+        df, values = impute(df,
+                            [column for column in NUMERICAL_COLUMNS if column in used_columns],
+                            [column for column in CATEGORICAL_COLUMNS if column in used_columns],
+                            [column for column in INVALID_ZERO_COLUMNS if column in used_columns])
+
+    with stage('categories'):
+        # Replacing 6 with M and 7 with A
+        df['transmission_from_vin'] = replace_categories(df['transmission_from_vin'], TRANSMISSION_CODES)
+
+        # Only the columns that were not read as categories are converted
+        text_columns = [column for column in CATEGORICAL_COLUMNS
+                        if column in used_columns and not isinstance(df[column].dtype, pd.CategoricalDtype)]
+        df = df.astype({column: 'category' for column in text_columns})
+
+    # Replacing low prices, msrps and used car mileages with the mean
+    with stage('low_values'):
+        df = replace_low_values(df, values)
+
+    # Removing rare categories
+    with stage('rare_values'):
+        df = remove_rare_values(df)
+
+    return df[X_COLUMNS + [Y_COLUMN]]
+
+
+def clean_and_split(file_path, output_folder='.', chunksize=0, data_format='parquet', test_size=0.2, random_state=42):
+    """
+    Cleans the raw listings and writes the train and test splits to output_folder.
+    With a chunksize the raw file is streamed in two passes instead of loaded into memory.
+    Returns the number of rows read and written to each split.
+    """
+    if chunksize:
+        from utils.chunked_preprocess import preprocess_chunked
+
+        return preprocess_chunked(file_path, output_folder, chunksize, test_size, random_state, data_format)
+
+    from sklearn.model_selection import train_test_split
+    from utils.data_io import save_splits
+
+    # Text columns are read as categories and other numeric columns downcast
+    with stage('read'):
+        df = read_raw_listings(file_path)
+    rows_read = len(df)
+
+    # Deduplicating, outlier removal, filling and filtering in one vectorized pass
+    with stage('clean'):
+        df = clean_listings(df)
+
+    # Split to X and y
+    X = df[X_COLUMNS]
+    y = df[Y_COLUMN]
+
+    # Train test split
+    with stage('split'):
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+
+    # Put into columnar files (or csvs)
+    with stage('write'):
+        save_splits(output_folder, X_train, y_train, X_test, y_test, data_format)
+
+    return {'rows_read': rows_read, 'rows_train': len(X_train), 'rows_test': len(X_test)}
@@ -0,0 +1,147 @@
+"""
+Reading and writing the processed train/test splits.
+
+Splits are stored as Parquet by default, with the categorical columns kept as dictionary
+encoded categories, so training and evaluation load them without parsing text. CSV is still
+supported for older processed folders.
+"""
+import os
+
+import pandas as pd
+
+# Names of the processed splits
+SPLIT_NAMES = ['X_train', 'y_train', 'X_test', 'y_test']
+
+# File extension for every supported data format
+DATA_FORMATS = {'parquet': '.parquet', 'csv': '.csv'}
+
+# Columns stored as categories in the columnar format
+CATEGORICAL_COLUMNS = ['make', 'transmission_from_vin', 'stock_type']
+
+
+def split_file_names(data_format):
+    """File names of the four processed splits for a data format."""
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f"Unknown data format {data_format}, expected one of {list(DATA_FORMATS)}")
+    return [name + DATA_FORMATS[data_format] for name in SPLIT_NAMES]
+
+
+def _arrow_schema(frame):
+    """Fixed Arrow schema for a split so every chunk is written with the same column types."""
+    import pyarrow as pa
+
+    fields = []
+    for column in frame.columns:
+        if column in CATEGORICAL_COLUMNS:
+            fields.append((column, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append((column, pa.float64()))
+    return pa.schema(fields)
+
+
+class SplitWriter:
+    """
+    Writes the processed splits to a folder, either all at once or appended chunk by chunk.
+    """
+
+    def __init__(self, folder, data_format='parquet'):
+        self.folder = folder
+        self.data_format = data_format
+        self.paths = dict(zip(SPLIT_NAMES, (os.path.join(folder, name) for name in split_file_names(data_format))))
+        self._writers = {}
+
+        # Start from empty files
+        for path in self.paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write(self, name, frame):
+        """Appends a DataFrame (or the y Series) to one of the splits."""
+        if isinstance(frame, pd.Series):
+            frame = frame.to_frame()
+
+        path = self.paths[name]
+
+        if self.data_format == 'csv':
+            header = name not in self._writers
+            self._writers[name] = None
+            frame.to_csv(path, mode='a', header=header, index=False)
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = self._writers.get(name)
+        if writer is None:
+            writer = pq.ParquetWriter(path, _arrow_schema(frame))
+            self._writers[name] = writer
+
+        writer.write_table(pa.Table.from_pandas(frame, schema=writer.schema, preserve_index=False))
+
+    def close(self):
+        """Finishes every file that was written."""
+        for writer in self._writers.values():
+            if writer is not None:
+                writer.close()
+        self._writers = {}
+
+
+def save_splits(folder, X_train, y_train, X_test, y_test, data_format='parquet'):
+    """Writes the four splits to folder and returns the file names."""
+    writer = SplitWriter(folder, data_format)
+    for name, frame in zip(SPLIT_NAMES, (X_train, y_train, X_test, y_test)):
+        writer.write(name, frame)
+    writer.close()
+    return split_file_names(data_format)
+
+
+def load_split(path, columns=None):
+    """
+    Loads one processed split as a DataFrame.
+    Parquet files are memory mapped and keep their categorical columns as categories.
+    """
+    if path.endswith(DATA_FORMATS['parquet']):
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+    return pd.read_csv(path, usecols=columns)
+
+
+def iter_split(path, chunksize=100000, columns=None):
+    """
+    Loads one processed split chunk by chunk, so it never has to fit in memory at once.
+    Parquet chunks keep their categorical columns as categories.
+    """
+    if path.endswith(DATA_FORMATS['parquet']):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+
+def iter_xy_splits(X_path, y_path, chunksize=100000):
+    """
+    Yields matching chunks of the X and y splits. Parquet batches of the two files can
+    end on different rows, so y is re-cut to the length of every X chunk.
+    """
+    y_chunks = iter_split(y_path, chunksize)
+    y_rest = None
+
+    for X_chunk in iter_split(X_path, chunksize):
+        parts = []
+        needed = len(X_chunk)
+        while needed:
+            if y_rest is None or not len(y_rest):
+                y_rest = next(y_chunks, None)
+                if y_rest is None:
+                    raise ValueError(f"{y_path} has fewer rows than {X_path}")
+            parts.append(y_rest.iloc[:needed])
+            y_rest = y_rest.iloc[needed:]
+            needed -= len(parts[-1])
+
+        if parts:
+            yield X_chunk, pd.concat(parts) if len(parts) > 1 else parts[0]
+
+    if (y_rest is not None and len(y_rest)) or any(len(chunk) for chunk in y_chunks):
+        raise ValueError(f"{y_path} has more rows than {X_path}")
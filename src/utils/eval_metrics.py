@@ -0,0 +1,166 @@
+"""
+Batched evaluation of a trained model on a processed test split.
+
+The test split is streamed in batches that worker processes encode and score. Each batch only
+comes back as a handful of additive sums (rows, sum of prices and squared prices, sum of errors,
+squared errors and absolute errors), overall and per make and model year. Adding the sums of
+every batch gives the exact r2, MSE, RMSE and MAE of the whole split, so memory stays at a few
+batches however many rows are evaluated.
+"""
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from utils.data_io import iter_xy_splits
+from utils.feature_encoder import FeatureEncoder
+from utils.linear_model import LinearModel, as_linear_model
+from utils.profiling import iterate, stage
+
+logger = logging.getLogger(__name__)
+
+# Raw test columns the errors are broken down by
+GROUP_COLUMNS = ['make', 'model_year']
+
+SUM_COLUMNS = ['count', 'sum_y', 'sum_y2', 'sum_error', 'sum_squared_error', 'sum_absolute_error']
+
+
+def batch_sums(y, y_pred, groups=None):
+    """
+    The additive sums of one batch as a DataFrame with SUM_COLUMNS,
+    one row per value of groups, or a single row when groups is None.
+    """
+    y = np.asarray(y, dtype=np.float64).ravel()
+    error = np.asarray(y_pred, dtype=np.float64).ravel() - y
+    values = [np.ones(len(y)), y, y * y, error, error * error, np.abs(error)]
+
+    if groups is None:
+        return pd.DataFrame([[value.sum() for value in values]], index=['all'], columns=SUM_COLUMNS)
+
+    # Categorical columns already carry their codes. Rows with a missing group value
+    # get code -1 and are left out of the breakdown
+    if isinstance(groups, pd.Series) and isinstance(groups.dtype, pd.CategoricalDtype):
+        codes, uniques = groups.cat.codes.to_numpy(), groups.cat.categories
+    else:
+        codes, uniques = pd.factorize(np.asarray(groups))
+
+    known = codes >= 0
+    sums = pd.DataFrame({column: np.bincount(codes[known], weights=value[known], minlength=len(uniques))
+                         for column, value in zip(SUM_COLUMNS, values)}, index=uniques)
+    return sums[sums['count'] > 0]
+
+
+def metrics_from_sums(sums):
+    """r2, MSE, RMSE, MAE and mean error (prediction minus price) for every row of a sums frame."""
+    count = sums['count']
+    total_squares = sums['sum_y2'] - sums['sum_y'] ** 2 / count
+    mse = sums['sum_squared_error'] / count
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = 1.0 - sums['sum_squared_error'] / total_squares
+
+    return pd.DataFrame({
+        'count': count.astype(np.int64),
+        'r2': r2.where(total_squares > 0),
+        'mse': mse,
+        'rmse': np.sqrt(mse),
+        'mae': sums['sum_absolute_error'] / count,
+        'mean_error': sums['sum_error'] / count,
+    })
+
+
+class RunningMetrics:
+    """Adds up the batch sums of the whole split, overall and per group column."""
+
+    def __init__(self, group_columns=GROUP_COLUMNS):
+        self.group_columns = list(group_columns)
+        self.totals = {name: None for name in ['all'] + self.group_columns}
+
+    def add(self, sums):
+        """Adds the sums of one batch, a dict of 'all' and every group column to its sums frame."""
+        for name, frame in sums.items():
+            current = self.totals[name]
+            self.totals[name] = frame if current is None else current.add(frame, fill_value=0.0)
+
+    @property
+    def count(self):
+        return 0 if self.totals['all'] is None else int(self.totals['all']['count'].iloc[0])
+
+    def overall(self):
+        """Metrics of the whole split as a dict."""
+        if self.totals['all'] is None:
+            raise ValueError("No rows were evaluated")
+        return metrics_from_sums(self.totals['all']).iloc[0].to_dict()
+
+    def breakdown(self, column):
+        """Metrics for every value of a group column, most common first."""
+        frame = metrics_from_sums(self.totals[column])
+        frame.index.name = column
+        return frame.sort_values('count', ascending=False)
+
+
+# Model, encoder and group columns of the current worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(model, group_columns, encoder=None):
+    encoder = encoder or FeatureEncoder.from_model(model)
+
+    _worker.update(model=as_linear_model(model), encoder=encoder, group_columns=group_columns)
+
+
+def score_batch(X_chunk, y_chunk):
+    """Encodes and scores one batch, then returns its sums overall and per group column."""
+    model, encoder = _worker['model'], _worker['encoder']
+
+    X = encoder.encode_frame(X_chunk)
+    if isinstance(model, LinearModel):
+        y_pred = model.predict(X)
+    else:
+        y_pred = model.predict(encoder.to_frame(X))
+
+    y = y_chunk.to_numpy(np.float64)
+    sums = {'all': batch_sums(y, y_pred)}
+    for column in _worker['group_columns']:
+        sums[column] = batch_sums(y, y_pred, X_chunk[column])
+    return sums
+
+
+def evaluate_batches(model, X_path, y_path, batch_size=100000, workers=0, group_columns=GROUP_COLUMNS, encoder=None):
+    """
+    Scores the test split batch by batch in a process pool and returns the RunningMetrics.
+    encoder is the one the model was trained with, rebuilt from its feature names when not given.
+    workers=0 uses every core, workers=1 scores in this process. At most two batches per
+    worker are read ahead, so memory stays bounded.
+    """
+    workers = workers or os.cpu_count() or 1
+    metrics = RunningMetrics(group_columns)
+    batches = iterate('load', iter_xy_splits(X_path, y_path, batch_size))
+
+    if workers == 1:
+        _init_worker(model, metrics.group_columns, encoder)
+        for X_chunk, y_chunk in batches:
+            with stage('score'):
+                metrics.add(score_batch(X_chunk, y_chunk))
+        return metrics
+
+    logger.info(f"Evaluating in batches of {batch_size} rows with {workers} workers")
+
+    # fork lets the workers inherit the loaded model and encoder instead of unpickling a copy in each one
+    with ProcessPoolExecutor(workers, mp_context=get_context('fork'), initializer=_init_worker,
+                             initargs=(model, metrics.group_columns, encoder)) as pool:
+        pending = set()
+        for X_chunk, y_chunk in batches:
+            pending.add(pool.submit(score_batch, X_chunk, y_chunk))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    metrics.add(future.result())
+
+        for future in pending:
+            metrics.add(future.result())
+
+    return metrics
@@ -0,0 +1,201 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Raw listing columns the model is trained on
+NUMERIC_COLUMNS = ['mileage', 'model_year', 'msrp']
+CATEGORICAL_COLUMNS = ['transmission_from_vin', 'stock_type', 'make']
+
+# Categorical columns that lose their first category when one-hot encoded for training
+DROP_FIRST_COLUMNS = ['transmission_from_vin', 'stock_type']
+
+# Version of the encoding schema saved next to every model
+SCHEMA_VERSION = 1
+
+# The only matrix type the encoder produces
+SCHEMA_DTYPE = 'float64'
+
+
+class FeatureEncoder:
+    """
+    Maps raw listings straight into the float64 feature matrix a trained model expects.
+    The column position of every numeric feature and every one-hot category is worked out
+    once, so encoding a listing is only a few dictionary lookups into a preallocated row.
+    Categories the model was not trained on (or dropped as the first category) encode as all zeros.
+    """
+
+    def __init__(self, feature_names, vocabularies=None):
+        self.feature_names = [str(name) for name in feature_names]
+        self.n_features = len(self.feature_names)
+
+        # Column -> every category seen in training, including the dropped first ones, when known
+        self.vocabularies = vocabularies
+
+        # Column -> position in the row for numeric features
+        self.numeric_index = {}
+
+        # Column -> {category -> position in the row} for one-hot features
+        self.category_index = {column: {} for column in CATEGORICAL_COLUMNS}
+
+        for position, name in enumerate(self.feature_names):
+            if name in NUMERIC_COLUMNS:
+                self.numeric_index[name] = position
+                continue
+
+            for column in CATEGORICAL_COLUMNS:
+                prefix = f"{column}_"
+                if name.startswith(prefix):
+                    self.category_index[column][name[len(prefix):]] = position
+                    break
+            else:
+                raise ValueError(f"Feature {name} is not a known listing feature")
+
+        # Column -> (categories, their positions) for encoding whole frames through categorical codes
+        self.frame_index = {column: (pd.Index(list(index)), np.fromiter(index.values(), dtype=np.intp, count=len(index)))
+                            for column, index in self.category_index.items() if index}
+
+    @classmethod
+    def from_model(cls, model):
+        """Builds the encoder from the feature names a fitted sklearn model was trained with."""
+        return cls(model.feature_names_in_)
+
+    @classmethod
+    def from_schema(cls, schema):
+        """Builds the encoder from a schema saved with save_schema."""
+        if schema.get("schema_version") != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported encoding schema version {schema.get('schema_version')}, expected {SCHEMA_VERSION}")
+        if schema.get("dtype") != SCHEMA_DTYPE:
+            raise ValueError(f"Unsupported encoding schema dtype {schema.get('dtype')}, expected {SCHEMA_DTYPE}")
+        return cls(schema["feature_names"], schema.get("vocabularies"))
+
+    @classmethod
+    def load_schema(cls, path):
+        """Builds the encoder from a schema JSON file."""
+        with open(path, "r") as file:
+            return cls.from_schema(json.load(file))
+
+    @classmethod
+    def from_frame(cls, X):
+        """
+        Builds the encoder from a raw training frame, giving the same columns as
+        pd.get_dummies with drop_first for transmission and stock type.
+        """
+        numeric_columns = [column for column in X.columns if column in NUMERIC_COLUMNS]
+        categories = {column: X[column].dropna().unique() for column in CATEGORICAL_COLUMNS}
+        return cls.from_categories(numeric_columns, categories)
+
+    @classmethod
+    def from_categories(cls, numeric_columns, categories):
+        """
+        Builds the encoder from the numeric columns in frame order and the values seen in
+        every categorical column, for data that is only ever read in chunks.
+        """
+        feature_names = list(numeric_columns)
+        vocabularies = {}
+
+        for column in CATEGORICAL_COLUMNS:
+            vocabularies[column] = sorted({str(value) for value in categories[column]})
+            column_categories = vocabularies[column]
+            if column in DROP_FIRST_COLUMNS:
+                column_categories = column_categories[1:]
+            feature_names.extend(f"{column}_{category}" for category in column_categories)
+
+        return cls(feature_names, vocabularies)
+
+    def schema(self):
+        """
+        The encoding as a JSON-able dict: the feature names in column order, the matrix dtype and the
+        category vocabularies. Categories outside the one-hot features encode as all zeros.
+        """
+        return {
+            "schema_version": SCHEMA_VERSION,
+            "dtype": SCHEMA_DTYPE,
+            "feature_names": self.feature_names,
+            "numeric_columns": list(self.numeric_index),
+            "vocabularies": self.vocabularies,
+            "drop_first_columns": DROP_FIRST_COLUMNS,
+            "unknown_category": "zeros",
+        }
+
+    def save_schema(self, path):
+        """Writes the schema to a JSON file."""
+        with open(path, "w") as file:
+            json.dump(self.schema(), file, indent=2)
+
+    def check_model(self, model):
+        """Raises a ValueError if the model was not trained on this encoder's columns."""
+        model_names = [str(name) for name in model.feature_names_in_]
+        if model_names != self.feature_names:
+            raise ValueError(f"Encoding schema has {self.n_features} features that do not match "
+                             f"the {len(model_names)} the model was trained with")
+
+    def encode_row(self, listing, out=None):
+        """
+        Encodes one listing dict into a float64 row.
+        Pass out to reuse a preallocated row instead of allocating a new one.
+        """
+        if out is None:
+            out = np.zeros(self.n_features, dtype=np.float64)
+        else:
+            out.fill(0.0)
+
+        for column, position in self.numeric_index.items():
+            out[position] = float(listing[column])
+
+        for column, index in self.category_index.items():
+            position = index.get(str(listing[column]))
+            if position is not None:
+                out[position] = 1.0
+
+        return out
+
+    def encode_many(self, listings):
+        """Encodes a list of listing dicts into one float64 matrix."""
+        X = np.zeros((len(listings), self.n_features), dtype=np.float64)
+        for i, listing in enumerate(listings):
+            self.encode_row(listing, out=X[i])
+        return X
+
+    def encode_frame(self, df):
+        """Encodes a raw listing DataFrame into one float64 matrix without pd.get_dummies."""
+        n = len(df)
+        X = np.zeros((n, self.n_features), dtype=np.float64)
+
+        for column, position in self.numeric_index.items():
+            X[:, position] = df[column].to_numpy(dtype=np.float64)
+
+        rows = np.arange(n)
+        for column, (categories, positions) in self.frame_index.items():
+            # Look up every value's position at once through categorical codes
+            values = df[column]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(str)
+            codes = pd.Categorical(values, categories=categories).codes
+
+            known = codes >= 0
+            X[rows[known], positions[codes[known]]] = 1.0
+
+        return X
+
+    def to_frame(self, X):
+        """Wraps an encoded matrix in a DataFrame with the model's feature names."""
+        return pd.DataFrame(X, columns=self.feature_names, copy=False)
+
+
+def schema_path(model_path):
+    """Path of the encoding schema saved next to a model file, e.g. models/ridge_model_v2.schema.json."""
+    return os.path.splitext(model_path)[0] + ".schema.json"
+
+
+def encoder_for_model(model, model_path=None):
+    """
+    The encoder a model was trained with. It is loaded from the schema next to model_path when there is
+    one, and rebuilt from the model's feature names for models saved without a schema.
+    """
+    if model_path is not None and os.path.exists(schema_path(model_path)):
+        encoder = FeatureEncoder.load_schema(schema_path(model_path))
+        encoder.check_model(model)
+        return encoder
+    return FeatureEncoder.from_model(model)
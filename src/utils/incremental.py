@@ -0,0 +1,125 @@
+"""
+Out-of-core Ridge training.
+
+The processed train split is streamed in chunks. Every encoded chunk only updates the running
+means and centered sums of squares and cross products of X and y, which are merged the same way
+as a pairwise variance. The Ridge system is solved from those statistics at the end, so memory
+stays at one chunk plus a features x features matrix however many listings there are.
+"""
+import logging
+
+import numpy as np
+from scipy import linalg
+from sklearn.linear_model import Ridge
+
+from utils.data_io import iter_split, iter_xy_splits
+from utils.feature_encoder import CATEGORICAL_COLUMNS, NUMERIC_COLUMNS, FeatureEncoder
+from utils.profiling import iterate, stage
+
+logger = logging.getLogger(__name__)
+
+
+class RidgeStats:
+    """Running sufficient statistics of a Ridge fit, updated one chunk of rows at a time."""
+
+    def __init__(self, n_features):
+        self.n = 0
+        self.x_mean = np.zeros(n_features)
+        self.y_mean = 0.0
+
+        # Centered X'X and X'y
+        self.xx = np.zeros((n_features, n_features))
+        self.xy = np.zeros(n_features)
+
+    def update(self, X, y):
+        """Merges a chunk of encoded rows and their prices into the statistics."""
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64).ravel()
+        m = len(X)
+        if m == 0:
+            return
+
+        chunk_x_mean = X.mean(axis=0)
+        chunk_y_mean = y.mean()
+        Xc = X - chunk_x_mean
+        yc = y - chunk_y_mean
+
+        n = self.n + m
+        dx = chunk_x_mean - self.x_mean
+        dy = chunk_y_mean - self.y_mean
+        weight = self.n * m / n
+
+        self.xx += Xc.T @ Xc + weight * np.outer(dx, dx)
+        self.xy += Xc.T @ yc + weight * dx * dy
+        self.x_mean += dx * m / n
+        self.y_mean += dy * m / n
+        self.n = n
+
+    def solve(self, alpha, fit_intercept=True):
+        """Coefficients and intercept of the Ridge fit, solved like sklearn's cholesky solver."""
+        if fit_intercept:
+            A = self.xx.copy()
+            b = self.xy.copy()
+        else:
+            A = self.xx + self.n * np.outer(self.x_mean, self.x_mean)
+            b = self.xy + self.n * self.x_mean * self.y_mean
+
+        A.flat[::A.shape[0] + 1] += alpha
+        try:
+            coef = linalg.solve(A, b, assume_a='pos', overwrite_a=True, check_finite=False)
+        except linalg.LinAlgError:
+            logger.warning("Singular matrix, solving with least squares instead")
+            coef = linalg.lstsq(A, b)[0]
+
+        intercept = self.y_mean - self.x_mean @ coef if fit_intercept else 0.0
+        return coef, intercept
+
+
+def split_categories(X_path, chunksize=100000):
+    """The numeric columns in file order and every value seen in each categorical column, read chunk by chunk."""
+    numeric_columns = None
+    categories = {column: set() for column in CATEGORICAL_COLUMNS}
+
+    for chunk in iter_split(X_path, chunksize):
+        if numeric_columns is None:
+            numeric_columns = [column for column in chunk.columns if column in NUMERIC_COLUMNS]
+        for column in CATEGORICAL_COLUMNS:
+            categories[column].update(chunk[column].dropna().unique())
+
+    return numeric_columns or [], categories
+
+
+def fit_incremental(X_path, y_path, alpha, fit_intercept=True, solver='auto', chunksize=100000):
+    """
+    Trains Ridge on the processed train split without loading it all at once.
+
+    Makes one pass to collect the categories and a second pass to accumulate the statistics.
+    Returns a fitted sklearn Ridge, with the same attributes as one fitted in memory on the
+    encoded frame, the encoder it was trained with and the number of rows.
+    """
+    with stage('categories'):
+        encoder = FeatureEncoder.from_categories(*split_categories(X_path, chunksize))
+
+    stats = RidgeStats(encoder.n_features)
+    for X_chunk, y_chunk in iterate('load', iter_xy_splits(X_path, y_path, chunksize)):
+        with stage('encode'):
+            X = encoder.encode_frame(X_chunk)
+        with stage('accumulate'):
+            stats.update(X, y_chunk.to_numpy(np.float64))
+
+    if stats.n == 0:
+        raise ValueError(f"{X_path} has no rows to train on")
+
+    with stage('fit'):
+        coef, intercept = stats.solve(alpha, fit_intercept)
+
+    # Same shapes as Ridge fitted on the single column y frame
+    model = Ridge(alpha=alpha, fit_intercept=fit_intercept, solver=solver)
+    model.coef_ = coef
+    model.intercept_ = np.array([intercept])
+    model.n_features_in_ = encoder.n_features
+    model.feature_names_in_ = np.asarray(encoder.feature_names, dtype=object)
+    model.n_iter_ = None
+    model.solver_ = 'cholesky'
+
+    return model, encoder, stats.n
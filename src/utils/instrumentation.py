@@ -0,0 +1,346 @@
+"""
+Request metrics in the Prometheus text format and non-blocking logging for the api.
+
+Counters, histograms and gauges live in a MetricsRegistry that renders them for a /metrics
+endpoint, merged over the worker processes of serve.py when they share a folder. Histograms only add to a bucket count under a lock, so recording a request costs a few
+microseconds. Logging goes through a queue: request threads put records on it and a background
+thread writes them to the console and the log file, so slow disks never hold up a request.
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import queue
+import random
+import threading
+import time
+from bisect import bisect_left
+from logging.handlers import QueueHandler, QueueListener
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Log file of the api, in LOG_DIR when it is set
+LOG_FILE = os.path.join(os.environ.get("LOG_DIR", "."), "app.log")
+
+# Fraction of successful requests that are logged, warnings and errors are always logged
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get("REQUEST_LOG_SAMPLE_RATE", 0.01))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds between the metrics snapshots every worker writes when metrics are shared between workers
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 1.0))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """A value per label set that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def values(self):
+        """{label values: value} of this process."""
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total, values):
+        for label_values, value in values.items():
+            total[label_values] = total.get(label_values, 0.0) + value
+
+    def lines(self, values):
+        for label_values, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    """Counts of observed values per bucket, with their sum, for every label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> [count per bucket (the last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def values(self):
+        """{label values: [count per bucket, sum]} of this process."""
+        with self._lock:
+            return {label_values: [list(counts), total] for label_values, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def merge(total, values):
+        for label_values, (counts, value_sum) in values.items():
+            entry = total.get(label_values)
+            if entry is None:
+                total[label_values] = [list(counts), value_sum]
+                continue
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += value_sum
+
+    def lines(self, values):
+        for label_values, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """Values read when the metrics are rendered. collect() returns {label values tuple: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def values(self):
+        return dict(self.collect())
+
+    def lines(self, values):
+        for label_values, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """
+    The metrics of one process, rendered together in the Prometheus text format.
+
+    Under the pre-fork launcher every worker has its own registry, so share() makes each worker
+    write a snapshot of its metrics to a folder all workers can read, every METRICS_FLUSH_SECONDS
+    and before it renders. render() then merges the snapshots into one exposition, like the
+    multiprocess mode of prometheus_client: counters and histograms are summed over every worker
+    that ever ran, so they never go down when a worker is restarted, and gauges are reported per
+    live worker with a worker label.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.folder = None
+        self._flusher = None
+        self._stop = threading.Event()
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self._register(Gauge(name, help, labels, collect))
+
+    def share(self, folder, interval=METRICS_FLUSH_SECONDS):
+        """Starts writing this process's snapshot to folder, and merging every snapshot there when rendering."""
+        self.folder = folder
+        self._stop.clear()
+        self.write_snapshot()
+
+        def flush():
+            while not self._stop.wait(interval):
+                try:
+                    self.write_snapshot()
+                except OSError as e:
+                    logging.getLogger(__name__).error(f"Writing the metrics snapshot failed with error: {str(e)}")
+
+        self._flusher = threading.Thread(target=flush, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop_sharing(self):
+        """Writes the last snapshot, so the totals of this process outlive it."""
+        if self._flusher is None:
+            return
+        self._stop.set()
+        self._flusher.join()
+        self._flusher = None
+        self.write_snapshot()
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.folder, f"metrics-{pid}.json")
+
+    def write_snapshot(self):
+        """Replaces this process's snapshot in the shared folder in one rename, so readers never see half of it."""
+        snapshot = {metric.name: [[list(label_values), value] for label_values, value in metric.values().items()]
+                    for metric in self.metrics}
+        path = self._snapshot_path(os.getpid())
+        with open(path + ".tmp", "w") as file:
+            json.dump(snapshot, file)
+        os.replace(path + ".tmp", path)
+
+    def _merged_values(self):
+        """{metric name: merged values} over the snapshots of every worker."""
+        self.write_snapshot()
+
+        merged = {metric.name: {} for metric in self.metrics}
+        kinds = {metric.name: metric for metric in self.metrics}
+        for name in os.listdir(self.folder):
+            if not (name.startswith("metrics-") and name.endswith(".json")):
+                continue
+            pid = int(name[len("metrics-"):-len(".json")])
+            try:
+                with open(os.path.join(self.folder, name), "r") as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            alive = _is_alive(pid)
+
+            for metric_name, items in snapshot.items():
+                metric = kinds.get(metric_name)
+                if metric is None:
+                    continue
+                values = {tuple(label_values): value for label_values, value in items}
+                if metric.kind == "gauge":
+                    # Gauges describe a running process, so only live workers count
+                    if alive:
+                        merged[metric_name].update({label_values + (str(pid), ): value
+                                                    for label_values, value in values.items()})
+                else:
+                    metric.merge(merged[metric_name], values)
+        return merged
+
+    def render(self):
+        merged = self._merged_values() if self.folder is not None else None
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if merged is None:
+                lines.extend(metric.lines(metric.values()))
+            elif metric.kind == "gauge":
+                lines.extend(Gauge(metric.name, metric.help, metric.labels + ("worker", )).lines(merged[metric.name]))
+            else:
+                lines.extend(metric.lines(merged[metric.name]))
+        return "\n".join(lines) + "\n"
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RequestTimer:
+    """
+    Splits the time of one request into phases. Each mark() closes the phase that
+    started at the previous mark (or at the start of the request).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.phases = {}
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def total(self):
+        return self._last - self.start
+
+
+class SampleFilter(logging.Filter):
+    """Lets through a fraction of the INFO and DEBUG records and every warning and error."""
+
+    def __init__(self, rate=REQUEST_LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+_listener = None
+
+
+def configure_logging(level=logging.INFO, log_file=LOG_FILE):
+    """
+    Sends every log record through a queue to a background thread that writes the console and
+    the log file. Call it again in a forked child, the parent's writer thread does not survive the fork.
+    """
+    global _listener
+
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = [logging.StreamHandler(), logging.FileHandler(log_file)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(records))
+    root.setLevel(level)
+
+    if _listener is None:
+        atexit.register(stop_logging)
+    else:
+        _listener.stop()
+
+    listener.start()
+    _listener = listener
+    return listener
+
+
+def stop_logging():
+    """Writes out the records still on the queue and stops the writer thread."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
@@ -0,0 +1,201 @@
+import logging
+import os
+import sys
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LinearModel:
+    """
+    A fitted linear model reduced to its coefficient vector, intercept and feature order.
+    Predicting is a single dot product, so no pandas or sklearn is needed to serve it.
+    """
+
+    def __init__(self, coef, intercept, feature_names):
+        self.coef_ = np.ascontiguousarray(coef, dtype=np.float64)
+        self.intercept_ = float(intercept)
+        self.feature_names_in_ = np.asarray(feature_names, dtype=str)
+        self.n_features_in_ = len(self.coef_)
+
+        if len(self.feature_names_in_) != self.n_features_in_:
+            raise ValueError("Number of feature names does not match number of coefficients")
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Takes the coefficients out of a fitted sklearn linear model with a single target."""
+        coef = np.ravel(model.coef_)
+        intercept = np.ravel(model.intercept_)[0] if np.ndim(model.intercept_) else model.intercept_
+        return cls(coef, intercept, model.feature_names_in_)
+
+    def predict(self, X):
+        """Predicts from an encoded float64 matrix in feature_names_in_ order."""
+        return X @ self.coef_ + self.intercept_
+
+    def save(self, path, source_sha256=None):
+        """Saves the model as an uncompressed .npz file, with the sha256 of the file it was exported from if given."""
+        extra = {} if source_sha256 is None else {"source_sha256": np.asarray(source_sha256)}
+        np.savez(path, coef=self.coef_, intercept=np.float64(self.intercept_),
+                 feature_names=self.feature_names_in_, **extra)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a model saved with save()."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["coef"], data["intercept"], data["feature_names"])
+
+
+class SegmentedModel(LinearModel):
+    """
+    A bundle of linear models, one per make segment, with a global model for makes without one.
+    coef_ and intercept_ are the global model. A listing is priced by the model of its make's
+    segment, found by a dictionary lookup of the make (or of its one-hot column in an encoded matrix).
+    """
+
+    def __init__(self, coef, intercept, feature_names, segments, segment_coefs, segment_intercepts, make_segments):
+        super().__init__(coef, intercept, feature_names)
+        self.segments_ = np.asarray(segments, dtype=str)
+        self.segment_coefs_ = np.ascontiguousarray(segment_coefs, dtype=np.float64).reshape(len(self.segments_),
+                                                                                            self.n_features_in_)
+        self.segment_intercepts_ = np.ascontiguousarray(segment_intercepts, dtype=np.float64).reshape(len(self.segments_))
+
+        # Make -> row of its segment, the global model is the last row
+        self.global_row = len(self.segments_)
+        self.make_segments = {str(make): int(row) for make, row in make_segments.items()}
+        self._coefs = np.vstack([self.segment_coefs_, self.coef_])
+        self._intercepts = np.append(self.segment_intercepts_, self.intercept_)
+
+        # A listing has at most one make one-hot column set, so whatever depends only on its make is
+        # a matrix-vector product: column 0 gives the offset from the global row to its segment's row,
+        # column 1 the weight of the make column plus the segment intercept over the global intercept.
+        make_columns = np.array([name.startswith("make_") for name in self.feature_names_in_], dtype=bool)
+        self._make_weights = np.zeros((self.n_features_in_, 2), dtype=np.float64)
+        for position in np.flatnonzero(make_columns):
+            row = self.make_segments.get(self.feature_names_in_[position][len("make_"):], self.global_row)
+            self._make_weights[position] = (row - self.global_row,
+                                            self._coefs[row, position] + self._intercepts[row] - self.intercept_)
+
+        # Only the other columns need the coefficients of each listing's own segment
+        self._dense_columns = np.flatnonzero(~make_columns)
+        self._dense_coefs = np.ascontiguousarray(self._coefs[:, self._dense_columns])
+
+    def segment_rows(self, X):
+        """Row of the segment model for every listing of an encoded matrix, read from its make one-hot column."""
+        return self.global_row + np.rint(X @ self._make_weights[:, 0]).astype(np.intp)
+
+    def rows_for_makes(self, makes):
+        """Row of the segment model for every make, the global row for makes without a segment."""
+        return np.fromiter((self.make_segments.get(str(make), self.global_row) for make in makes),
+                           dtype=np.intp, count=len(makes))
+
+    def predict(self, X, makes=None):
+        """
+        Predicts from an encoded float64 matrix in feature_names_in_ order.
+        Pass the make of every row to route by dictionary lookup instead of through the one-hot columns.
+        """
+        X = np.asarray(X, dtype=np.float64)
+
+        if len(X) == 1:
+            row = self.segment_rows(X)[0] if makes is None else self.make_segments.get(str(makes[0]), self.global_row)
+            return X @ self._coefs[row] + self._intercepts[row]
+
+        # The make dependent part of every row in one product, then the other columns against its segment
+        make_part = X @ self._make_weights
+        rows = self.rows_for_makes(makes) if makes is not None else \
+            self.global_row + np.rint(make_part[:, 0]).astype(np.intp)
+
+        dense = np.einsum('ij,ij->i', X[:, self._dense_columns], self._dense_coefs[rows])
+        return dense + make_part[:, 1] + self.intercept_
+
+    def save(self, path):
+        """Saves the bundle as an uncompressed .npz file."""
+        np.savez(path, coef=self.coef_, intercept=np.float64(self.intercept_), feature_names=self.feature_names_in_,
+                 segments=self.segments_, segment_coefs=self.segment_coefs_,
+                 segment_intercepts=self.segment_intercepts_,
+                 segment_makes=np.asarray(list(self.make_segments), dtype=str),
+                 segment_make_rows=np.asarray(list(self.make_segments.values()), dtype=np.intp))
+
+    @classmethod
+    def load(cls, path):
+        """Loads a bundle saved with save()."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["coef"], data["intercept"], data["feature_names"], data["segments"],
+                       data["segment_coefs"], data["segment_intercepts"],
+                       dict(zip(data["segment_makes"], data["segment_make_rows"])))
+
+
+def as_linear_model(model):
+    """
+    Returns a fitted sklearn linear model with a single target as a LinearModel, so it scores as a
+    plain dot product without sklearn's input checks. Any other model is returned unchanged.
+    """
+    if not isinstance(model, LinearModel) and hasattr(model, "coef_") and np.size(model.intercept_) == 1:
+        return LinearModel.from_sklearn(model)
+    return model
+
+
+def load_npz(path):
+    """Loads a .npz model, as a SegmentedModel if it holds segment models and a LinearModel otherwise."""
+    with np.load(path, allow_pickle=False) as data:
+        segmented = "segments" in data.files
+    return SegmentedModel.load(path) if segmented else LinearModel.load(path)
+
+
+def numpy_model_path(model_path):
+    """Path of the .npz export that sits next to a .jlib model."""
+    return os.path.splitext(model_path)[0] + ".npz"
+
+
+def export_linear_model(model_path, npz_path=None):
+    """
+    Exports a joblib saved sklearn linear model to a .npz coefficient file.
+    Returns the path of the export.
+    """
+    import joblib
+
+    from utils.preprocess_cache import file_digest
+
+    if npz_path is None:
+        npz_path = numpy_model_path(model_path)
+
+    model = joblib.load(model_path)
+    LinearModel.from_sklearn(model).save(npz_path, source_sha256=file_digest(model_path))
+
+    logger.info(f"Exported {model_path} to {npz_path}")
+    return npz_path
+
+
+def exported_from(npz_path):
+    """sha256 of the .jlib an export was made from, None if the file is missing or does not record it."""
+    if not os.path.exists(npz_path):
+        return None
+    with np.load(npz_path, allow_pickle=False) as data:
+        return str(data["source_sha256"]) if "source_sha256" in data.files else None
+
+
+def ensure_exported(model_path):
+    """
+    Exports a model if its .npz is missing or was made from other contents of the .jlib, and returns the .npz path.
+    The contents are compared by sha256 rather than by mtime, which a checkout or a copy does not keep in order.
+    """
+    from utils.preprocess_cache import file_digest
+
+    npz_path = numpy_model_path(model_path)
+
+    if os.path.exists(model_path) and exported_from(npz_path) != file_digest(model_path):
+        export_linear_model(model_path, npz_path)
+
+    return npz_path
+
+
+if __name__ == "__main__":
+    # Export every model in the models folder, or the files given on the command line
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    from utils.model_registry import MODEL_DIR
+
+    paths = sys.argv[1:] or [os.path.join(MODEL_DIR, name) for name in sorted(os.listdir(MODEL_DIR)) if name.endswith(".jlib")]
+    for path in paths:
+        export_linear_model(path)
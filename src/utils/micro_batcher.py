@@ -0,0 +1,117 @@
+"""
+Micro-batching of single listing predictions.
+
+An asyncio event loop runs in a background thread. Request threads hand their listing to the
+loop and wait for its price. The first listing of a model version starts a max_wait_ms timer, and
+the listings of that version collected until the timer fires (or until max_batch_size are
+waiting) are scored with one vectorized call, so many concurrent requests cost one model call.
+"""
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent predictions into batches.
+
+    score_batch(version, listings) must return one result per listing, either a price or
+    an Exception that is raised in the thread waiting for that listing.
+    """
+
+    def __init__(self, score_batch, max_batch_size=64, max_wait_ms=2.0):
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._loop = None
+        self._thread = None
+        self._pending = {}
+        self._timers = {}
+        self._start_lock = threading.Lock()
+
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    def start(self):
+        """Starts the event loop thread if it is not running yet."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="micro-batcher", daemon=True)
+            self._thread.start()
+
+            logger.info(f"Micro-batching up to {self.max_batch_size} listings, waiting at most {self.max_wait * 1000} ms")
+
+    def stop(self):
+        """Stops the event loop thread."""
+        with self._start_lock:
+            if self._thread is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop, self._thread, self._pending, self._timers = None, None, {}, {}
+
+    def predict(self, version, listing, timeout=None):
+        """Queues a listing for the next batch of its version and blocks until its price is ready."""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._submit(version, listing), self._loop)
+        return future.result(timeout)
+
+    async def _submit(self, version, listing):
+        result = self._loop.create_future()
+
+        pending = self._pending.setdefault(version, [])
+        pending.append((listing, result))
+        if len(pending) >= self.max_batch_size:
+            self._flush(version)
+        elif len(pending) == 1:
+            self._timers[version] = self._loop.call_later(self.max_wait, self._flush, version)
+
+        return await result
+
+    def _flush(self, version):
+        """Scores the listings waiting for a version."""
+        timer = self._timers.pop(version, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(version, [])
+        if batch:
+            self._score(version, batch)
+
+    def _score(self, version, batch):
+        listings = [listing for listing, _ in batch]
+        try:
+            results = self.score_batch(version, listings)
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.cancelled():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self):
+        """Number of batches scored and how big they were."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "predictions": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+        }
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+import time
+
+import joblib
+
+from utils.artifact_cache import default_cache
+from utils.feature_encoder import encoder_for_model
+from utils.linear_model import ensure_exported, load_npz
+
+logger = logging.getLogger(__name__)
+
+# Automatically detect the root directory of the ML project
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(PROJECT_ROOT, "models"))
+
+# Either "jlib" to serve the sklearn models or "numpy" to serve their .npz coefficient exports
+MODEL_FORMAT = os.environ.get("MODEL_FORMAT", "jlib")
+
+# Model versions served by the api and the file each one is loaded from
+MODEL_FILES = {
+    "v1": "ridge_model_v1.jlib",
+    "v2": "ridge_model_v2.jlib",
+    "v3": "ridge_segmented_v3.npz",
+}
+
+# Versions served straight from the model logged to an mlflow run, e.g. MODEL_RUNS="v2=<run_id>,v3=<run_id>".
+# They are loaded through the local artifact cache, so a restart does not download them again.
+MODEL_RUNS = dict(item.strip().split("=", 1) for item in os.environ.get("MODEL_RUNS", "").split(",") if "=" in item)
+
+
+class ModelNotDeployedError(FileNotFoundError):
+    """Raised for a registered version whose model file is not there, e.g. a segmented model that was never trained."""
+
+    def __init__(self, version, path):
+        super().__init__(f"Model {version} is not deployed, {path} does not exist")
+        self.version = version
+        self.path = path
+
+
+class ModelRegistry:
+    """
+    Keeps every model version loaded in memory so requests never unpickle from disk.
+    A model is reloaded when the modification time of its file changes.
+    """
+
+    def __init__(self, model_paths):
+        # Dict of version -> path of the model file
+        self.model_paths = dict(model_paths)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _load(self, version, path, mtime):
+        """Unpickles one model file and records how long it took."""
+        start = time.perf_counter()
+        if path.endswith(".npz"):
+            model = load_npz(path)
+        else:
+            model = joblib.load(path)
+        load_time = time.perf_counter() - start
+
+        previous = self._entries.get(version)
+        entry = {
+            "model": model,
+            "encoder": encoder_for_model(model, path),
+            "path": path,
+            "mtime": mtime,
+            "loaded_at": time.time(),
+            "load_time_ms": load_time * 1000,
+            "loads": previous["loads"] + 1 if previous else 1,
+            "hits": previous["hits"] if previous else 0,
+        }
+        self._entries[version] = entry
+
+        logger.info(f"Loaded model {version} from {path} in {entry['load_time_ms']:.1f} ms")
+        return entry
+
+    def _entry(self, version):
+        """Returns the in-memory entry for a version, loading or reloading it if needed."""
+        path = self.model_paths[version]
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            raise ModelNotDeployedError(version, path) from None
+
+        entry = self._entries.get(version)
+        if entry is None or entry["mtime"] != mtime:
+            with self._lock:
+                # Another thread may have loaded it while we waited
+                entry = self._entries.get(version)
+                if entry is None or entry["mtime"] != mtime:
+                    return self._load(version, path, mtime)
+
+        entry["hits"] += 1
+        return entry
+
+    def get(self, version):
+        """Returns the in-memory model for a version."""
+        return self._entry(version)["model"]
+
+    def get_encoder(self, version):
+        """Returns the feature encoder of a version."""
+        return self._entry(version)["encoder"]
+
+    def get_with_encoder(self, version):
+        """
+        Returns the in-memory model for a version together with its feature encoder, loaded from the
+        encoding schema saved next to the model file.
+        """
+        entry = self._entry(version)
+        return entry["model"], entry["encoder"]
+
+    def preload(self):
+        """Loads every registered version up front, skipping files that do not exist."""
+        for version in self.model_paths:
+            try:
+                self.get(version)
+            except FileNotFoundError:
+                logger.warning(f"Model file for {version} not found at {self.model_paths[version]}")
+
+    def stats(self):
+        """Returns load time and cache hit information for every registered version."""
+        stats = {}
+        for version, path in self.model_paths.items():
+            entry = self._entries.get(version)
+            if entry is None:
+                stats[version] = {"path": path, "loaded": False}
+                continue
+
+            stats[version] = {
+                "path": path,
+                "loaded": True,
+                "loaded_at": entry["loaded_at"],
+                "load_time_ms": entry["load_time_ms"],
+                "loads": entry["loads"],
+                "cache_hits": entry["hits"],
+            }
+        return stats
+
+
+def default_registry(model_format=None, model_runs=None):
+    """
+    Creates a registry for the model versions stored in the models folder and the
+    versions in model_runs (version -> mlflow run id, MODEL_RUNS by default).
+    With the numpy format each model is exported to .npz first if its export is missing or stale.
+    """
+    model_format = model_format or MODEL_FORMAT
+    if model_format not in ("jlib", "numpy"):
+        raise ValueError(f"Unknown model format {model_format}")
+
+    paths = {version: os.path.join(MODEL_DIR, name) for version, name in MODEL_FILES.items()}
+
+    for version, run_id in (MODEL_RUNS if model_runs is None else model_runs).items():
+        try:
+            paths[version] = default_cache().model_file(run_id)
+        except Exception as e:
+            logger.error(f"Could not get the model of run {run_id} for {version}: {str(e)}")
+
+
+    if model_format == "numpy":
+        paths = {version: ensure_exported(path) for version, path in paths.items()}
+
+    return ModelRegistry(paths)
@@ -0,0 +1,112 @@
+"""
+Cache of single listing predictions.
+
+Popular trims are priced over and over with the same features. The cache keeps the last prices
+keyed on the model version and the listing as the model sees it: numbers as floats and every
+categorical value as its one-hot column, so 543, 543.0 and "543" share an entry, as do all makes
+the model was not trained on. Entries expire after a time to live, the least recently used are
+dropped when the cache is full, and all entries of a version are dropped when its model is reloaded.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+def listing_key(encoder, listing):
+    """
+    The features of a listing the way the encoder reads them.
+    Raises TypeError or ValueError for listings the encoder cannot encode either.
+    """
+    numbers = tuple(float(listing[column]) for column in encoder.numeric_index)
+    categories = tuple(index.get(str(listing[column]), -1) for column, index in encoder.category_index.items())
+    return numbers + categories
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of prices with a time to live, shared by the request threads.
+    max_size=0 disables it.
+    """
+
+    def __init__(self, max_size=10000, ttl_seconds=300.0):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+
+        # (version, key) -> (price, expiry time)
+        self._entries = OrderedDict()
+        # Version -> the model its entries were predicted with
+        self._models = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def _check_model(self, version, model):
+        """Drops the entries of a version if they were predicted by another model than the current one."""
+        previous = self._models.get(version)
+        if previous is model:
+            return
+
+        if previous is not None:
+            stale = [entry for entry in self._entries if entry[0] == version]
+            for entry in stale:
+                del self._entries[entry]
+            self.invalidations += 1
+        self._models[version] = model
+
+    def get(self, version, model, key):
+        """The cached price for a listing, or MISSING."""
+        now = time.monotonic()
+        with self._lock:
+            self._check_model(version, model)
+
+            cached = self._entries.get((version, key))
+            if cached is not None:
+                price, expires = cached
+                if expires > now:
+                    self._entries.move_to_end((version, key))
+                    self.hits += 1
+                    return price
+
+                del self._entries[(version, key)]
+                self.expired += 1
+
+            self.misses += 1
+            return MISSING
+
+    def put(self, version, model, key, price):
+        """Stores the price of a listing predicted by model."""
+        with self._lock:
+            self._check_model(version, model)
+
+            self._entries[(version, key)] = (price, time.monotonic() + self.ttl)
+            self._entries.move_to_end((version, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._models.clear()
+
+    def stats(self):
+        """Hit and miss counts and the current size of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "invalidations": self.invalidations,
+        }
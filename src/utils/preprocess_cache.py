@@ -0,0 +1,73 @@
+"""
+Cache for the processed splits so preprocess.py can skip cleaning when nothing has changed.
+
+The cache key is a hash of the raw file contents, the cleaning settings and the source of the
+cleaning code. It is written to cache_key.json next to the processed files, so it is versioned
+together with them by dvc.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = "cache_key.json"
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """sha256 of a file, read in blocks so large files are not loaded into memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def preprocess_cache_key(raw_path, config, code_files=()):
+    """
+    Builds the cache key for a raw file and the cleaning settings.
+    Returns the key and the record that is stored next to the processed files.
+    """
+    record = {
+        "raw_file": os.path.abspath(raw_path),
+        "raw_sha256": file_digest(raw_path),
+        "config": config,
+        "code_sha256": {os.path.basename(path): file_digest(path) for path in code_files},
+    }
+
+    key = hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+    return key, record
+
+
+def cache_is_valid(folder, key, file_names):
+    """True if folder holds every processed file and they were made with this cache key."""
+    cache_path = os.path.join(folder, CACHE_FILE)
+    if not os.path.exists(cache_path):
+        return False
+
+    with open(cache_path, "r") as file:
+        try:
+            stored = json.load(file)
+        except ValueError:
+            return False
+
+    if stored.get("key") != key:
+        logger.info("Processed data was made from a different raw file or settings")
+        return False
+
+    missing = [name for name in file_names if not os.path.exists(os.path.join(folder, name))]
+    if missing:
+        logger.info(f"Processed files missing: {missing}")
+        return False
+
+    return True
+
+
+def write_cache_key(folder, key, record, file_names):
+    """Records the cache key of the processed files that were just written."""
+    record = dict(record, key=key, files=list(file_names), created=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+    with open(os.path.join(folder, CACHE_FILE), "w") as file:
+        json.dump(record, file, indent=2, sort_keys=True, default=str)
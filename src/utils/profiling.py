@@ -0,0 +1,283 @@
+"""
+Opt-in profiling of the pipeline stages.
+
+Code marks its stages and sub-steps with `with stage("read"):`. Outside of profiling that is a
+no-op. While a Profiler is started, every stage records its wall time, CPU time of this process
+and of the worker processes that finished during it, and its peak resident memory, nested under
+the stage it runs in (preprocess/clean/dedup). Stages that run many times, like the chunks of a
+streaming pass, are added up under one name.
+
+On Linux the peak memory of each stage is measured on its own by resetting the kernel's high water
+mark (VmHWM) when the stage starts. Elsewhere it is the peak of the process so far. The reset also
+clears ru_maxrss, so the profiler keeps the peak of the whole process and peak_rss_mb() reports it.
+
+Top level stages can also be dumped with cProfile (<stage>.prof, open with snakeviz or pstats) and
+tracemalloc (<stage>.tracemalloc.txt, the lines holding the most memory when the stage ends, and the
+Python-level peak of every stage in the summary).
+"""
+import contextlib
+import json
+import logging
+import os
+import resource
+import time
+
+logger = logging.getLogger(__name__)
+
+# Kinds of dumps that can be written for every top level stage
+DUMPS = ['cprofile', 'tracemalloc']
+
+# Allocation sites listed in a tracemalloc dump
+TRACEMALLOC_TOP = 25
+
+# Writing 5 to this file resets the peak resident memory (VmHWM) of the process
+CLEAR_REFS = '/proc/self/clear_refs'
+PROC_STATUS = '/proc/self/status'
+
+# Profiler of this process while one is started, set by Profiler.start
+_active = None
+
+
+def _peak_rss_mb():
+    """Peak resident memory of the process in MB, since the last reset where that is supported."""
+    try:
+        with open(PROC_STATUS, 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, including what a started Profiler reset per stage."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if _active is not None:
+        peak = max(peak, _active.process_peak_rss_mb, _peak_rss_mb())
+    return peak
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _Frame:
+    """A stage that is running."""
+
+    def __init__(self, path):
+        self.path = path
+        self.peak_rss_mb = 0.0
+        self.peak_traced_mb = 0.0
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.children_cpu = _children_cpu()
+
+
+class Profiler:
+    """
+    Collects the timings of every stage run while it is started.
+    dumps is a list of DUMPS written to folder for every top level stage.
+    """
+
+    def __init__(self, dumps=(), folder='profiles'):
+        unknown = [dump for dump in dumps if dump not in DUMPS]
+        if unknown:
+            raise ValueError(f"Unknown profile dumps {unknown}, expected some of {DUMPS}")
+
+        self.dumps = list(dumps)
+        self.folder = folder
+        self.stages = {}
+        self.files = []
+        self._stack = []
+        self._can_reset = os.access(CLEAR_REFS, os.W_OK)
+
+        # Peak of the whole process, which resetting the kernel's counter would otherwise lose
+        self.process_peak_rss_mb = 0.0
+
+    def start(self):
+        """Makes this the profiler every stage() reports to."""
+        global _active
+
+        if self.dumps:
+            os.makedirs(self.folder, exist_ok=True)
+        if 'tracemalloc' in self.dumps:
+            import tracemalloc
+
+            tracemalloc.start()
+
+        self.process_peak_rss_mb = max(self.process_peak_rss_mb, _peak_rss_mb())
+        _active = self
+        return self
+
+    def stop(self):
+        global _active
+
+        if 'tracemalloc' in self.dumps:
+            import tracemalloc
+
+            tracemalloc.stop()
+        _active = None
+
+    def _reset_peaks(self):
+        """Starts a new peak memory measurement, after folding the peak so far into the running stages."""
+        rss = _peak_rss_mb()
+        traced = self._traced_peak_mb()
+        self.process_peak_rss_mb = max(self.process_peak_rss_mb, rss)
+        for frame in self._stack:
+            frame.peak_rss_mb = max(frame.peak_rss_mb, rss)
+            frame.peak_traced_mb = max(frame.peak_traced_mb, traced)
+
+        if self._can_reset:
+            try:
+                with open(CLEAR_REFS, 'w') as file:
+                    file.write('5')
+            except OSError:
+                self._can_reset = False
+        if 'tracemalloc' in self.dumps:
+            import tracemalloc
+
+            tracemalloc.reset_peak()
+
+    def _traced_peak_mb(self):
+        if 'tracemalloc' not in self.dumps:
+            return 0.0
+        import tracemalloc
+
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        path = f"{self._stack[-1].path}/{name}" if self._stack else name
+        top_level = not self._stack
+
+        # Registered on entry, so stages are listed before their sub-steps
+        self.stages.setdefault(path, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'children_cpu_s': 0.0, 'peak_rss_mb': 0.0})
+
+        self._reset_peaks()
+        frame = _Frame(path)
+        self._stack.append(frame)
+
+        # Only one cProfile profiler can run at a time, so only top level stages get one
+        cprofile = None
+        if top_level and 'cprofile' in self.dumps:
+            import cProfile
+
+            cprofile = cProfile.Profile()
+            cprofile.enable()
+
+        try:
+            yield
+        finally:
+            if cprofile is not None:
+                cprofile.disable()
+
+            wall = time.perf_counter() - frame.wall
+            cpu = time.process_time() - frame.cpu
+            children_cpu = _children_cpu() - frame.children_cpu
+            self._stack.pop()
+
+            # The peak of this stage also counts for the stages it runs in
+            frame.peak_rss_mb = max(frame.peak_rss_mb, _peak_rss_mb())
+            frame.peak_traced_mb = max(frame.peak_traced_mb, self._traced_peak_mb())
+            for parent in self._stack:
+                parent.peak_rss_mb = max(parent.peak_rss_mb, frame.peak_rss_mb)
+                parent.peak_traced_mb = max(parent.peak_traced_mb, frame.peak_traced_mb)
+
+            self._record(frame, wall, cpu, children_cpu)
+            if top_level:
+                self._dump(name, cprofile)
+
+    def _record(self, frame, wall, cpu, children_cpu):
+        stats = self.stages[frame.path]
+        stats['calls'] += 1
+        stats['wall_s'] += wall
+        stats['cpu_s'] += cpu
+        stats['children_cpu_s'] += children_cpu
+        stats['peak_rss_mb'] = max(stats['peak_rss_mb'], frame.peak_rss_mb)
+        if 'tracemalloc' in self.dumps:
+            stats['peak_traced_mb'] = max(stats.get('peak_traced_mb', 0.0), frame.peak_traced_mb)
+
+    def _dump(self, name, cprofile):
+        if cprofile is not None:
+            path = os.path.join(self.folder, f"{name}.prof")
+            cprofile.dump_stats(path)
+            self.files.append(path)
+            logger.info(f"Wrote the cProfile of {name} to {path}")
+
+        if 'tracemalloc' in self.dumps:
+            import tracemalloc
+
+            path = os.path.join(self.folder, f"{name}.tracemalloc.txt")
+            top = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP]
+            with open(path, 'w') as file:
+                file.write(f"Memory still allocated after {name}, largest first\n")
+                file.write("\n".join(str(statistic) for statistic in top) + "\n")
+            self.files.append(path)
+            logger.info(f"Wrote the tracemalloc top allocations of {name} to {path}")
+
+    def summary(self):
+        """Stage path -> calls, wall_s, cpu_s, children_cpu_s and peak_rss_mb, in the order the stages started."""
+        return {path: dict(stats) for path, stats in self.stages.items()}
+
+    def table(self):
+        """The summary as a text table, sub-steps indented under their stage."""
+        lines = [f"{'stage':<36} {'calls':>6} {'wall s':>9} {'cpu s':>9} {'workers cpu s':>14} {'peak MB':>9}"]
+        for path, stats in self.stages.items():
+            depth = path.count('/')
+            name = '  ' * depth + path.rsplit('/', 1)[-1]
+            lines.append(f"{name:<36} {stats['calls']:>6} {stats['wall_s']:>9.3f} {stats['cpu_s']:>9.3f} "
+                         f"{stats['children_cpu_s']:>14.3f} {stats['peak_rss_mb']:>9.1f}")
+        return "\n".join(lines)
+
+    def log_to_mlflow(self, run_id):
+        """Logs the summary as profile/stages.json and profile/stages.txt and every stage's totals as metrics."""
+        import mlflow
+
+        metrics = {}
+        for path, stats in self.stages.items():
+            for key in ('wall_s', 'cpu_s', 'children_cpu_s', 'peak_rss_mb'):
+                metrics[f"profile/{path}/{key}"] = stats[key]
+
+        with mlflow.start_run(run_id=run_id):
+            mlflow.log_metrics(metrics)
+            mlflow.log_dict(self.summary(), "profile/stages.json")
+            mlflow.log_text(self.table(), "profile/stages.txt")
+            for path in self.files:
+                mlflow.log_artifact(path, "profile")
+
+    def report(self, run_id=None):
+        """Prints the table, writes the summary to the dump folder and logs it to the mlflow run, when given."""
+        print(self.table())
+
+        if self.dumps:
+            path = os.path.join(self.folder, "stages.json")
+            with open(path, 'w') as file:
+                json.dump(self.summary(), file, indent=2)
+            logger.info(f"Wrote the stage timings to {path}")
+
+        if run_id:
+            try:
+                self.log_to_mlflow(run_id)
+            except Exception as e:
+                logger.error(f"Logging the profile to run {run_id} failed with error: {str(e)}")
+
+
+def stage(name):
+    """Marks a stage or sub-step of the pipeline. Only measured while a Profiler is started."""
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name)
+
+
+def iterate(name, iterable):
+    """Yields the items of iterable, measuring the time to produce each one as the stage name."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
@@ -0,0 +1,186 @@
+"""
+Bulk re-pricing of a raw listing dump with several model versions at once.
+
+The dump is read in chunks with only the id and model columns. Worker processes clean, encode
+and score every chunk with every version, and the prices are appended to a Parquet (or CSV)
+file next to the listing ids, in the order of the dump. At most two chunks per worker are in
+flight, so memory stays bounded however big the dump is.
+"""
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pandas as pd
+
+from utils.chunked_preprocess import peak_rss_mb
+from utils.cleaning import X_COLUMNS, clean_for_scoring, fill_values
+from utils.feature_encoder import CATEGORICAL_COLUMNS, NUMERIC_COLUMNS, FeatureEncoder
+from utils.linear_model import LinearModel, as_linear_model
+
+logger = logging.getLogger(__name__)
+
+# Columns copied from the dump to the output to identify every listing
+ID_COLUMNS = ['listing_id', 'vin']
+
+# Listings that are still for sale have no drop off date
+ACTIVE_COLUMN = 'listing_dropoff_date'
+
+# Output file formats
+OUTPUT_FORMATS = {'.parquet': 'parquet', '.csv': 'csv'}
+
+
+def scoring_fill_values(X_train):
+    """Means and modes of the model columns of the train split, used to fill missing values."""
+    return fill_values(X_train,
+                       [column for column in X_COLUMNS if column in NUMERIC_COLUMNS],
+                       [column for column in X_COLUMNS if column in CATEGORICAL_COLUMNS])
+
+
+def read_listings(file_path, chunksize=100000, active_only=False):
+    """
+    Reads the dump in chunks with the id columns it has and the model columns.
+    With active_only, listings that have a drop off date are skipped.
+    """
+    header = pd.read_csv(file_path, nrows=0).columns
+    columns = [column for column in ID_COLUMNS if column in header] + X_COLUMNS
+    if active_only:
+        columns.append(ACTIVE_COLUMN)
+
+    dtypes = {column: 'float64' if column in NUMERIC_COLUMNS else 'str' for column in columns}
+    for chunk in pd.read_csv(file_path, usecols=columns, dtype=dtypes, chunksize=chunksize):
+        if active_only:
+            chunk = chunk[chunk[ACTIVE_COLUMN].isna()].drop(columns=ACTIVE_COLUMN)
+        yield chunk
+
+
+class PriceWriter:
+    """Appends chunks of prices to a Parquet or CSV file."""
+
+    def __init__(self, path):
+        extension = os.path.splitext(path)[1]
+        if extension not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {extension}, expected one of {list(OUTPUT_FORMATS)}")
+
+        self.path = path
+        self.data_format = OUTPUT_FORMATS[extension]
+        self._writer = None
+        self._header = True
+
+        if os.path.exists(path):
+            os.remove(path)
+
+    def write(self, frame):
+        if self.data_format == 'csv':
+            frame.to_csv(self.path, mode='a', header=self._header, index=False)
+            self._header = False
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, pa.Schema.from_pandas(frame, preserve_index=False))
+        self._writer.write_table(pa.Table.from_pandas(frame, schema=self._writer.schema, preserve_index=False))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+# Models and fill values of the current worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(models, values, encoders=None):
+    scorers = {}
+    for version, model in models.items():
+        encoder = (encoders or {}).get(version) or FeatureEncoder.from_model(model)
+        scorers[version] = (as_linear_model(model), encoder)
+    _worker.update(scorers=scorers, values=values)
+
+
+def score_chunk(chunk):
+    """Cleans and encodes one chunk and scores it with every version. Returns price column -> prices."""
+    df = clean_for_scoring(chunk, _worker['values'])
+
+    # Versions trained on the same features share one encoded matrix
+    encoded = {}
+    prices = {}
+    for version, (model, encoder) in _worker['scorers'].items():
+        key = tuple(encoder.feature_names)
+        if key not in encoded:
+            encoded[key] = encoder.encode_frame(df)
+        X = encoded[key]
+
+        if isinstance(model, LinearModel):
+            prices[f'price_{version}'] = model.predict(X)
+        else:
+            prices[f'price_{version}'] = model.predict(encoder.to_frame(X))
+    return prices
+
+
+def reprice(input_path, output_path, models, values, chunksize=100000, workers=0, active_only=False, encoders=None):
+    """
+    Prices every listing of the dump at input_path with every model in models (version -> model)
+    and writes the ids and one price_<version> column per version to output_path.
+    values are the fill values of scoring_fill_values and encoders (version -> FeatureEncoder) the
+    encoders the models were trained with, rebuilt from their feature names when missing. workers=0 uses every core, workers=1
+    scores in this process. Returns the rows scored, the time taken and rows per second.
+    """
+    workers = workers or os.cpu_count() or 1
+    writer = PriceWriter(output_path)
+    rows = 0
+    start = time.perf_counter()
+
+    def write(ids, prices):
+        nonlocal rows
+        frame = ids.reset_index(drop=True)
+        for column, price in prices.items():
+            frame[column] = price
+        writer.write(frame)
+        rows += len(frame)
+
+    chunks = read_listings(input_path, chunksize, active_only)
+    id_columns = None
+
+    try:
+        if workers == 1:
+            _init_worker(models, values, encoders)
+            for chunk in chunks:
+                id_columns = id_columns or [column for column in chunk.columns if column in ID_COLUMNS]
+                write(chunk[id_columns], score_chunk(chunk[X_COLUMNS]))
+
+        else:
+            logger.info(f"Re-pricing {input_path} with {list(models)} in chunks of {chunksize} rows with {workers} workers")
+
+            # Chunks are written in the order they were read, so the output lines up with the dump
+            with ProcessPoolExecutor(workers, mp_context=get_context('fork'), initializer=_init_worker,
+                                     initargs=(models, values, encoders)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    id_columns = id_columns or [column for column in chunk.columns if column in ID_COLUMNS]
+                    pending.append((chunk[id_columns], pool.submit(score_chunk, chunk[X_COLUMNS])))
+                    if len(pending) >= 2 * workers:
+                        ids, future = pending.popleft()
+                        write(ids, future.result())
+
+                while pending:
+                    ids, future = pending.popleft()
+                    write(ids, future.result())
+    finally:
+        writer.close()
+
+    seconds = time.perf_counter() - start
+    summary = {
+        'rows': rows,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    logger.info(f"Re-pricing finished: {summary}")
+
+    return summary
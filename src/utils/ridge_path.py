@@ -0,0 +1,67 @@
+"""
+Ridge regularization path: the coefficients for many alphas from one decomposition.
+
+The centered design matrix and prices are reduced with one QR decomposition of [X y], and the small
+R factor of X is split with an SVD, R = U diag(s) V'. The Ridge solution for any alpha is then
+V diag(s / (s^2 + alpha)) U' Q'y, so after the one pass over the rows every extra alpha only costs a
+few tiny matrix products. This stays as accurate as sklearn's svd solver even with mileage in the
+hundred thousands next to one-hot columns, which an eigendecomposition of X'X does not.
+"""
+import numpy as np
+from scipy import linalg
+
+
+def alpha_grid(low=0.001, high=1000.0, num=100):
+    """num alphas spaced evenly on a log scale from low to high."""
+    return np.logspace(np.log10(low), np.log10(high), int(num))
+
+
+def ridge_path(X, y, alphas, fit_intercept=True):
+    """
+    Solves Ridge for every alpha at once.
+    Returns coefs with one row per alpha and the matching intercepts, the same values
+    sklearn's Ridge gives for each alpha.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).ravel()
+    alphas = np.asarray(alphas, dtype=np.float64)
+
+    n_features = X.shape[1]
+    if fit_intercept:
+        X_mean = X.mean(axis=0)
+        y_mean = y.mean()
+    else:
+        X_mean = np.zeros(n_features)
+        y_mean = 0.0
+
+    # R of [X - X_mean, y - y_mean]: its last column holds Q'y, so Q is never stored
+    Xy = np.empty((len(X), n_features + 1))
+    np.subtract(X, X_mean, out=Xy[:, :n_features])
+    np.subtract(y, y_mean, out=Xy[:, n_features])
+    R = linalg.qr(Xy, mode='r', overwrite_a=True, check_finite=False)[0]
+
+    U, s, Vt = np.linalg.svd(R[:n_features, :n_features])
+    Uty = U.T @ R[:n_features, n_features]
+
+    # Row i of shrunk is Uty * s / (s^2 + alphas[i])
+    shrunk = Uty * s / (s ** 2 + alphas[:, None])
+    coefs = shrunk @ Vt
+    intercepts = y_mean - coefs @ X_mean
+
+    return coefs, intercepts
+
+
+def path_scores(X, y, coefs, intercepts):
+    """r2, rmse and mae of every alpha on a validation set, from one matrix product."""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).ravel()
+
+    errors = X @ coefs.T + intercepts - y[:, None]
+    sse = np.einsum('ij,ij->j', errors, errors)
+    sst = np.sum((y - y.mean()) ** 2)
+
+    return {
+        'val_r2': 1.0 - sse / sst,
+        'val_rmse': np.sqrt(sse / len(y)),
+        'val_mae': np.abs(errors).mean(axis=0),
+    }
@@ -0,0 +1,185 @@
+"""
+Segmented training: one Ridge model per make (or per group of makes) and a global model.
+
+The encoded training matrix is copied once into shared memory, like the sweep, and every
+segment model is fitted in a worker process on the rows of its segment. Makes with too few
+rows get no model of their own and are priced by the global model.
+"""
+import logging
+import os
+import sys
+import time
+from multiprocessing import get_context
+
+import numpy as np
+from sklearn.linear_model import Ridge
+
+from utils.linear_model import SegmentedModel
+from utils.sweep import SharedArray, attach, holdout_split
+
+logger = logging.getLogger(__name__)
+
+# Name of the model fitted on every row
+GLOBAL_SEGMENT = '__global__'
+
+
+def make_columns(feature_names):
+    """Positions and makes of the make one-hot columns."""
+    return [(position, str(name)[len('make_'):]) for position, name in enumerate(feature_names)
+            if str(name).startswith('make_')]
+
+
+def make_segments(make_counts, min_rows=500, groups=None):
+    """
+    Picks the segments to fit. Returns a dict of segment name -> list of makes.
+
+    groups maps a segment name to the makes fitted together, every other make is its own segment.
+    Segments with fewer than min_rows training rows are left to the global model.
+    """
+    groups = groups or {}
+    grouped = {make for makes in groups.values() for make in makes}
+
+    segments = {name: [make for make in makes if make in make_counts] for name, makes in groups.items()}
+    segments.update({make: [make] for make in make_counts if make not in grouped})
+
+    return {name: makes for name, makes in segments.items()
+            if makes and sum(make_counts[make] for make in makes) >= min_rows}
+
+
+def segment_of_rows(X, feature_names, segments):
+    """Index into the segment list for every row of the encoded matrix, -1 for rows left to the global model."""
+    make_segment = {make: index for index, makes in enumerate(segments.values()) for make in makes}
+
+    rows = np.full(len(X), -1, dtype=np.intp)
+    for position, make in make_columns(feature_names):
+        if make in make_segment:
+            rows[X[:, position] > 0] = make_segment[make]
+    return rows
+
+
+# Shared data of the current worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(X_spec, y_spec, params):
+    # Forked workers inherit mlflow autolog, but the bundle is logged by the parent process
+    if 'mlflow' in sys.modules:
+        import mlflow.sklearn
+        mlflow.sklearn.autolog(disable=True)
+
+    X_shm, X = attach(X_spec)
+    y_shm, y = attach(y_spec)
+    _worker.update(blocks=(X_shm, y_shm), X=X, y=y, params=params)
+
+
+def fit_segment(task):
+    """Fits the Ridge of one segment on its rows of the shared matrix. Returns its coefficients."""
+    key, rows = task
+    X, y = _worker['X'], _worker['y']
+    if rows is not None:
+        X, y = X[rows], y[rows]
+
+    start = time.perf_counter()
+    model = Ridge(**_worker['params']).fit(X, y)
+    return key, np.ravel(model.coef_), float(np.ravel(model.intercept_)[0]), time.perf_counter() - start
+
+
+def fit_segment_models(X, y, row_sets, params, workers=0):
+    """
+    Fits a Ridge with params on each set of rows in a process pool.
+    row_sets maps a key to the row indices to fit on, or None for every row.
+    Returns key -> (coef, intercept, fit seconds).
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).ravel()
+
+    # Biggest segments first so one large fit does not start last
+    tasks = sorted(row_sets.items(), key=lambda item: len(X) if item[1] is None else len(item[1]), reverse=True)
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    X_shared = SharedArray(X.shape)
+    y_shared = SharedArray(y.shape)
+    try:
+        X_shared.array[:] = X
+        y_shared.array[:] = y
+
+        logger.info(f"Fitting {len(tasks)} segment models with {workers} workers")
+
+        results = {}
+        with get_context('fork').Pool(workers, initializer=_init_worker,
+                                      initargs=(X_shared.spec, y_shared.spec, params)) as pool:
+            for key, coef, intercept, fit_seconds in pool.imap_unordered(fit_segment, tasks):
+                results[key] = (coef, intercept, fit_seconds)
+    finally:
+        X_shared.close()
+        y_shared.close()
+
+    return results
+
+
+def bundle(feature_names, segments, fits, stage):
+    """Builds the SegmentedModel from the fits of one stage of fit_segmented."""
+    global_coef, global_intercept, _ = fits[(stage, GLOBAL_SEGMENT)]
+    names = list(segments)
+
+    coefs = np.array([fits[(stage, name)][0] for name in names]).reshape(len(names), len(feature_names))
+    intercepts = np.array([fits[(stage, name)][1] for name in names])
+    make_rows = {make: row for row, name in enumerate(names) for make in segments[name]}
+
+    return SegmentedModel(global_coef, global_intercept, feature_names, names, coefs, intercepts, make_rows)
+
+
+def r2(y, y_pred):
+    """Coefficient of determination of the predictions."""
+    return 1.0 - float(np.sum((y - y_pred) ** 2)) / float(np.sum((y - y.mean()) ** 2))
+
+
+def fit_segmented(X, y, feature_names, params, min_rows=500, groups=None, workers=0, validation_size=0.2,
+                  random_state=42):
+    """
+    Fits the global model and one model per segment, all in one process pool, and bundles them.
+
+    With a validation_size the bundle and the global model are also fitted on a seeded share of
+    the rows and scored on the rest, so the gain of segmenting can be checked. Returns the bundle
+    fitted on every row, the segments (name -> makes) and the validation metrics.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).ravel()
+    feature_names = [str(name) for name in feature_names]
+
+    make_counts = {make: int(np.count_nonzero(X[:, position])) for position, make in make_columns(feature_names)}
+    segments = make_segments(make_counts, min_rows, groups)
+    rows = segment_of_rows(X, feature_names, segments)
+
+    stages = {'all': np.arange(len(X))}
+    if validation_size:
+        order, n_fit = holdout_split(len(X), validation_size, random_state)
+        stages['fit'] = np.sort(order[:n_fit])
+        val_rows = np.sort(order[n_fit:])
+
+    # Every stage fits the global model and every segment on its own rows
+    row_sets = {}
+    for stage, stage_rows in stages.items():
+        row_sets[(stage, GLOBAL_SEGMENT)] = None if stage == 'all' else stage_rows
+        stage_segments = rows[stage_rows]
+        for index, name in enumerate(segments):
+            row_sets[(stage, name)] = stage_rows[stage_segments == index]
+
+    # A segment whose rows all went to validation falls back to the global model
+    for (stage, name), segment_rows in list(row_sets.items()):
+        if segment_rows is not None and len(segment_rows) == 0:
+            row_sets.pop((stage, name))
+
+    start = time.perf_counter()
+    fits = fit_segment_models(X, y, row_sets, params, workers)
+    metrics = {'segments': len(segments), 'segment_fit_seconds': time.perf_counter() - start,
+               'segment_rows': int(np.count_nonzero(rows >= 0)), 'global_rows': int(np.count_nonzero(rows < 0))}
+
+    if validation_size:
+        fit_segments = {name: makes for name, makes in segments.items() if ('fit', name) in fits}
+        holdout_model = bundle(feature_names, fit_segments, fits, 'fit')
+        X_val, y_val = X[val_rows], y[val_rows]
+        metrics['val_r2_segmented'] = r2(y_val, holdout_model.predict(X_val))
+        metrics['val_r2_global'] = r2(y_val, X_val @ holdout_model.coef_ + holdout_model.intercept_)
+
+    return bundle(feature_names, segments, fits, 'all'), segments, metrics
@@ -0,0 +1,310 @@
+"""
+Shadow scoring of live traffic.
+
+A sampled share of the listings a primary model version priced is handed to a background
+thread, which scores them again with a shadow version and keeps running totals of the price
+differences, overall and per make. A request only pays for a random draw and a non-blocking
+queue put; when the queue is full the listing is dropped instead of slowing the request down.
+
+Under serve.py every worker only sees its share of the traffic, so after share() each worker
+publishes its raw sums to a folder all workers can read and stats() merges them. A reset bumps a
+generation number in that folder: sums of older generations are ignored straight away, and every
+worker clears its own totals the next time it publishes.
+"""
+import glob
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue to stop the thread
+_STOP = object()
+
+# Seconds between the sums a worker publishes when shadow stats are shared between workers
+SHADOW_PUBLISH_SECONDS = float(os.environ.get("SHADOW_PUBLISH_SECONDS", 1.0))
+
+# File in the shared folder holding the generation of the totals, bumped by every reset
+GENERATION_FILE = "shadow-generation"
+
+
+class DeltaStats:
+    """Running sums of the differences between shadow and primary prices."""
+
+    FIELDS = ('count', 'sum_delta', 'sum_abs_delta', 'sum_squared_delta', 'sum_abs_pct_delta', 'max_abs_delta')
+
+    def __init__(self):
+        self.count = 0
+        self.sum_delta = 0.0
+        self.sum_abs_delta = 0.0
+        self.sum_squared_delta = 0.0
+        self.sum_abs_pct_delta = 0.0
+        self.max_abs_delta = 0.0
+
+    def sums(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def merge(self, sums):
+        """Adds the sums of another DeltaStats, e.g. of another worker."""
+        for field in self.FIELDS:
+            if field == 'max_abs_delta':
+                self.max_abs_delta = max(self.max_abs_delta, sums[field])
+            else:
+                setattr(self, field, getattr(self, field) + sums[field])
+        return self
+
+    def add(self, primary, shadow):
+        delta = shadow - primary
+        self.count += 1
+        self.sum_delta += delta
+        self.sum_abs_delta += abs(delta)
+        self.sum_squared_delta += delta * delta
+        self.max_abs_delta = max(self.max_abs_delta, abs(delta))
+        if primary:
+            self.sum_abs_pct_delta += abs(delta) / abs(primary)
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_delta": self.sum_delta / self.count,
+            "mean_abs_delta": self.sum_abs_delta / self.count,
+            "rmse_delta": (self.sum_squared_delta / self.count) ** 0.5,
+            "max_abs_delta": self.max_abs_delta,
+            "mean_abs_pct_delta": self.sum_abs_pct_delta / self.count * 100,
+        }
+
+
+class ShadowScorer:
+    """
+    Scores a sample of the primary versions' traffic with their shadow versions in the background.
+
+    pairs maps a primary version to its shadow version. score_batch(version, listings) must return
+    one result per listing, either a price or an Exception, like the micro-batcher's.
+    """
+
+    def __init__(self, score_batch, pairs, sample_rate=0.1, max_queue=10000, max_batch_size=256):
+        self.score_batch = score_batch
+        self.pairs = dict(pairs)
+        self.sample_rate = sample_rate
+        self.max_batch_size = max_batch_size
+
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset()
+
+        # Shared folder, generation of the totals and when they were last published, set by share()
+        self.folder = None
+        self.generation = 0
+        self._published = 0.0
+
+    def _reset(self):
+        self._totals = {primary: DeltaStats() for primary in self.pairs}
+        self._by_make = {primary: {} for primary in self.pairs}
+        self._counters = {primary: {"sampled": 0, "dropped": 0, "errors": 0} for primary in self.pairs}
+
+    def start(self):
+        """Starts the scoring thread if it is not running yet."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+            self._thread.start()
+
+            logger.info(f"Shadow scoring {self.sample_rate:.0%} of {self.pairs}")
+
+    def stop(self):
+        """Scores what is queued and stops the scoring thread."""
+        with self._start_lock:
+            if self._thread is None:
+                return
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def offer(self, version, listing, price):
+        """
+        Queues a listing the primary version priced for shadow scoring if it is drawn in the sample.
+        Returns whether it was queued.
+        """
+        if version not in self.pairs or random.random() >= self.sample_rate:
+            return False
+
+        counters = self._counters[version]
+        try:
+            self._queue.put_nowait((version, listing, price))
+        except queue.Full:
+            counters["dropped"] += 1
+            return False
+
+        counters["sampled"] += 1
+        return True
+
+    def share(self, folder):
+        """Publishes this process's sums to folder and merges the sums of every process there in stats()."""
+        self.folder = folder
+        self._publish()
+
+    def _shared_generation(self):
+        try:
+            with open(os.path.join(self.folder, GENERATION_FILE), "r") as file:
+                return int(file.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _raw(self):
+        """Counters and sums of this process for every primary version, with DeltaStats as dicts."""
+        return {
+            primary: {
+                "counters": dict(self._counters[primary]),
+                "totals": self._totals[primary].sums(),
+                "by_make": {make: stats.sums() for make, stats in self._by_make[primary].items()},
+            }
+            for primary in self.pairs
+        }
+
+    def _publish(self):
+        """Writes this process's sums to the shared folder, after clearing them if another worker reset the totals."""
+        generation = self._shared_generation()
+        with self._stats_lock:
+            if generation != self.generation:
+                self._reset()
+                self.generation = generation
+            snapshot = {"generation": generation, "queued": self._queue.qsize(), "pairs": self._raw()}
+
+        path = os.path.join(self.folder, f"shadow-{os.getpid()}.json")
+        with open(path + ".tmp", "w") as file:
+            json.dump(snapshot, file)
+        os.replace(path + ".tmp", path)
+        self._published = time.monotonic()
+
+    def _maybe_publish(self):
+        if self.folder is not None and time.monotonic() - self._published >= SHADOW_PUBLISH_SECONDS:
+            try:
+                self._publish()
+            except OSError as e:
+                logger.error(f"Publishing the shadow stats failed with error: {str(e)}")
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=SHADOW_PUBLISH_SECONDS if self.folder is not None else None)
+            except queue.Empty:
+                self._maybe_publish()
+                continue
+            if item is _STOP:
+                return
+
+            # Everything waiting is scored together, one call per primary version
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._score(batch)
+            self._maybe_publish()
+            if stop:
+                return
+
+    def _score(self, batch):
+        """Scores a batch with the shadow versions and adds the differences to the totals."""
+        by_version = {}
+        for version, listing, price in batch:
+            by_version.setdefault(version, []).append((listing, price))
+
+        for version, items in by_version.items():
+            try:
+                results = self.score_batch(self.pairs[version], [listing for listing, _ in items])
+            except Exception as e:
+                logger.error(f"Shadow scoring with {self.pairs[version]} failed with error: {str(e)}")
+                self._counters[version]["errors"] += len(items)
+                continue
+
+            with self._stats_lock:
+                by_make = self._by_make[version]
+                for (listing, primary), shadow in zip(items, results):
+                    if isinstance(shadow, Exception):
+                        self._counters[version]["errors"] += 1
+                        continue
+                    self._totals[version].add(primary, shadow)
+                    by_make.setdefault(str(listing.get("make")), DeltaStats()).add(primary, shadow)
+
+    def _snapshots(self):
+        """The published snapshots of every process, of the current generation only."""
+        self._publish()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.folder, "shadow-*.json")):
+            try:
+                with open(path, "r") as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if snapshot["generation"] == self.generation:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def stats(self, merged=True):
+        """
+        Sampling counters and price differences (shadow minus primary) for every primary version,
+        of every worker when the stats are shared, or of this process only when merged is False.
+        """
+        if self.folder is None or not merged:
+            with self._stats_lock:
+                snapshots = [{"queued": self._queue.qsize(), "pairs": self._raw()}]
+        else:
+            snapshots = self._snapshots()
+
+        stats = {}
+        for primary, shadow in self.pairs.items():
+            counters = {"sampled": 0, "dropped": 0, "errors": 0}
+            totals = DeltaStats()
+            by_make = {}
+            for snapshot in snapshots:
+                raw = snapshot["pairs"].get(primary)
+                if raw is None:
+                    continue
+                for name in counters:
+                    counters[name] += raw["counters"][name]
+                totals.merge(raw["totals"])
+                for make, sums in raw["by_make"].items():
+                    by_make.setdefault(make, DeltaStats()).merge(sums)
+
+            stats[primary] = {
+                "shadow": shadow,
+                "sample_rate": self.sample_rate,
+                **counters,
+                "queued": sum(snapshot["queued"] for snapshot in snapshots),
+                **totals.summary(),
+                "by_make": {make: make_stats.summary() for make, make_stats in
+                            sorted(by_make.items(), key=lambda item: -item[1].count)},
+            }
+        return stats
+
+    def reset(self):
+        """Clears the totals, of every worker when the stats are shared, for example after a new shadow model was deployed."""
+        if self.folder is None:
+            with self._stats_lock:
+                self._reset()
+            return
+
+        # Every worker sees the new generation and clears its totals when it next publishes
+        path = os.path.join(self.folder, GENERATION_FILE)
+        with open(path + f".{os.getpid()}.tmp", "w") as file:
+            file.write(str(self._shared_generation() + 1))
+        os.replace(path + f".{os.getpid()}.tmp", path)
+        self._publish()
@@ -0,0 +1,169 @@
+"""
+Hyperparameter sweep for the Ridge model.
+
+The encoded training matrix is copied once into shared memory. Worker processes attach to it
+when they start and fit every candidate on views of it, so the matrix is never pickled per
+candidate. A seeded share of the rows is held out to score and rank the candidates.
+"""
+import logging
+import os
+import sys
+import time
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+from scipy import stats
+from sklearn.linear_model import Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+logger = logging.getLogger(__name__)
+
+# Candidates are ranked on this validation metric, higher is better
+RANK_METRIC = 'val_r2'
+
+
+def _distribution(values):
+    """A list of choices, or a scipy distribution for a {low, high, log} range."""
+    if not isinstance(values, dict):
+        return list(values)
+
+    low, high = float(values['low']), float(values['high'])
+    if values.get('log', False):
+        return stats.loguniform(low, high)
+    return stats.uniform(low, high - low)
+
+
+def sweep_candidates(space, search='grid', n_iter=20, random_state=42):
+    """
+    Lists the parameter sets to try.
+
+    space maps a Ridge parameter to a list of values, or for random search to a
+    {low, high, log} range. Grid search tries every combination of the lists,
+    random search draws n_iter sets.
+    """
+    if search == 'grid':
+        ranges = [name for name, values in space.items() if isinstance(values, dict)]
+        if ranges:
+            raise ValueError(f"Grid search needs lists of values, got ranges for {ranges}")
+        return list(ParameterGrid({name: list(values) for name, values in space.items()}))
+
+    if search == 'random':
+        distributions = {name: _distribution(values) for name, values in space.items()}
+        candidates = ParameterSampler(distributions, n_iter=n_iter, random_state=random_state)
+        return [{name: value.item() if isinstance(value, np.generic) else value for name, value in params.items()}
+                for params in candidates]
+
+    raise ValueError(f"Unknown search {search}, use grid or random")
+
+
+class SharedArray:
+    """A NumPy array held in a shared memory block that other processes can attach to."""
+
+    def __init__(self, shape, dtype=np.float64):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @property
+    def spec(self):
+        """What a worker needs to attach to the block."""
+        return self.shm.name, self.shape, self.dtype.str
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach(spec):
+    """Attaches to a SharedArray from its spec. Returns the block and an array view of it."""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+# Shared data of the current worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(X_spec, y_spec, n_fit):
+    # Forked workers inherit mlflow autolog, but candidates are logged by the parent process
+    if 'mlflow' in sys.modules:
+        import mlflow.sklearn
+        mlflow.sklearn.autolog(disable=True)
+
+    X_shm, X = attach(X_spec)
+    y_shm, y = attach(y_spec)
+    _worker.update(blocks=(X_shm, y_shm), X=X, y=y, n_fit=n_fit)
+
+
+def fit_candidate(params):
+    """Fits one candidate on the shared fit rows and scores it on the held out rows."""
+    X, y, n_fit = _worker['X'], _worker['y'], _worker['n_fit']
+
+    start = time.perf_counter()
+    model = Ridge(**params).fit(X[:n_fit], y[:n_fit])
+    fit_seconds = time.perf_counter() - start
+
+    y_val = y[n_fit:]
+    y_pred = model.predict(X[n_fit:])
+
+    metrics = {
+        'val_r2': r2_score(y_val, y_pred),
+        'val_rmse': float(np.sqrt(mean_squared_error(y_val, y_pred))),
+        'val_mae': mean_absolute_error(y_val, y_pred),
+        'fit_seconds': fit_seconds,
+    }
+    return {'params': params, 'metrics': metrics}
+
+
+def holdout_split(n_rows, validation_size=0.2, random_state=42):
+    """
+    A seeded shuffle of the rows and how many of them to fit on.
+    Rows past n_fit in the shuffled order are held out for validation.
+    """
+    n_fit = n_rows - int(round(n_rows * validation_size))
+    if not 0 < n_fit < n_rows:
+        raise ValueError(f"validation_size {validation_size} leaves no rows to fit or to score on")
+
+    return np.random.default_rng(random_state).permutation(n_rows), n_fit
+
+
+def run_sweep(X, y, candidates, workers=0, validation_size=0.2, random_state=42):
+    """
+    Fits every candidate in a process pool and returns the results, best first.
+
+    X is the encoded training matrix and y the prices. The rows are shuffled once into shared
+    memory; the last validation_size of them score the candidates. workers=0 uses every core.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).ravel()
+
+    order, n_fit = holdout_split(len(X), validation_size, random_state)
+    workers = min(workers or os.cpu_count() or 1, len(candidates))
+
+    X_shared = SharedArray(X.shape)
+    y_shared = SharedArray(y.shape)
+    try:
+        np.take(X, order, axis=0, out=X_shared.array)
+        np.take(y, order, out=y_shared.array)
+
+        logger.info(f"Sweeping {len(candidates)} candidates on {n_fit} rows with {workers} workers")
+
+        # fork starts the workers from this process, so they attach to the shared blocks with sklearn already imported
+        context = get_context('fork')
+        results = []
+        with context.Pool(workers, initializer=_init_worker,
+                          initargs=(X_shared.spec, y_shared.spec, n_fit)) as pool:
+            for result in pool.imap_unordered(fit_candidate, candidates):
+                logger.info(f"{result['params']} {RANK_METRIC}={result['metrics'][RANK_METRIC]:.4f}")
+                results.append(result)
+    finally:
+        X_shared.close()
+        y_shared.close()
+
+    results.sort(key=lambda result: result['metrics'][RANK_METRIC], reverse=True)
+    return results